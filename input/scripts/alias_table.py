@@ -0,0 +1,73 @@
+import re
+
+class alias_table(object):
+  # FSH aliases keyed by name, e.g.
+  #   Alias: $SGActor = http://smart.who.int/base/StructureDefinition/SGActor
+  # is stored as '$SGActor' -> 'http://smart.who.int/base/StructureDefinition/SGActor'.
+  # The first definition of a name wins; a later definition of the same name
+  # with a different value is reported as a conflict and ignored.
+
+  alias_pattern = re.compile(r'^\s*Alias:\s*(\S+)\s*=\s*(\S+)\s*$')
+
+  def __init__(self):
+    self.aliases = {}     # name -> value, in the order the names were added
+    self.conflicts = []   # (name, value kept, value ignored)
+
+  def parse_line(self,line:str):
+    # returns (name, value) for an alias definition, None for anything else
+    match = self.alias_pattern.match(line)
+    if not match:
+      return None
+    return (match.group(1),match.group(2))
+
+  def add(self,name:str,value:str):
+    # returns False if name is already defined with a different value
+    if name in self.aliases:
+      if self.aliases[name] != value:
+        self.conflicts.append((name,self.aliases[name],value))
+        return False
+      return True
+    self.aliases[name] = value
+    return True
+
+  def add_lines(self,lines):
+    for line in lines:
+      alias = self.parse_line(line)
+      if alias is not None:
+        self.add(*alias)
+
+  def update(self,aliases:dict):
+    for name,value in aliases.items():
+      self.add(name,value)
+
+  def resolve(self,name:str):
+    # value of an alias such as '$SGActor', or None when it is not defined
+    return self.aliases.get(name)
+
+  def get_aliases(self):
+    return dict(self.aliases)
+
+  def get_conflicts(self):
+    return list(self.conflicts)
+
+  def render(self,content:str = ""):
+    # the content of an alias file with all aliases of this table: the
+    # existing content is kept as is, aliases it does not define yet are
+    # appended sorted by name so that the file does not change between runs.
+    # Aliases the existing content defines differently are recorded as
+    # conflicts, the existing definition is kept.
+    defined = alias_table()
+    defined.add_lines(content.splitlines())
+    missing = []
+    for name,value in self.aliases.items():
+      existing = defined.resolve(name)
+      if existing is None:
+        missing.append(name)
+      elif existing != value:
+        self.conflicts.append((name,existing,value))
+    if len(missing) == 0:
+      return content
+    lines = ["Alias: " + name + " = " + self.aliases[name] for name in sorted(missing)]
+    if len(content) > 0 and not content.endswith("\n"):
+      content += "\n"
+    return content + "\n".join(lines) + "\n"
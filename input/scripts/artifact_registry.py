@@ -0,0 +1,89 @@
+import json
+import re
+from pathlib import Path
+
+class artifact_registry(object):
+  # Index of the FSH artifacts produced by an extraction: the kind (the
+  # directory under input/fsh), the references to other artifacts found in
+  # the FSH and the workbook location it was generated from, e.g.
+  #   ('plandefinitions','DT.BCG.DT.1') -> refs [('Canonical','DTs.BCG'), ('Canonical','DTO.Vaccinate'), ...]
+  # Together with the instances, profiles, code systems etc. defined in the
+  # static FSH of the IG, the references are resolved in one pass so that
+  # dangling ones are reported before SUSHI and the IG Publisher run.
+
+  report_file = "temp/DAKExtract.references.json"
+  reference_pattern = re.compile(r'\b(Canonical|Reference)\(\s*([^)|\s]+)[^)]*\)')
+  link_pattern = re.compile(r'href="([A-Z][A-Za-z]+)-([^"]+?)\.html"')
+  definition_pattern = re.compile(r'^\s*(?:Instance|Profile|Extension|Logical|Resource|CodeSystem|ValueSet|RuleSet|Invariant|Mapping)\s*:\s*(\S+)',re.M)
+  id_pattern = re.compile(r'^\s*Id\s*:\s*(\S+)',re.M)
+
+  def __init__(self):
+    self.artifacts = {}   # (kind, id) -> {'refs': [(type, target)], 'source': ..}
+    self.static = {}      # id or name -> FSH file defining it
+    self.report = None
+
+  def get_references(self,fsh:str):
+    refs = set(self.reference_pattern.findall(fsh))
+    refs.update(("Link",target) for type,target in self.link_pattern.findall(fsh))
+    return sorted(refs)
+
+  def add(self,kind:str,id:str,fsh:str,source = None):
+    # source is where the artifact came from, e.g. {'workbook':..., 'location':'row 12'}
+    self.artifacts[(kind,id)] = {'refs':self.get_references(fsh),'source':source}
+
+  def get_workbook(self,kind:str,id:str):
+    # the workbook an artifact was generated from, or None
+    artifact = self.artifacts.get((kind,id))
+    if artifact is None or not artifact['source']:
+      return None
+    return artifact['source'].get('workbook')
+
+  def add_static(self,file_name:str,fsh:str):
+    for id in self.definition_pattern.findall(fsh) + self.id_pattern.findall(fsh):
+      self.static.setdefault(id,file_name)
+
+  def get_results(self):
+    return self.artifacts
+
+  def merge_results(self,artifacts:dict):
+    self.artifacts.update(artifacts)
+
+  def resolve(self,resolve_alias):
+    # returns the dangling references as a list of
+    # {'kind':..,'id':..,'type':..,'target':..,'source':..}
+    # resolve_alias(name) gives the value of an alias such as $SGActor, or None
+    known = set(id for kind,id in self.artifacts.keys())
+    known.update(self.static.keys())
+    dangling = []
+    count = 0
+    for (kind,id),artifact in sorted(self.artifacts.items()):
+      for type,target in artifact['refs']:
+        count += 1
+        if target in known or "://" in target:
+          continue
+        if target.startswith("$") and resolve_alias(target) is not None:
+          continue
+        dangling.append({'kind':kind,'id':id,'type':type,'target':target,'source':artifact['source']})
+    self.report = {'artifacts':len(self.artifacts),
+                   'static':len(self.static),
+                   'references':count,
+                   'dangling':dangling}
+    return dangling
+
+  def describe(self,reference:dict):
+    text = reference['type'] + "(" + reference['target'] + ") in " + reference['kind'] + "/" + reference['id']
+    source = reference['source']
+    if source:
+      text += " from " + str(source.get('workbook'))
+      if source.get('location'):
+        text += " " + str(source['location'])
+    return text
+
+  def get_summary(self):
+    return "References: " + str(self.report['references']) + " in " + str(self.report['artifacts']) \
+      + " artifact(s), " + str(len(self.report['dangling'])) + " dangling"
+
+  def save(self,file_name:str):
+    Path(file_name).parent.mkdir(exist_ok=True, parents=True)
+    with open(file_name, 'w') as file:
+      json.dump(self.report,file,indent=1)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# Benchmark for the DAK extraction pipeline.
+#
+# Generates synthetic L2 workbooks of a given size in a scratch IG directory,
+# extracts them as extract_dak.py does and reports wall time, peak RSS and
+# the stage timings of the installer's profiler as JSON, e.g.
+#   python input/scripts/benchmark.py --tabs 10 --tables 3 --rules 40 --output bench.json
+
+import contextlib
+import getopt
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import openpyxl
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+
+parameters = {'workbooks':1,   # decision logic workbooks
+              'tabs':5,        # tabs per workbook
+              'tables':2,      # decision tables per tab
+              'rules':20,      # rule rows per decision table
+              'requirements':50, # functional and non-functional requirement rows
+              'repeat':3}
+
+def usage():
+    print("Usage: benchmark the DAK extraction on synthetic workbooks")
+    print("OPTIONS:")
+    print("--workbooks N : number of decision logic workbooks (default " + str(parameters['workbooks']) + ")")
+    print("--tabs N : tabs per decision logic workbook (default " + str(parameters['tabs']) + ")")
+    print("--tables N : decision tables per tab (default " + str(parameters['tables']) + ")")
+    print("--rules N : rule rows per decision table (default " + str(parameters['rules']) + ")")
+    print("--requirements N : functional and non-functional requirement rows (default " + str(parameters['requirements']) + ")")
+    print("--repeat N : number of measured runs (default " + str(parameters['repeat']) + ")")
+    print("--output|o FILE : write the JSON report to FILE instead of stdout")
+    print("--keep DIR : generate the IG in DIR/template and keep it, with the copy each run extracted into")
+    print("--help|h : print this information")
+    sys.exit(2)
+
+
+def write_decision_table(ws,r,c,dt_id,contra,rules):
+    ws.cell(r,c,"Decision ID")
+    ws.cell(r,c+1,dt_id)
+    ws.cell(r+1,c,"Business rule")
+    ws.cell(r+1,c+1,"Determine the recommendation of " + dt_id)
+    ws.cell(r+2,c,"Trigger")
+    ws.cell(r+2,c+1,"BM.B1 Benchmark process step")
+    ws.cell(r+3,c,"Potential contraindications" if contra else "Inputs")
+    ws.cell(r+3,c+3,"Output")
+    ws.cell(r+3,c+4,"Guidance displayed to health worker")
+    ws.cell(r+3,c+5,"Annotations")
+    ws.cell(r+3,c+6,"Reference(s)")
+    row = r + 4
+    if not contra:
+        ws.cell(row,c,"Client's age\nAge of the client in months")
+        ws.cell(row,c+1,"Dose number " + dt_id)
+        ws.cell(row,c+2,"Shared input")
+        row += 1
+    for i in range(rules):
+        ws.cell(row,c,"Age < " + str(i) + " months")
+        ws.cell(row,c+1,"Dose " + str(i) if i % 2 else "-")
+        ws.cell(row,c+2,"Shared input")
+        ws.cell(row,c+3,"Output " + dt_id + " " + str(i % 4) + "\nRecommend step " + str(i % 4))
+        ws.cell(row,c+4,"Guidance " + str(i) + " for the health worker")
+        if i % 3 == 0:
+            ws.cell(row,c+5,"Annotation " + str(i))
+        ws.cell(row,c+6,"WHO reference " + str(i))
+        row += 1
+    return row
+
+
+def write_decision_workbook(file_name,workbook_number,tabs,tables,rules):
+    wb = openpyxl.Workbook()
+    cover = wb.active
+    cover.title = "COVER"
+    cover["A1"] = "Decision-support logic"
+    headers = ["Activity ID.Activity name", "Tab name",
+               "Decision-support table (DT), contraindications table and scheduling-logic table (S) identification (ID)",
+               "Table description", "Reference/source"]
+    for i,header in enumerate(headers):
+        cover.cell(4,i+1,header)
+    cover_row = 5
+    for t in range(tabs):
+        tab = "Tab" + str(t)
+        ws = wb.create_sheet(tab)
+        ws["A1"] = "Decision logic for " + tab
+        row = 3
+        for m in range(tables):
+            dt_id = "BM.D" + str(workbook_number) + ".DT." + tab + "." + str(m)
+            cover.cell(cover_row,1,"BM.D" + str(workbook_number) + ".A" + str(t) + str(m) + " Activity " + dt_id)
+            cover.cell(cover_row,2,tab)
+            cover.cell(cover_row,3,dt_id)
+            cover.cell(cover_row,4,"Description of " + dt_id)
+            cover.cell(cover_row,5,"Benchmark source")
+            cover_row += 1
+            # the last table of every other tab is a contraindications table
+            contra = m == tables - 1 and t % 2 == 1
+            row = write_decision_table(ws,row,2,dt_id,contra,rules) + 3
+    wb.save(file_name)
+
+
+def write_requirements_workbook(file_name,requirements):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Functional"
+    ws["A1"] = "Functional requirements"
+    for i,header in enumerate(["Requirement ID", "Activity ID and name", "As a", "I want to", "So that"]):
+        ws.cell(2,i+1,header)
+    ws.cell(3,1,"Classification of digital health interventions 1.1, 2.3")
+    ws.cell(4,1,"Business process A: Benchmarking")
+    actors = ["Health worker", "Client", "Supervisor"]
+    for k in range(requirements):
+        ws.cell(5+k,1,"BM.FXREQ." + str(k))
+        ws.cell(5+k,2,"BM.A." + str(k) + ".Do step " + str(k))
+        ws.cell(5+k,3,actors[k % len(actors)])
+        ws.cell(5+k,4,"do step " + str(k))
+        ws.cell(5+k,5,"outcome " + str(k) + " is reached")
+    ws = wb.create_sheet("Non-functional")
+    for i,header in enumerate(["Requirement ID", "Category", "Non-functional requirement"]):
+        ws.cell(1,i+1,header)
+    ws.cell(2,1,"Classification of digital health interventions 3.1")
+    for k in range(requirements):
+        ws.cell(3+k,1,"BM.NFXREQ." + str(k))
+        ws.cell(3+k,2,["Security", "Usability", "Performance"][k % 3])
+        ws.cell(3+k,3,"The system shall meet requirement " + str(k))
+    wb.save(file_name)
+
+
+def generate_ig(ig_directory,parameters):
+    ig = Path(ig_directory)
+    for directory in ["input/decision-logic", "input/system-requirements", "input/cql", "input/fsh"]:
+        (ig / directory).mkdir(exist_ok=True, parents=True)
+    with open(ig / "sushi-config.yaml", 'w') as file:
+        file.write("id: smart.who.int.benchmark\n"
+                   "canonical: http://smart.who.int/benchmark\n"
+                   "name: Benchmark\n"
+                   "title: DAK extraction benchmark\n"
+                   "version: 0.1.0\n"
+                   "publisher:\n  name: WHO\n")
+    shutil.copy(Path(script_directory).parent / "fsh" / "Aliases.fsh", ig / "input/fsh/Aliases.fsh")
+    for w in range(parameters['workbooks']):
+        write_decision_workbook(ig / "input/decision-logic" / ("benchmark" + str(w) + ".xlsx"),
+                                w,parameters['tabs'],parameters['tables'],parameters['rules'])
+    write_requirements_workbook(ig / "input/system-requirements/benchmark.xlsx",parameters['requirements'])
+
+
+def run_stages(ig_directory):
+    # runs in a fresh worker process so that the import time is measured too.
+    # The stages are timed by the profiler of the installer, as with
+    # extract_dak.py --profile.
+    os.chdir(ig_directory)
+    sys.path.insert(0,script_directory)
+    start = time.perf_counter()
+    import extract_dak
+    from installer import installer
+    from req_extractor import req_extractor
+    from dt_extractor import dt_extractor
+    from logger import logger
+    import_time = time.perf_counter() - start
+
+    # keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        ins = extract_dak.run(force=True,stderr_level=logger.ERROR,profile=True)
+    wall = time.perf_counter() - start
+    return {'wall':wall,
+            'peak_rss_kb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'import':import_time,
+            'stages':ins.profiler.get_totals(),
+            'counters':ins.profiler.counters,
+            'files':len(ins.installed_files)}
+
+
+def run_extract_dak(ig_directory):
+    # end to end run of extract_dak.py, including the manifest and output writer.
+    # The child is reaped with wait4() for its own peak RSS: RUSAGE_CHILDREN
+    # would also cover the run_stages workers reaped before.
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(script_directory,"extract_dak.py"), "--force", "--log-level", "ERROR"],
+                               cwd=ig_directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    pid,status,usage = os.wait4(process.pid,0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {'wall':wall,
+            'returncode':process.returncode,
+            'peak_rss_kb':usage.ru_maxrss}
+
+
+def copy_ig(template_directory,ig_directory):
+    # every run starts from a fresh copy of the generated IG, so that none
+    # sees the outputs, caches or generated CQL of an earlier run
+    shutil.copytree(template_directory,ig_directory)
+    return os.path.abspath(ig_directory)
+
+
+def summarize(runs):
+    # the fastest time of every stage, with its count and bytes
+    summary = {'wall':min(run['wall'] for run in runs),
+               'peak_rss_kb':max(run['peak_rss_kb'] for run in runs),
+               'import':min(run['import'] for run in runs),
+               'stages':{}}
+    for stage in runs[0]['stages'].keys():
+        summary['stages'][stage] = min((run['stages'][stage] for run in runs if stage in run['stages']),
+                                       key=lambda entry: entry['seconds'])
+    return summary
+
+
+def main():
+    try:
+        opts,args = getopt.getopt(sys.argv[1:], "ho:",
+                                  ["help","workbooks=","tabs=","tables=","rules=","requirements=","repeat=","output=","keep="])
+    except getopt.GetoptError:
+        usage()
+
+    output_file = None
+    keep_directory = None
+    for opt,arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+        elif opt in ("-o", "--output"):
+            output_file = arg
+        elif opt == "--keep":
+            keep_directory = arg
+        elif opt[2:] in parameters:
+            try:
+                parameters[opt[2:]] = int(arg)
+            except ValueError:
+                usage()
+
+    work_directory = keep_directory if keep_directory else tempfile.mkdtemp(prefix="dak-benchmark-")
+    template_directory = os.path.join(work_directory,"template")
+    try:
+        start = time.perf_counter()
+        generate_ig(template_directory,parameters)
+        generate_time = time.perf_counter() - start
+
+        runs = []
+        for i in range(parameters['repeat']):
+            ig_directory = copy_ig(template_directory,os.path.join(work_directory,"run-" + str(i + 1)))
+            with multiprocessing.Pool(processes=1,maxtasksperchild=1) as pool:
+                runs.append(pool.apply(run_stages,(ig_directory,)))
+        end_to_end = run_extract_dak(copy_ig(template_directory,os.path.join(work_directory,"extract_dak")))
+    finally:
+        if not keep_directory:
+            shutil.rmtree(work_directory,ignore_errors=True)
+
+    report = {'parameters':parameters,
+              'environment':{'python':platform.python_version(),
+                             'platform':platform.platform(),
+                             'cpus':os.cpu_count()},
+              'generate_time':generate_time,
+              'runs':runs,
+              'best':summarize(runs),
+              'extract_dak':end_to_end}
+    if output_file:
+        with open(output_file,'w') as file:
+            json.dump(report,file,indent=1)
+    else:
+        print(json.dumps(report,indent=1))
+
+
+if __name__ == "__main__":
+    main()
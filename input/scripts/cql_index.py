@@ -0,0 +1,97 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+
+class cql_index(object):
+  # Index of the named expressions defined in CQL files.  Each file is
+  # tokenised once into a case-insensitive map from define name to the text of
+  # the definition, i.e. what
+  #   (^define\s+('|")NAME('|")\s*:(.*?))(\/\*|^define|\Z)
+  # would capture in group 1.  Lookups are then dictionary hits.
+  #
+  # The tokenised files are cached on disk keyed by the hash of their content.
+  # The cache also records the version and the patterns it was tokenised
+  # with, and is discarded when either of them changed.
+
+  index_file = "temp/DAKExtract.cqlindex.json"
+  version = 1   # bump when tokenise() changes
+  define_pattern = re.compile(r'^define\s+[\'"]([^\'"]*)[\'"]\s*:', re.MULTILINE | re.IGNORECASE)
+  end_pattern = re.compile(r'/\*|^define', re.MULTILINE | re.IGNORECASE)
+
+  def __init__(self,installer):
+    self.installer = installer
+    self.files = {}         # cql file -> {'hash':..., 'defines': {lower case name -> definition}}
+    self.definitions = {}   # lower case name -> [(cql file, definition), ...] in file order
+
+  def get_format(self):
+    return {'version':self.version,
+            'define':[self.define_pattern.pattern,self.define_pattern.flags],
+            'end':[self.end_pattern.pattern,self.end_pattern.flags]}
+
+  def load(self):
+    try:
+      with open(self.installer.get_output_path(self.index_file), 'r') as file:
+        index = json.load(file)
+    except (IOError, ValueError):
+      return
+    if isinstance(index,dict) and index.get('format') == self.get_format() and isinstance(index.get('files'),dict):
+      self.files = index['files']
+    else:
+      self.installer.log("CQL index " + self.index_file + " was built differently, all CQL files will be indexed")
+
+  def save(self):
+    try:
+      index_path = Path(self.installer.get_output_path(self.index_file))
+      index_path.parent.mkdir(exist_ok=True, parents=True)
+      with open(index_path, 'w') as file:
+        json.dump({'format':self.get_format(),'files':self.files},file)
+    except IOError as e:
+      self.installer.log("Could not save CQL index " + self.index_file)
+      self.installer.log(f"\tError: {e}")
+      return False
+    return True
+
+  def tokenise(self,content:str):
+    defines = {}
+    for match in self.define_pattern.finditer(content):
+      name = match.group(1).lower()
+      if name in defines:
+        # like re.search, the first definition in the file wins
+        continue
+      end = self.end_pattern.search(content,match.end())
+      defines[name] = content[match.start():end.start() if end else len(content)]
+    return defines
+
+  def update(self,cql_files):
+    # (re)build the index for the given files, tokenising only files whose
+    # content changed since they were last indexed
+    self.load()
+    files = {}
+    for cql_file in cql_files:
+      try:
+        data = Path(self.installer.get_input_path(cql_file)).read_bytes()
+      except IOError as e:
+        self.installer.log("Could not read CQL file " + cql_file)
+        self.installer.log(f"\tError: {e}")
+        continue
+      file_hash = hashlib.sha256(data).hexdigest()
+      if cql_file in self.files and self.files[cql_file]['hash'] == file_hash:
+        files[cql_file] = self.files[cql_file]
+        continue
+      content = data.decode("utf-8").replace("\r\n","\n").replace("\r","\n")
+      files[cql_file] = {'hash':file_hash, 'defines':self.tokenise(content)}
+      self.installer.log("Indexed " + str(len(files[cql_file]['defines'])) + " CQL definitions in " + cql_file)
+    self.files = files
+
+    self.definitions = {}
+    for cql_file,entry in self.files.items():
+      for name,definition in entry['defines'].items():
+        if not name in self.definitions:
+          self.definitions[name] = []
+        self.definitions[name].append((cql_file,definition))
+    return True
+
+  def get_definitions(self,name:str):
+    # returns [(cql file, definition), ...] for the (case insensitive) name
+    return self.definitions.get(name.lower(),[])
@@ -0,0 +1,100 @@
+from array import array
+
+class cql_table(object):
+  # the CQL definitions of a decision table: the string ids of its tab and
+  # table, and the names and expressions of its definitions as parallel
+  # arrays of string ids, in the order they were first defined
+  __slots__ = ('tab','table','names','exprs')
+
+  def __init__(self,tab:int,table:int):
+    self.tab = tab
+    self.table = table
+    self.names = array('I')
+    self.exprs = array('I')
+
+
+class cql_code(object):
+  # a code of the decision table code system: its name and title and the
+  # tab and table it was first defined in, all string ids
+  __slots__ = ('name','title','tab','table')
+
+  def __init__(self,name:int,title:int,tab:int,table:int):
+    self.name = name
+    self.title = title
+    self.tab = tab
+    self.table = table
+
+
+class cql_symbols(object):
+  # Symbol table of the CQL definitions found in decision tables, e.g.
+  #   add('IMMZ.D2', 'DT.IMMZ.D2.DT.BCG', 'Client age', 'Age of the client in months')
+  # The same tab and table ids, names and long pseudocode expressions recur
+  # in many rules, tables and workbooks, so each distinct string is stored
+  # once and referred to by an integer id everywhere else.  Redefining a
+  # name in a table replaces its expression and keeps its position, as
+  # updating a dict would.
+  #
+  # get_results() hands the strings and arrays of a worker process to the
+  # parent, which interns them into its own table in merge_results().
+
+  def __init__(self):
+    self.strings = []     # string id -> string
+    self.ids = {}         # string -> string id
+    self.tables = []      # cql_table, in the order the tables were first seen
+    self.table_ids = {}   # (tab, table) string ids -> index in tables
+    self.positions = {}   # (index in tables, name string id) -> index in the arrays of the table
+    self.types = {'input':{},'output':{},'annotation':{}}   # type -> name string id -> expression string id
+
+  def intern(self,string:str):
+    id = self.ids.get(string)
+    if id is None:
+      id = self.ids[string] = len(self.strings)
+      self.strings.append(string)
+    return id
+
+  def get(self,id:int):
+    return self.strings[id]
+
+  def add(self,tab_id:str,dt_id:str,name:str,expr:str,type = None):
+    self.add_ids(self.intern(tab_id),self.intern(dt_id),self.intern(name),self.intern(expr),type)
+
+  def add_ids(self,tab:int,table:int,name:int,expr:int,type = None):
+    index = self.table_ids.get((tab,table))
+    if index is None:
+      index = self.table_ids[(tab,table)] = len(self.tables)
+      self.tables.append(cql_table(tab,table))
+    cql_definitions = self.tables[index]
+    position = self.positions.get((index,name))
+    if position is None:
+      self.positions[(index,name)] = len(cql_definitions.names)
+      cql_definitions.names.append(name)
+      cql_definitions.exprs.append(expr)
+    else:
+      cql_definitions.exprs[position] = expr
+    if type is not None:
+      self.types[type][name] = expr
+
+  def get_tabs(self):
+    # (tab string id, [cql_table]) in the order the tabs were first seen
+    tabs = {}
+    for cql_definitions in self.tables:
+      tabs.setdefault(cql_definitions.tab,[]).append(cql_definitions)
+    return tabs.items()
+
+  def get_definitions(self,type:str):
+    # (name, expression) of the definitions of type, e.g. 'output'
+    return [(self.strings[name],self.strings[expr]) for name,expr in self.types[type].items()]
+
+  def get_results(self):
+    return {'strings':self.strings,
+            'tables':[(t.tab,t.table,t.names,t.exprs) for t in self.tables],
+            'types':self.types}
+
+  def merge_results(self,results):
+    ids = array('I',[self.intern(string) for string in results['strings']])
+    for tab,table,names,exprs in results['tables']:
+      for name,expr in zip(names,exprs):
+        self.add_ids(ids[tab],ids[table],ids[name],ids[expr])
+    for type,definitions in results['types'].items():
+      for name,expr in definitions.items():
+        self.types[type][ids[name]] = ids[expr]
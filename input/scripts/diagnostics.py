@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+
+class diagnostics(object):
+  # Structured record of the problems found in the DAK while extracting, for
+  # quality control by the L2 authors, e.g.
+  #   {'severity':'WARN', 'workbook':'input/system-requirements/req.xlsx',
+  #    'sheet':'Functional', 'cell':'C14', 'artifact':None,
+  #    'message':'skipping row 12: no as-a'}
+  # Each diagnostic is logged as before and also kept here, so that the JSON
+  # and JUnit reports are written without parsing the log.  Worker processes
+  # hand theirs back to the parent with get_results(), in task order.
+
+  report_file = "temp/DAKExtract.diagnostics.json"
+  junit_file = "temp/DAKExtract.diagnostics.junit.xml"
+  fields = ['severity','workbook','sheet','cell','artifact','message']
+
+  def __init__(self):
+    self.records = []
+
+  def add(self,severity:str,message:str,workbook = None,sheet = None,cell = None,artifact = None):
+    self.records.append({'severity':severity,
+                         'workbook':workbook,
+                         'sheet':sheet,
+                         'cell':cell,
+                         'artifact':artifact,
+                         'message':message.strip()})
+
+  def get_results(self):
+    return self.records
+
+  def merge_results(self,records:list):
+    self.records.extend(records)
+
+  def get_counts(self):
+    # severity -> number of diagnostics
+    counts = {}
+    for record in self.records:
+      counts[record['severity']] = counts.get(record['severity'],0) + 1
+    return counts
+
+  def get_summary(self):
+    counts = self.get_counts()
+    return "Diagnostics: " + str(counts.get('ERROR',0)) + " error(s), " + str(counts.get('WARN',0)) + " warning(s)"
+
+  def describe(self,record:dict):
+    location = [str(record[field]) for field in ['workbook','sheet','cell'] if record[field]]
+    text = record['message']
+    if record['artifact']:
+      text = str(record['artifact']) + ": " + text
+    if location:
+      text = "/".join(location) + ": " + text
+    return text
+
+  def save(self,file_name:str):
+    Path(file_name).parent.mkdir(exist_ok=True, parents=True)
+    with open(file_name, 'w') as file:
+      json.dump({'counts':self.get_counts(),'diagnostics':self.records},file,indent=1)
+
+  def save_junit(self,file_name:str,workbooks = []):
+    # one test suite per workbook and a test case per diagnostic: errors are
+    # reported as <error>, warnings as <failure>.  A workbook without any
+    # diagnostic gets a passing test case, so that dashboards see it.
+    import xml.etree.ElementTree as ET
+    suites = {workbook:[] for workbook in workbooks}
+    for record in self.records:
+      if record['severity'] in ('ERROR','WARN'):
+        suites.setdefault(record['workbook'] or "",[]).append(record)
+    root = ET.Element('testsuites',name="DAK extraction")
+    for workbook,records in suites.items():
+      errors = sum(1 for record in records if record['severity'] == 'ERROR')
+      suite = ET.SubElement(root,'testsuite',name=workbook or "(no workbook)",tests=str(max(len(records),1)),
+                            errors=str(errors),failures=str(len(records) - errors))
+      if len(records) == 0:
+        ET.SubElement(suite,'testcase',classname=workbook,name="extract")
+      for record in records:
+        name = " ".join(str(record[field]) for field in ['sheet','cell','artifact'] if record[field]) or "extract"
+        case = ET.SubElement(suite,'testcase',classname=workbook or "",name=name)
+        element = ET.SubElement(case,'error' if record['severity'] == 'ERROR' else 'failure',
+                                type=record['severity'],message=record['message'])
+        element.text = self.describe(record)
+    Path(file_name).parent.mkdir(exist_ok=True, parents=True)
+    ET.ElementTree(root).write(file_name,encoding="utf-8",xml_declaration=True)
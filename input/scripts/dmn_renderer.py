@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+class dmn_renderer(object):
+  # Renders DMN trees to HTML with the dmn2html XSLT in a pool of threads
+  # (lxml releases the GIL while transforming).  The stylesheet is parsed
+  # once and compiled once per thread, as compiled XSLT objects must not be
+  # shared between threads.
+  #
+  # The hash of each rendered DMN (and of the stylesheet) is kept in
+  # state_file so that tables whose DMN did not change since the last run are
+  # not transformed again.
+  #
+  # Nothing is read before the first table is installed: worker processes
+  # and runs without changes never load the stylesheet or lxml.
+  #
+  # The parsed stylesheets, the threads and their compiled stylesheets are
+  # shared by all renderers of a process, so that the runs of a long running
+  # process (--watch) do not parse and compile the stylesheet again.
+
+  state_file = "temp/DAKExtract.dmnhtml.json"
+  xslt_docs = {}              # stylesheet hash -> parsed stylesheet
+  local = threading.local()   # per thread: stylesheet hash -> compiled stylesheet
+  pools = {}                  # number of threads -> ThreadPoolExecutor
+  lock = threading.Lock()
+
+  def __init__(self,installer,xslt_file,jobs = None):
+    self.installer = installer
+    if not os.path.isfile(xslt_file):
+      raise FileNotFoundError("No such file: " + str(xslt_file))
+    self.xslt_file = xslt_file
+    self.xslt_data = None
+    self.xslt_hash = None
+    self.jobs = jobs if jobs is not None else min(8,os.cpu_count() or 1)
+    self.previous = None
+    self.current = {}
+
+  def read_xslt(self):
+    if self.xslt_data is None:
+      with open(Path(self.xslt_file), "rb") as f:
+        self.xslt_data = f.read()
+      self.xslt_hash = hashlib.sha256(self.xslt_data).hexdigest()
+    return self.xslt_data
+
+  def get_xslt_doc(self):
+    # parsed stylesheet, shared by the threads that compile it
+    with self.lock:
+      self.read_xslt()
+      xslt_doc = self.xslt_docs.get(self.xslt_hash)
+      if xslt_doc is None:
+        import lxml.etree as ET
+        xslt_doc = ET.fromstring(self.xslt_data,base_url=str(self.xslt_file))
+        self.xslt_docs[self.xslt_hash] = xslt_doc
+      return xslt_doc
+
+  def get_previous(self):
+    if self.previous is None:
+      self.read_xslt()
+      self.previous = self.load()
+    return self.previous
+
+  def load(self):
+    try:
+      with open(self.installer.get_output_path(self.state_file), 'r') as file:
+        state = json.load(file)
+    except (IOError, ValueError):
+      return {}
+    if not isinstance(state,dict) or state.get('xslt') != self.xslt_hash:
+      return {}
+    return state.get('tables',{})
+
+  def save(self):
+    try:
+      self.read_xslt()
+      state_path = Path(self.installer.get_output_path(self.state_file))
+      state_path.parent.mkdir(exist_ok=True, parents=True)
+      with open(state_path, 'w') as file:
+        json.dump({'xslt':self.xslt_hash,'tables':self.current},file,indent=1,sort_keys=True)
+    except IOError as e:
+      self.installer.warn("Could not save DMN rendering state " + self.state_file)
+      self.installer.warn(f"\tError: {e}")
+      return False
+    return True
+
+  def get_xslt(self):
+    # compiled stylesheet of the current thread
+    xslts = getattr(self.local,'xslts',None)
+    if xslts is None:
+      xslts = self.local.xslts = {}
+    xslt = xslts.get(self.xslt_hash)
+    if xslt is None:
+      import lxml.etree as ET
+      xslt = ET.XSLT(self.get_xslt_doc())
+      xslts[self.xslt_hash] = xslt
+    return xslt
+
+  def get_pool(self):
+    with self.lock:
+      pool = self.pools.get(self.jobs)
+      if pool is None:
+        pool = self.pools[self.jobs] = ThreadPoolExecutor(max_workers=self.jobs)
+      return pool
+
+  def get_hash(self,dmn:str):
+    return hashlib.sha256(dmn.encode("utf-8")).hexdigest()
+
+  def is_unchanged(self,id:str,dmn:str,html_path):
+    return self.get_previous().get(id) == self.get_hash(dmn) and os.path.exists(html_path)
+
+  def transform(self,dmn_tree):
+    import lxml.etree as ET
+    with self.installer.profiler.stage("xslt"):
+      return ET.tostring(self.get_xslt()(dmn_tree),encoding="unicode")
+
+  def render(self,tables):
+    # tables is a list of (id, dmn tree); yields (id, html, error) in the
+    # order of tables, with html None if the transform failed
+    if len(tables) == 0:
+      return
+    self.read_xslt()
+    pool = self.get_pool()
+    futures = [(id,pool.submit(self.transform,dmn_tree)) for id,dmn_tree in tables]
+    for id,future in futures:
+      try:
+        yield (id,future.result(),None)
+      except BaseException as e:
+        yield (id,None,e)
+
+  def record(self,id:str,dmn:str):
+    self.current[id] = self.get_hash(dmn)
@@ -0,0 +1,101 @@
+import json
+import threading
+from pathlib import Path
+import lxml.etree as ET
+from logger import logger
+
+class dmn_validator(object):
+  # Validates DMN trees in memory against the DMN 1.6 XML schema bundled in
+  # includes/ (DMN16.xsd and the DMNDI15, DI and DC schemas it imports).
+  # The schema is compiled once per thread and shared by the validators of
+  # that thread: a schema keeps the errors of its last validation in its
+  # error_log, so concurrent runs must not validate with the same one.
+  #
+  # Every schema error is reported with the decision table and rule it
+  # belongs to, and the whole report is saved as JSON in report_file.
+
+  schema_file = "includes/DMN16.xsd"  #relative to directory containing this file
+  report_file = "temp/DAKExtract.dmnvalidation.json"
+  local = threading.local()   # per thread: schema path -> compiled schema
+
+  def __init__(self,installer):
+    self.installer = installer
+    self.report = {}
+
+  @classmethod
+  def get_schema(cls,script_directory:str):
+    schemas = getattr(cls.local,'schemas',None)
+    if schemas is None:
+      schemas = cls.local.schemas = {}
+    schema_path = str(Path(script_directory) / cls.schema_file)
+    schema = schemas.get(schema_path)
+    if schema is None:
+      schema = schemas[schema_path] = ET.XMLSchema(ET.parse(schema_path))
+    return schema
+
+  def get_context(self,dmn_tree,path:str):
+    # (decision id, rule id) of the element at the path of a schema error
+    decision_id = None
+    rule_id = None
+    try:
+      elements = dmn_tree.getroottree().xpath(path,namespaces={'dmn':self.installer.dmn_namespace})
+    except ET.XPathError:
+      return (decision_id,rule_id)
+    if len(elements) == 0:
+      return (decision_id,rule_id)
+    for element in [elements[0]] + list(elements[0].iterancestors()):
+      local_name = ET.QName(element).localname
+      if local_name == "rule" and rule_id is None:
+        rule_id = element.get("id")
+      elif local_name == "decision" and decision_id is None:
+        decision_id = element.get("id")
+    return (decision_id,rule_id)
+
+  def validate(self,id:str,dmn_tree):
+    # returns True if the DMN of table id is valid, errors are added to the report
+    schema = self.get_schema(self.installer.get_base_dir() + "/input/scripts")
+    valid = schema.validate(dmn_tree)
+    errors = []
+    for error in schema.error_log:
+      decision_id,rule_id = self.get_context(dmn_tree,error.path)
+      errors.append({'decision':decision_id,
+                     'rule':rule_id,
+                     'path':error.path,
+                     'message':error.message})
+    self.report[id] = {'valid':valid,'errors':errors}
+    if not valid:
+      self.installer.diagnose(logger.WARN,"DMN " + id + " is not valid against " + self.schema_file + ": " + str(len(errors)) + " error(s)",
+                              artifact=id)
+      for error in errors:
+        self.installer.log("\t" + self.describe_error(error))
+    return valid
+
+  def describe_error(self,error:dict):
+    context = []
+    if error['decision']:
+      context.append("decision " + error['decision'])
+    if error['rule']:
+      context.append("rule " + error['rule'])
+    if len(context) == 0:
+      context.append(error['path'])
+    return ", ".join(context) + ": " + error['message']
+
+  def is_valid(self):
+    return all(table['valid'] for table in self.report.values())
+
+  def get_summary(self):
+    invalid = [id for id,table in self.report.items() if not table['valid']]
+    return "DMN validation: " + str(len(self.report) - len(invalid)) + " valid, " \
+      + str(len(invalid)) + " invalid table(s)"
+
+  def save(self):
+    try:
+      report_path = Path(self.installer.get_output_path(self.report_file))
+      report_path.parent.mkdir(exist_ok=True, parents=True)
+      with open(report_path, 'w') as file:
+        json.dump({'valid':self.is_valid(),'tables':self.report},file,indent=1)
+    except IOError as e:
+      self.installer.warn("Could not save DMN validation report " + self.report_file)
+      self.installer.warn(f"\tError: {e}")
+      return False
+    return True
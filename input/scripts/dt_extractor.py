@@ -1,33 +1,36 @@
 import sys
 import pprint
 import os
-import glob as glob
-import re
-import pandas as pd
 import urllib.parse
 from extractor import extractor 
 from installer import installer
-from pathlib import Path
+from logger import logger
+from cql_index import cql_index
+from cql_symbols import cql_symbols, cql_code
+from emitter import emitter, fsh_emitter
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+  import pandas as pd
 class dt_extractor(extractor):
   
   prefix = "DT"
 
   # internal variables
-  cql_definitions : dict
-  cql_definitions_by_type : dict
+  cql_symbols : cql_symbols
   tab_data : dict      
-  cql_definitions = {}
-  cql_definitions_by_type = {'input':{},'output':{},'annotation':{}}
-  tab_data = {}
+  activities_extracted = False
   
   def __init__(self,installer:installer):
     super().__init__(installer)
+    self.cql_symbols = cql_symbols()
+    self.tab_data = {}
+    self.cql_index = cql_index(installer)
     
   def find_files(self):
-    return glob.glob("input/decision-logic/*xlsx")
+    return self.installer.find_input_files("input/decision-logic/*xlsx")
         
   def find_cql_files(self):
-    return glob.glob("input/cql/*cql")
+    return self.installer.find_input_files("input/cql/*cql")
 
   
   def extract_file(self):
@@ -43,13 +46,13 @@ class dt_extractor(extractor):
     
     
     if (not  self.extract_activities(cover_sheet)):
-      self.log("Could not extract decision logic in: " + self.inputfile_name)
+      self.diagnose(logger.WARN,"Could not extract decision logic in: " + self.inputfile_name)
       return False        
       
     return True
 
 
-  def extract_activities(self,cover_sheet:pd.DataFrame):
+  def extract_activities(self,cover_sheet:"pd.DataFrame"):
     id_name  = ""
     id = ""
     name = ""
@@ -60,7 +63,7 @@ class dt_extractor(extractor):
 
 
     if cover_sheet is None:
-      self.log("Could not load cover sheet")      
+      self.diagnose(logger.WARN,"Could not load cover sheet",sheet="COVER")
       return False
     
     for index, row in cover_sheet.iterrows():
@@ -71,7 +74,7 @@ class dt_extractor(extractor):
         or (isinstance(row["description"],str) and bool(row["description"]) and row["description"] != "-" )           
 
       if not has_non_empty:
-        self.log("Reached end of cover index table")
+        self.debug("Reached end of cover index table")
         break
       
       if  "id_name" in row and  isinstance(row["id_name"], str) and row["id_name"]:
@@ -79,19 +82,20 @@ class dt_extractor(extractor):
 
         
       if not id_name:
-        self.log("could not get id_name on row=" + str(row))
+        self.warn("could not get id_name on row=" + str(row))
         continue
       
       parts = id_name.split(" ",1)
       if (len(parts) != 2):
-        self.log("Skipping bad activity id.name: " + id_name ,parts)
+        self.diagnose(logger.WARN,"Skipping bad activity id.name: " + id_name + "\n" + str(parts),
+                      artifact=id_name,**self.get_row_location(index,'id_name'))
         continue
       
       id = parts[0].strip()
       name = parts[1].strip()
 
       if not "dt_id" in row  or not isinstance(row["dt_id"], str) or not row["dt_id"]:
-        self.log("Could not load decision dt_id data", row)
+        self.diagnose(logger.WARN,"Could not load decision dt_id data\n" + str(row),**self.get_row_location(index,'dt_id'))
         continue
       dt_id = self.name_to_id(row["dt_id"])
       
@@ -105,80 +109,86 @@ class dt_extractor(extractor):
       #if tab != 'BCG':
       #  continue
 
-      if not self.load_tab(tab):      
-        self.log("Could not load tab data for "  + tab)
+      with self.profile("load_tab"):
+        loaded = self.load_tab(tab)
+      if not loaded:
+        self.diagnose(logger.WARN,"Could not load tab data for "  + tab,sheet=tab)
         continue
 
       data = {"tab":tab,"dt_id":dt_id,"description":row["description"],"source":row["sources"]}
-      if not self.extract_activity_table(id,name,tab,dt_id,data):
-        self.log("Could not extract decition table for id=" + id + " name=" + name + " data=" + str(data))
+      with self.profile("decision_table"):
+        extracted = self.extract_activity_table(id,name,tab,dt_id,data)
+      if not extracted:
+        self.diagnose(logger.WARN,"Could not extract decition table for id=" + id + " name=" + name + " data=" + str(data),
+                      sheet=tab,artifact=dt_id)
+
+    self.activities_extracted = True
+    return True
 
 
-    cql_files = self.find_cql_files()
-    #cql_files = ["input/cql/IMMZD5DTBCGElements.cql"]        
-    cql_contents = {}
-    for cql_file in cql_files:
+  def get_results(self):
+    return {'cql_symbols':self.cql_symbols.get_results(),
+            'activities_extracted':self.activities_extracted}
+
+  def merge_results(self,results):
+    self.cql_symbols.merge_results(results['cql_symbols'])
+    self.activities_extracted |= results['activities_extracted']
+    return True
+
+
+  def finalize(self):
+    # the code system, value sets, CQL libraries and pages span all of the
+    # decision tables, so they are produced once every workbook is extracted
+    if not self.activities_extracted:
+      self.log("No decision logic activities were extracted")
+      return False
+
+    cql_files = []
+    for cql_file in self.find_cql_files():
       if cql_file.startswith(self.prefix):
-        self.log("Ignoring " + cql_file)
+        self.debug("Ignoring " + cql_file)
         continue      
-      cql_contents[cql_file] = Path(cql_file).read_text()
-
-    all_codes = {}
-    for full_tab_id,dts in self.cql_definitions.items():
+      cql_files.append(cql_file)
+    with self.profile("cql_index"):
+      self.cql_index.update(cql_files)
+      self.cql_index.save()
+
+    symbols = self.cql_symbols
+    codes = {}   # name string id -> cql_code, from the first definition of each name
+    for tab,tables in symbols.get_tabs():
+      full_tab_id = symbols.get(tab)
       tab_codes = {}
-      tab_markdown = "### Decision Tables for Tab  " + full_tab_id + "\n"
-
-      for full_dt_id,cql_definitions in dts.items():
-        
-        dt_include = "{% include " + full_dt_id + ".html %}\n"
-        dt_markdown = "### Decision Table " + full_dt_id + "\n"
-        dt_markdown += dt_include
-        tab_markdown += "#### Decision Table " + full_dt_id + "\n"
-        tab_markdown += dt_include
-        #self.installer.add_page( full_dt_id,dt_markdown)
-        
-        self.log("Processing DT ID cql for " + full_dt_id + " on full tab_id " + full_tab_id)
+      # the decision tables of a tab are rendered together as one page
+      tab_markdown = emitter()
+      tab_markdown.line("### Decision Tables for Tab  " + full_tab_id)
+      tab_markdown.line("{% include " + full_tab_id + ".html %}")
+
+      for cql_definitions in tables:
+        full_dt_id = symbols.get(cql_definitions.table)
+        self.debug("Processing DT ID cql for " + full_dt_id + " on full tab_id " + full_tab_id)
         vs_id = full_dt_id
         dt_codes = []
-        for cql_id,val in cql_definitions.items():
+        for name,expr in zip(cql_definitions.names,cql_definitions.exprs):
+          cql_id = symbols.get(name)
+          val = symbols.get(expr)
           if not cql_id:
-            self.log("BAD:" + cql_id + " from " + full_dt_id)
+            self.warn("BAD:" + cql_id + " from " + full_dt_id)
             sys.exit(2)
-          if not cql_id in all_codes:
-            self.log("  adding new " + cql_id  + " -> " + str(val))
-            if isinstance(val,str):
-              cql_prop = { 'title' : val,
-                           'pseudocode' : val,
-                           'tab' : [full_tab_id],
-                           'table' : [full_dt_id]
-                          }
-              all_codes[cql_id] = cql_prop
-              tab_codes[cql_id] = cql_prop
-            elif isinstance(val,dict) and 'title' in val:
-              if not 'pseudocode' in val:
-                val['pseudocode'] = val['title']
-              all_codes[cql_id] = val
-              all_codes[cql_id]['tab'] = [full_tab_id]
-              all_codes[cql_id]['table'] = [full_dt_id]
-              tab_codes[cql_id] = all_codes[cql_id]                            
-            else:
-              self.log("  skipping " + cql_id  )
-              continue
+          code = codes.get(name)
+          if code is None:
+            self.debug("  adding new " + cql_id  + " -> " + val)
+            codes[name] = cql_code(name,expr,tab,cql_definitions.table)
+            tab_codes[cql_id] = { 'title' : val,
+                                  'pseudocode' : val,
+                                  'tab' : [full_tab_id],
+                                  'table' : [full_dt_id]
+                                 }
           else:
-            self.log("  updating" + cql_id  + " -> " + str(val))
-            if isinstance(val,str):
-              title = val
-              tab_codes[cql_id] = {'pseudocode':title}
-            elif isinstance(val,dict) and 'title' in val:
-              title = val['title']
-              tab_codes[cql_id] = val
-            else:
-              self.log("  skipping " + cql_id  )
-              continue
-            
-            
-            if title != all_codes[cql_id]['title']:
-              self.log("ERROR: cql expression " + cql_id + " has repeated non-matching definition in decision table with id " + full_dt_id + " on tab_id " + full_tab_id )
+            self.debug("  updating" + cql_id  + " -> " + val)
+            tab_codes[cql_id] = {'pseudocode':val}
+            if expr != code.title:
+              self.diagnose(logger.ERROR,"ERROR: cql expression " + cql_id + " has repeated non-matching definition in decision table with id " + full_dt_id + " on tab_id " + full_tab_id,
+                            artifact=cql_id)
 
           dt_codes += [self.escape_code(cql_id)]
           
@@ -187,9 +197,9 @@ class dt_extractor(extractor):
                                              'Decision Table for ' + full_dt_id + ". Autogenerated from DAK artifacts", \
                                              dt_codes)
 
-      self.installer.add_page(full_tab_id,tab_markdown)
-      cql_desc ="This library contains Decision Table elements from the decision table " \
-        + "<a href='" + full_dt_id + ".html'>" + full_dt_id + "</a>"
+      self.installer.add_page(full_tab_id,tab_markdown.getvalue())
+      cql_desc ="This library contains Decision Table elements from the decision tables of tab " \
+        + "<a href='" + full_tab_id + ".html'>" + full_tab_id + "</a>"
       properties = {'description':cql_desc}
       self.create_cql_skeleton_for_tab(full_tab_id,tab_codes,properties)        
       tab_vs_id = self.name_to_id(full_tab_id)
@@ -199,31 +209,26 @@ class dt_extractor(extractor):
 
     #normalize content for codesystem
     normalized_codes = {}
-    for cql_id,cql_prop in all_codes.items():
-      #if cql_id != "The client is pregnant": 
-      #  continue
-      #  # BCG test case
-        
-      cql_prop['display'] = cql_prop['title']
-      cql_prop['definition'] = cql_prop['title'] + "\nReferenced in the following locations:\n"
-      cql_prop['definition'] += " * Decision Tables: " + ", ".join(cql_prop['table']) + "\n"
-      cql_prop['definition'] += " * Tabs: " + ", ".join(cql_prop['tab']) + "\n"
+    for code in codes.values():
+      cql_id = symbols.get(code.name)
+      title = symbols.get(code.title)
+      table = symbols.get(code.table)
+      tab = symbols.get(code.tab)
+      cql_prop = {'title':title,'pseudocode':title,'display':title}
+      cql_prop['definition'] = title + "\nReferenced in the following locations:\n"
+      cql_prop['definition'] += " * Decision Tables: " + table + "\n"
+      cql_prop['definition'] += " * Tabs: " + tab + "\n"
       cql_prop['propertyString'] = {
-        'table' : ", ".join(cql_prop['table']),
-        'tab' : ", ".join(cql_prop['tab'])
+        'table' : table,
+        'tab' : tab
       }
-      cql_prop.pop('tab')
-      cql_prop.pop('table')
 
       #look for existing defintions
       cql_prop['designation'] = []
       cql_defs = ""
-      for cql_file,cql_content in cql_contents.items():
-        pattern = r'(^define\s+(\'|")' + re.escape(cql_id) + r'(\'|")\s*:(.*?))(\/\*|^define|\Z)'        
-        match = re.search(pattern, cql_content, re.DOTALL | re.MULTILINE | re.IGNORECASE)
-        if not match:
-          continue
-        cql_def = match.group(1)
+      with self.profile("cql_lookup"):
+        cql_definitions = self.cql_index.get_definitions(cql_id)
+      for cql_file,cql_def in cql_definitions:
         if self.is_blank(cql_def):
           continue
         #self.log("for " + cql_id + " found in " + cql_file + "found:" +  cql_def)
@@ -253,30 +258,30 @@ class dt_extractor(extractor):
     return True
 
   def produce_activities(self):    
-    for code,expr in self.cql_definitions_by_type['output'].items():
+    for code,expr in self.cql_symbols.get_definitions('output'):
       a_id = self.name_to_id(self.prefix + "O." + code)
       # this should be moved to a ruleset so we can do:
-      fsh_activity =  f"Instance: {a_id}\n"
-      fsh_activity += "InstanceOf: $SGActivityDefinition\n"
-      fsh_activity += f"Title: \"Decision Table Output {code}\"\n"
-      fsh_activity += f"Description: \"\"\"{expr}\n\"\"\"\n"
-      fsh_activity += "Usage: #definition\n"
-      fsh_activity += "* publisher = \"World Health Organization (WHO)\"\n"
-      fsh_activity += "* experimental = false\n"
-      fsh_activity += "* version = \"" + self.installer.get_ig_version() + "\"\n"
-      fsh_activity += f"* name = \"{code}\"\n"
-      fsh_activity += "* status = #draft\n"
-      fsh_activity += "* contact[+]\n"
-      fsh_activity += "  * telecom[+]\n"
-      fsh_activity += "    * system = #url\n"
-      fsh_activity += "    * value = \"https://who.int\"\n"
-      fsh_activity += "* kind = #CommunicationRequest\n"
-      fsh_activity += "* intent = #proposal\n"
-      fsh_activity += "* doNotPerform = false\n"
+      fsh_activity = fsh_emitter()
+      fsh_activity.instance(a_id,"$SGActivityDefinition",
+                            title=fsh_activity.quote(f"Decision Table Output {code}"),
+                            description=fsh_activity.triple_quote(f"{expr}\n"),
+                            usage="#definition")
+      fsh_activity.rule("publisher",fsh_activity.quote("World Health Organization (WHO)"))
+      fsh_activity.rule("experimental","false")
+      fsh_activity.rule("version",fsh_activity.quote(self.installer.get_ig_version()))
+      fsh_activity.rule("name",fsh_activity.quote(code))
+      fsh_activity.rule("status","#draft")
+      fsh_activity.rule("contact[+]")
+      fsh_activity.rule("telecom[+]",None,1)
+      fsh_activity.rule("system","#url",2)
+      fsh_activity.rule("value",fsh_activity.quote("https://who.int"),2)
+      fsh_activity.rule("kind","#CommunicationRequest")
+      fsh_activity.rule("intent","#proposal")
+      fsh_activity.rule("doNotPerform","false")
       
-      #fsh_activity += "* ^abstract = true\n"
+      #fsh_activity.rule("^abstract","true")
 
-      self.installer.add_resource('activitydefinitions',a_id, fsh_activity)
+      self.installer.add_resource('activitydefinitions',a_id, fsh_activity.getvalue())
 
     return True
   
@@ -285,107 +290,118 @@ class dt_extractor(extractor):
     return self.installer.create_cql_library(lib_name,cql_codes,properties)
   
   
+  # labels of the cells that anchor the geometry of a decision table
+  table_anchor_labels = ["Decision ID"]
+  row_anchor_labels = ["Business rule","Trigger","Inputs","Potential contraindications"]
+  column_anchor_labels = {"Output":"output_col",
+                          "Guidance displayed to health worker":"guidance_col",
+                          "Annotations":"annotation_col",
+                          "Reference(s)":"reference_col"}
+
+  def find_anchors(self,df,grid):
+    # a single vectorised pass over the sheet finding every anchor label
+    # returns (row, col, label) coordinates in column-major order
+    labels = self.table_anchor_labels + ["Schedule ID"] + self.row_anchor_labels + list(self.column_anchor_labels.keys())
+    cols,rows = df.isin(labels).to_numpy().T.nonzero()
+    return [(int(row),int(col),grid[row,col]) for col,row in zip(cols,rows)]
+
   def load_tab(self,tab:str):
-    tab_id = self.name_to_id("tab")
+    tab_id = self.name_to_id(tab)
     if tab_id in self.tab_data:
       return True
     
-    self.log("Attempting to load decision table metadata for tab=" + tab)
-    try:
-      df = pd.read_excel(self.inputfile_name, sheet_name=tab,header=None)
-      
-    except Exception as e:
-      self.log("Could not open sheet " + tab )
-      self.log(e)
+    self.debug("Attempting to load decision table metadata for tab=" + tab)
+    df = self.workbook.get_sheet(tab)
+    if df is None:
+      self.diagnose(logger.WARN,"Could not open sheet " + tab,sheet=tab)
       return False
 
-    tab_id = self.name_to_id(tab)
-    self.log("Exracting tab to " + tab_id)
-    self.tab_data[tab_id] = {'df' :df,'tables':{}}
-    for col in df:
-      matching_rows = df[col] == "Decision ID"
-      sched_matching_rows = df[col] == "Schedule ID"
-      
-      if not isinstance(matching_rows,pd.Series) or not matching_rows.any():
+    self.debug("Exracting tab to " + tab_id)
+    grid = df.to_numpy(dtype=object)
+    # the rows of the tab as plain tuples, converted once for all of its tables
+    rows = [tuple(row) for row in grid.tolist()]
+    self.tab_data[tab_id] = {'grid' :grid,'rows':rows,'tables':{}}
+    n_rows,n_cols = grid.shape
+
+    anchors = self.find_anchors(df,grid)
+    labels_at = {(row,col):label for row,col,label in anchors}
+    column_anchors = {}  # row -> [(col,label)] of the column headers on that row, left to right
+    for row,col,label in sorted(anchors):
+      if label in self.column_anchor_labels:
+        column_anchors.setdefault(row,[]).append((col,label))
+    self.debug("Found anchors (row,col,label) ", anchors)
+
+    for row_idx,col_idx,label in anchors:
+      if not label in self.table_anchor_labels:
+        continue
+      self.debug("Validating decision table on row= # " + str(row_idx) +  \
+            "\n\t" +  '\t'.join(str(x) for x in grid[row_idx]))
+      decision_id = self.name_to_id(grid[row_idx,col_idx+1]) if col_idx + 1 < n_cols else None
+      if not isinstance(decision_id,str) or not decision_id:
+        self.diagnose(logger.WARN,"Could not find decision id to right of r,c:"+ str(row_idx) + "," + str(col_idx),
+                      sheet=tab,cell=self.get_cell_name(row_idx,col_idx))
         continue
-      
-      col_idx = df.columns.get_loc(col) 
-      self.log("Found decision tables in column index " + str(col_idx) + " on  matched rows=", df[matching_rows])
-      for row in df[matching_rows].iterrows():
-        row_idx = row[0]
-        self.log("Validating decision table on row= # " + str(row_idx) +  \
-              "\n\t" +  '\t'.join(str(x) for x in row[1].values))
-        decision_id = self.name_to_id(row[1][col_idx+1])
-        if not isinstance(decision_id,str) or not decision_id:
-          self.log("Could not find decision id to right of r,c:"+ row + "," + col)
-          continue
 
-        self.log("found decision id=" + decision_id)
-        br_row = row_idx + 1
-        if not isinstance(df[col][br_row],str) or not df[col][br_row] == "Business rule":
-          self.log("Did not find Business Rule row of decision table " + decision_id)
-          continue        
-        br = df[col_idx + 1][br_row]
-        if not isinstance(br,str) or not br:
-          self.log("Did not find any Business Rule defined for decision table " + decision_id)
-          continue
+      self.debug("found decision id=" + decision_id)
+      br_row = row_idx + 1
+      if not labels_at.get((br_row,col_idx)) == "Business rule":
+        self.diagnose(logger.WARN,"Did not find Business Rule row of decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(br_row,col_idx),artifact=decision_id)
+        continue        
+      br = grid[br_row,col_idx + 1] if col_idx + 1 < n_cols else None
+      if not isinstance(br,str) or not br:
+        self.diagnose(logger.WARN,"Did not find any Business Rule defined for decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(br_row,col_idx + 1),artifact=decision_id)
+        continue
 
-        trigger_row = row_idx + 2
-        if not isinstance(df[col][trigger_row],str) or not df[col][trigger_row] == "Trigger":
-          self.log("Did not find trigger row of decision table " + decision_id)
-          continue
-        trigger = df[col_idx + 1][trigger_row]
-        if not isinstance(trigger,str) or not trigger:
-          self.log("Did not find any trigger defined for decision table " + decision_id)
-          continue
+      trigger_row = row_idx + 2
+      if not labels_at.get((trigger_row,col_idx)) == "Trigger":
+        self.diagnose(logger.WARN,"Did not find trigger row of decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(trigger_row,col_idx),artifact=decision_id)
+        continue
+      trigger = grid[trigger_row,col_idx + 1] if col_idx + 1 < n_cols else None
+      if not isinstance(trigger,str) or not trigger:
+        self.diagnose(logger.WARN,"Did not find any trigger defined for decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(trigger_row,col_idx + 1),artifact=decision_id)
+        continue
 
-        input_row = row_idx + 3
-        if not isinstance(df[col][input_row],str) or \
-          ( not df[col][input_row] == "Inputs" and not df[col][input_row] == "Potential contraindications"):
-          self.log("Did not find Inputs row of decision table " + decision_id)
-          continue
-        self.log("Found Inputs/Potential contraindications at " + str(col) + " / " + str(input_row))
-
-        output_col = False
-        guidance_col = False
-        ref_col = False
-        anno_col = False
-        for c in df:
-          if c <= col:
-            continue
-          if df[c][input_row] == "Output":
-            output_col = c
-          elif df[c][input_row] == "Guidance displayed to health worker":
-            guidance_col = c
-          elif df[c][input_row] == "Annotations":
-            anno_col = c
-          elif df[c][input_row] == "Reference(s)":
-            ref_col = c
-            
-        if not output_col:
-          self.log("Did not find Output column of decision table " + decision_id)
-          continue
+      input_row = row_idx + 3
+      if not labels_at.get((input_row,col_idx)) in ["Inputs","Potential contraindications"]:
+        self.diagnose(logger.WARN,"Did not find Inputs row of decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(input_row,col_idx),artifact=decision_id)
+        continue
+      self.debug("Found Inputs/Potential contraindications at " + str(col_idx) + " / " + str(input_row))
+
+      tab_data = {"row":row_idx,
+        "col":col_idx,
+        "trigger":trigger,
+        "br":br,
+        "input_row":input_row,
+        "output_col":False,
+        "guidance_col":False,
+        "annotation_col":False,
+        "reference_col":False,
+        'used':False}
+      # the right-most matching column on the Inputs row wins
+      for c,column_label in column_anchors.get(input_row,[]):
+        if c > col_idx:
+          tab_data[self.column_anchor_labels[column_label]] = c
+
+      if not tab_data["output_col"]:
+        self.diagnose(logger.WARN,"Did not find Output column of decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(input_row,col_idx),artifact=decision_id)
+        continue
 
-        if not guidance_col:
-          self.log("Did not find Guidance column of decision table " + decision_id)
-          
-        if not ref_col:
-          self.log("Did not find Reference column of decision table " + decision_id)
-
-
-        tab_data = {"row":row_idx,
-          "col":col_idx,
-          "trigger":trigger,
-          "br":br,
-          "input_row":input_row,
-          "output_col":output_col,
-          "guidance_col":guidance_col,
-          "annotation_col":anno_col,
-          "reference_col":ref_col,
-          'used':False}        
-          
-        self.log("Found decision table " + decision_id + " in " + tab + " at r,c:" + str(row_idx) + "," + str(col_idx) + ".  Saving in tab_id=" + tab_id + " with " + str(tab_data))
-        self.tab_data[tab_id]['tables'][decision_id] = tab_data
+      if not tab_data["guidance_col"]:
+        self.diagnose(logger.WARN,"Did not find Guidance column of decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(input_row,col_idx),artifact=decision_id)
+        
+      if not tab_data["reference_col"]:
+        self.diagnose(logger.WARN,"Did not find Reference column of decision table " + decision_id,
+                      sheet=tab,cell=self.get_cell_name(input_row,col_idx),artifact=decision_id)
+
+      self.debug(lambda: "Found decision table " + decision_id + " in " + tab + " at r,c:" + str(row_idx) + "," + str(col_idx) + ".  Saving in tab_id=" + tab_id + " with " + str(tab_data))
+      self.tab_data[tab_id]['tables'][decision_id] = tab_data
     return True    
 
 
@@ -401,7 +417,7 @@ class dt_extractor(extractor):
       else:
         if self.is_nan(val)  and len(inputs) < len(prev_inputs):
           #merged cells end up as NaNs
-          self.log('  => setting to previous value')
+          self.debug('  => setting to previous value')
           inputs += [prev_inputs[i]]
         else:
           inputs += [val]
@@ -409,15 +425,16 @@ class dt_extractor(extractor):
   
 
   def extract_activity_table(self,id:str,name:str,tab:str,dt_id:str,row):
-    self.log("Looking for decision table ID=" + dt_id + " for activivity id /name (" + id + "/" + name + "): row=\n" + str(row))
+    self.debug(lambda: "Looking for decision table ID=" + dt_id + " for activivity id /name (" + id + "/" + name + "): row=\n" + str(row))
     tab_id =self.name_to_id(tab)
     if dt_id not in self.tab_data[tab_id]['tables']:
-      self.log("Could not find " + dt_id + " in sheet " + tab + " among found tables:" + ",".join(self.tab_data[tab_id]['tables'].keys()))
+      self.diagnose(logger.WARN,"Could not find " + dt_id + " in sheet " + tab + " among found tables:" + ",".join(self.tab_data[tab_id]['tables'].keys()),
+                    sheet=tab,artifact=dt_id)
       return False
     data = self.tab_data[tab_id]['tables'][dt_id]
-    df = self.tab_data[tab_id]["df"]
+    grid = self.tab_data[tab_id]["grid"]
     
-    ul_corner = df[data["col"]][data["row"]]
+    ul_corner = grid[data["row"],data["col"]]
     is_contra_table = False
     is_regular_table = False
     is_schedule_table = False
@@ -425,9 +442,9 @@ class dt_extractor(extractor):
     business_rule = data["br"]
 
     row_offset = 0
-    self.log("input row=" +  str(data["input_row"]))
+    self.debug("input row=" +  str(data["input_row"]))
     if self.name_to_id(ul_corner) == self.name_to_id("Decision ID"):
-      table_type = df[data["col"]][data["input_row"]]
+      table_type = grid[data["input_row"],data["col"]]
       is_contra_table = table_type == "Potential contraindications"
       if is_contra_table:
         row_offset += 1
@@ -436,15 +453,16 @@ class dt_extractor(extractor):
       table_type = ul_corner
       is_schedule_table = True
     else:
-      self.log("Could not determine type of table from " + ul_corner + "/" + table_type )
+      self.diagnose(logger.WARN,"Could not determine type of table from " + str(ul_corner),
+                    sheet=tab,cell=self.get_cell_name(data["row"],data["col"]),artifact=dt_id)
       return False
     
     self.log("Using decision tab of type (" + table_type + ") " + dt_id + " in sheet " + tab + " at r,c:"  + str(data["row"]) +"," + str(data["col"])  )
-    self.log("Tab data = \n\t" + pprint.pformat(data).replace("\n","\n\t"))
+    self.debug(lambda: "Tab data = \n\t" + pprint.pformat(data).replace("\n","\n\t"))
 
     in_table = True
     dmn = {'rule':[],'input' : [], 'output' : []}
-    fsh = {'plan':"",'citations':"",'rules':""}
+    fsh = {'plan':fsh_emitter(),'citations':fsh_emitter(),'rules':fsh_emitter()}
     rule = {'inputs':[],'output':None,'guidance':None,'annotation':None,'reference':None}
     
     full_dt_id = self.name_to_id(self.prefix +"." + dt_id)
@@ -455,37 +473,40 @@ class dt_extractor(extractor):
       dmn['input'].extend(self.get_contra_dmns(full_dt_id,table_type))
     elif is_regular_table:
       dmn['output'] += self.get_regular_dmns(full_dt_id)
-      fsh['plan'] = self.get_fsh_plan(full_tab_id,full_dt_id,full_lib_id,name)
+      self.get_fsh_plan(full_tab_id,full_dt_id,full_lib_id,name,fsh['plan'])
     
+    rows = self.tab_data[tab_id]['rows']
     while in_table:
       row_offset += 1      
       prev_rule = rule
-      rule = self.get_rule(df,data ,row_offset,prev_rule)
-      self.log("Previus rule=" +str(prev_rule)+ "\nRule=" + str(rule))
+      with self.profile("rule_walking"):
+        rule = self.get_rule(rows,data ,row_offset,prev_rule)
+      self.debug(lambda: "Previus rule=" +str(prev_rule)+ "\nRule=" + str(rule))
       if not rule:        #end of table
-        self.log("End of table for " + dt_id)
+        self.debug("End of table for " + dt_id)
         break
 
       if is_regular_table:
-        self.log("Got input column")
+        self.debug("Got input column")
         if len(prev_rule['inputs']) == 0:
           #it is a input variable definition
           dmn['input'].extend(self.get_dmn_input_definition(full_tab_id,full_dt_id,rule))
         else:
           #it is a rule
           dmn['rule'].extend(self.get_dmn_input_rule(full_tab_id,full_dt_id,row_offset,rule))
-          fsh['rules'] += self.get_fsh_rule(rule)
-          fsh['citations'] += self.get_fsh_citations(rule)
+          self.get_fsh_rule(rule,fsh['rules'])
+          self.get_fsh_citations(rule,fsh['citations'])
       elif is_contra_table:
         
         dmn['rule'].extend(self.get_dmn_contra_indication_rule(full_tab_id,full_dt_id,row_offset,rule))
       else:
-        self.log("WARNING - UNKNOWN table type")
+        self.warn("WARNING - UNKNOWN table type")
         return False
       
     if is_regular_table:
-      fsh['plan'] +=  "\n"+ fsh['citations'] + "\n" + fsh['rules']
-      self.installer.add_resource('plandefinitions',full_dt_id, fsh['plan'])
+      fsh['plan'].write("\n").write(fsh['citations'].getvalue()).write("\n").write(fsh['rules'].getvalue())
+      self.installer.add_resource('plandefinitions',full_dt_id, fsh['plan'].getvalue(),
+                                  self.get_source("tab " + tab + " table " + dt_id))
       
     dmn_tab = self.get_dmn(full_tab_id,full_dt_id,business_rule,trigger,dmn)
     self.installer.add_dmn_table(full_tab_id,dmn_tab)
@@ -496,25 +517,32 @@ class dt_extractor(extractor):
 
 
 
-  def get_rule(self,df,data,row_offset,prev_rule):
+  def get_cell(self,row:tuple,col):
+    # string value of a cell stripped of whitespace, or None
+    if col is False or col >= len(row) or not isinstance(row[col],str):
+      return None
+    return row[col].strip()
+
+  def get_rule(self,rows,data,row_offset,prev_rule):
     t_row = data["input_row"] + row_offset
     
-    if not t_row in df[data["output_col"]]:
+    if t_row >= len(rows):
       return None
+    row = rows[t_row]
     
-    vals = df.iloc[t_row, data["col"]:data["output_col"]].tolist()
+    vals = list(row[data["col"]:data["output_col"]])
     first_val = vals[0]
-    self.log("scanning row=" + str(t_row) + " with first value=" + str( first_val ))
+    self.debug("scanning row=" + str(t_row) + " with first value=" + str( first_val ))
 
     trailing_vals = vals[1:]    
     trailing_blank_input = all([self.is_blank(v) for v in trailing_vals])      
     trailing_nan_input = all([self.is_nan(v) for v in trailing_vals])
     
     rule = {'inputs' :[],
-            'output' : df[data["output_col"]][t_row].strip() if isinstance(df[data["output_col"]][t_row],str) else None,
-            'guidance' : df[data["guidance_col"]][t_row].strip() if isinstance(df[data["guidance_col"]][t_row],str) else None,
-            'reference' :df[data["reference_col"]][t_row].strip() if isinstance(df[data["reference_col"]][t_row],str) else None,
-            'annotation' : df[data["annotation_col"]][t_row].strip() if isinstance(df[data["annotation_col"]][t_row],str) else None
+            'output' : self.get_cell(row,data["output_col"]),
+            'guidance' : self.get_cell(row,data["guidance_col"]),
+            'reference' : self.get_cell(row,data["reference_col"]),
+            'annotation' : self.get_cell(row,data["annotation_col"])
             }
 
     blank_outputs = self.is_blank(rule['output']) and self.is_blank(rule['guidance']) and self.is_blank(rule['annotation'])
@@ -557,28 +585,24 @@ class dt_extractor(extractor):
 
     dmn_url = self.installer.get_ig_canonical() + "/dmn/" + dmn_tab_id + ".dmn"
     
-    dmn_out = "<dmn:definitions  xmlns:dmn='" + self.installer.dmn_namespace + "'\n" \
-        + " namespace='" + self.installer.get_ig_canonical() + "'\n" \
-        + " label='"  + self.escape(business_rule) + "'\n" \
-        + " id='" + dmn_tab_id + "'>\n" \
-        + "  <dmn:decision id='" + dmn_dt_id + "' label='" + self.escape(business_rule) + "'>\n" \
-        + "    <dmn:question>" + self.xml_escape(business_rule) + "</dmn:question>" \
-        + "    <dmn:usingTask href='" + trigger_url + "'/>" \
-        + "    <dmn:decisionTable id='" + self.name_to_id(dmn_dt_id) + "'>\n" \
-        + "\n      ".join(dmn['input']) + "\n" \
-        + "\n      ".join(dmn['output']) + "\n" \
-        + "\n      ".join(dmn['rule']) + "\n" \
-        + "    </dmn:decisionTable>\n" \
-        + "  </dmn:decision>\n" \
-        + "</dmn:definitions>\n"
-
-    return dmn_out
+    definitions = self.create_dmn_element(None,"definitions",{"namespace":self.installer.get_ig_canonical(),
+                                                              "label":self.escape(business_rule),
+                                                              "id":dmn_tab_id})
+    decision = self.create_dmn_element(definitions,"decision",{"id":dmn_dt_id,"label":self.escape(business_rule)})
+    self.create_dmn_element(decision,"question",{},business_rule)
+    self.create_dmn_element(decision,"usingTask",{"href":trigger_url})
+    decision_table = self.create_dmn_element(decision,"decisionTable",{"id":self.name_to_id(dmn_dt_id)})
+    for part in ['input','output','rule']:
+      for element in dmn[part]:
+        decision_table.append(element)
+
+    return definitions
 
   def get_contra_dmns(self,dt_id,table_type):
-    self.log("rendering contraindication input dmn for decision table ")
+    self.debug("rendering contraindication input dmn for decision table ")
     contra_id = self.name_to_id(table_type + dt_id) 
     contra_dmn_id = "input." + contra_id  + "."
-    contra_dmn = "<dmn:input id='" + contra_dmn_id + "' label='" + self.xml_escape(table_type) + "'></dmn:input>"    
+    contra_dmn = self.create_dmn_element(None,"input",{"id":contra_dmn_id,"label":table_type})
     return [contra_dmn]
 
 
@@ -610,7 +634,7 @@ class dt_extractor(extractor):
     for val in rule['inputs']:
       if self.is_blank(val) or self.is_dash(val) or self.is_nan(val):
         continue
-      self.log("Adding contra '" + str(val) + "'")
+      self.debug("Adding contra '" + str(val) + "'")
       rule_dmn_entries.append(self.create_dmn_entry(tab_id,dt_id,rule_name,"input",str(val)))
 
     rule_dmn_entries.append(self.create_dmn_entry(tab_id,dt_id,rule_name,"output",rule['output']))
@@ -631,7 +655,7 @@ class dt_extractor(extractor):
 
     
   def get_dmn_input_rule(self,tab_id:str,dt_id:str,row_offset,rule):
-    self.log(rule)
+    self.debug(rule)
     rule_data = "".join(rule['inputs'])
     for k in ['output','guidance','annotation','reference']:
       if  isinstance(rule[k],str):
@@ -640,7 +664,7 @@ class dt_extractor(extractor):
 
     rule_dmn_entries = []            
     for val in rule['inputs']:
-      self.log("Processing input defintion: " + str(val))
+      self.debug("Processing input defintion: " + str(val))
       rule_dmn_entries.append(self.create_dmn_entry(tab_id,dt_id,rule_name,"input",val))
 
     rule_dmn_entries.append(self.create_dmn_entry(tab_id,dt_id,rule_name,"output",rule['output']))
@@ -661,7 +685,7 @@ class dt_extractor(extractor):
       if self.is_blank(val) or self.is_dash(val) or self.is_nan(val):
         continue
 
-      self.log("Processing input defintion: " + str(val))
+      self.debug("Processing input defintion: " + str(val))
       
       val_id = str(val).strip()
       parts = val_id.split("\n",1)
@@ -672,19 +696,15 @@ class dt_extractor(extractor):
         val_definition = val_id
 
       val_id = self.escape_code(val_id)
-      self.log("Found code(" + val_id + ")")
-      if not tab_id in self.cql_definitions:
-        self.cql_definitions[tab_id] = {}
-      if not dt_id in self.cql_definitions[tab_id]:
-        self.cql_definitions[tab_id][dt_id] = {}
-      self.cql_definitions[tab_id][dt_id][val_id] = val_definition
+      self.debug("Found code(" + val_id + ")")
+      self.cql_symbols.add(tab_id,dt_id,val_id,val_definition)
 
       input_dmns.append(self.create_dmn_input_expression(dt_id,val_id,val_definition))
-      self.log("Added CQL with:\n\tTAB_ID="  + tab_id + "\n\tDT_ID=" + dt_id + "\n\tNAME=" + val_id + "\n\tEXPR=" + val_definition)
+      self.debug("Added CQL with:\n\tTAB_ID="  + tab_id + "\n\tDT_ID=" + dt_id + "\n\tNAME=" + val_id + "\n\tEXPR=" + val_definition)
     return input_dmns
 
   def get_fsh_conditions(self,inputs):
-    fsh_conditions = ""
+    fsh_conditions = fsh_emitter()
     for input in inputs:
       if self.is_blank(input) or self.is_dash(input):
         continue
@@ -694,37 +714,36 @@ class dt_extractor(extractor):
         input_name = parts[0].strip()
         input_id = self.name_to_id(input_name)
         condition = self.escape(input_id)
-        fsh_conditions += '  * condition[+]\n'
-        fsh_conditions += '    * kind = #applicability\n'
-        fsh_conditions += '  * expression\n'
-        fsh_conditions += f"    * description = \"\"\"{condition}\"\"\"\n"
-        fsh_conditions += '    * language = #text/cql-identifier\n'
-        fsh_conditions += f"    * expression = \"\"\"{condition}\"\"\"\n"
-        print(fsh_conditions)
+        fsh_conditions.rule('condition[+]',None,1)
+        fsh_conditions.rule('kind','#applicability',2)
+        fsh_conditions.rule('expression',None,1)
+        fsh_conditions.rule('description',fsh_conditions.triple_quote(condition),2)
+        fsh_conditions.rule('language','#text/cql-identifier',2)
+        fsh_conditions.rule('expression',fsh_conditions.triple_quote(condition),2)
+        print(fsh_conditions.getvalue())
         sys.exit(99)
-    return fsh_conditions
+    return fsh_conditions.getvalue()
 
-  def get_fsh_plan(self,tab_id,dt_id,lib_id,name):
+  def get_fsh_plan(self,tab_id,dt_id,lib_id,name,fsh_plan):
     version = self.installer.get_ig_version()
     publisher = self.escape(self.installer.get_ig_publisher())
     e_name = self.escape(name)
-    fsh_plan =  f"Instance: {dt_id}\n"
-    fsh_plan += "InstanceOf: $SGDecisionTable\n"
-    fsh_plan += f"Title: \"Decision Table {e_name}\"\n"
-    fsh_plan += 'Description: """' + self.markdown_escape(name) + ' """\n'
-    fsh_plan += "Usage: #definition\n"
-    #fsh_plan += "* ^abstract = true\n"
-    fsh_plan += '* meta.profile[+] = "http://hl7.org/fhir/uv/crmi/StructureDefinition/crmi-shareableplandefinition"\n'
-    fsh_plan += '* meta.profile[+] = "http://hl7.org/fhir/uv/crmi/StructureDefinition/crmi-publishableplandefinition"\n'
-    fsh_plan += f"* library = Canonical({tab_id})\n"
-    fsh_plan += "* extension[+]\n"
-    fsh_plan += '  * url = "http://hl7.org/fhir/uv/cpg/StructureDefinition/cpg-knowledgeCapability"\n'
-    fsh_plan += '  * valueCode = #computable\n'
-    fsh_plan += '* version = "{version}"\n'
-    fsh_plan += f"* name = \"{dt_id}\"\n"
-    fsh_plan += '* status = #draft\n'
-    fsh_plan += '* experimental = false\n'
-    fsh_plan += f"* publisher = \"{publisher}\"\n"
+    fsh_plan.instance(dt_id,"$SGDecisionTable",
+                      title=fsh_plan.quote(f"Decision Table {e_name}"),
+                      description=fsh_plan.triple_quote(self.markdown_escape(name) + ' '),
+                      usage="#definition")
+    #fsh_plan.rule("^abstract","true")
+    fsh_plan.rule("meta.profile[+]",fsh_plan.quote("http://hl7.org/fhir/uv/crmi/StructureDefinition/crmi-shareableplandefinition"))
+    fsh_plan.rule("meta.profile[+]",fsh_plan.quote("http://hl7.org/fhir/uv/crmi/StructureDefinition/crmi-publishableplandefinition"))
+    fsh_plan.rule("library",f"Canonical({tab_id})")
+    fsh_plan.rule("extension[+]")
+    fsh_plan.rule("url",fsh_plan.quote("http://hl7.org/fhir/uv/cpg/StructureDefinition/cpg-knowledgeCapability"),1)
+    fsh_plan.rule("valueCode","#computable",1)
+    fsh_plan.rule("version",fsh_plan.quote("{version}"))
+    fsh_plan.rule("name",fsh_plan.quote(dt_id))
+    fsh_plan.rule("status","#draft")
+    fsh_plan.rule("experimental","false")
+    fsh_plan.rule("publisher",fsh_plan.quote(publisher))
 
     return fsh_plan
 
@@ -734,12 +753,21 @@ class dt_extractor(extractor):
   def get_output_activity_id(self,output_name):
     return self.name_to_id(self.prefix  + "O." + output_name)
   
-  def get_fsh_rule(self,rule:dict):
-    fsh_rules = ""
+  def get_fsh_dynamic_value(self,fsh_rules,path:str,language:str,expression:str,description = None):
+    fsh_rules.rule("dynamicValue[+]",None,1)
+    fsh_rules.rule("path",fsh_rules.quote(path),2)
+    fsh_rules.rule("expression",None,2)
+    if description is not None:
+      fsh_rules.rule("description",fsh_rules.quote(description),3)
+    fsh_rules.rule("language",language,3)
+    fsh_rules.rule("expression",expression,3)
+    return fsh_rules
+
+  def get_fsh_rule(self,rule:dict,fsh_rules):
     fsh_conditions = self.get_fsh_conditions(rule)
 
     if self.is_blank(rule['output']):
-      self.log("ERROR: misformed decision table near rule=" + str(rule))
+      self.error("ERROR: misformed decision table near rule=" + str(rule))
       sys.exit(44)
 
     output_name = str(rule['output']).strip()
@@ -758,68 +786,60 @@ class dt_extractor(extractor):
     description = self.markdown_escape(rule['output'] + "\n" + description)
     title = self.escape(output_name)
     a_id = self.get_output_activity_id(output_name)
-    fsh_rules +=  "* action[+]\n"
-    fsh_rules += f"  * title = \"{title}\"\n"
-    fsh_rules += f"  * description = \"\"\"{description}\"\"\"\n"
-    fsh_rules += f"  * definitionCanonical = Canonical({a_id})\n"
-    fsh_rules +=  "  * dynamicValue[+]\n"
-    fsh_rules +=  "    * path = \"status\"\n"
-    fsh_rules +=  "    * expression\n"
-    fsh_rules +=  "      * language = #text/cql-expression\n"
-    fsh_rules +=  "      * expression = \"draft\"\n"
-    fsh_rules +=  "  * dynamicValue[+]\n"
-    fsh_rules +=  "    * path = \"intent\"\n"
-    fsh_rules +=  "    * expression\n"
-    fsh_rules +=  "      * language = #text/cql-expression\n"
-    fsh_rules +=  "      * expression = \"proposal\"\n"
-
-    fsh_rules += fsh_conditions
+    fsh_rules.rule("action[+]")
+    fsh_rules.rule("title",fsh_rules.quote(title),1)
+    fsh_rules.rule("description",fsh_rules.triple_quote(description),1)
+    fsh_rules.rule("definitionCanonical",f"Canonical({a_id})",1)
+    self.get_fsh_dynamic_value(fsh_rules,"status","#text/cql-expression",fsh_rules.quote("draft"))
+    self.get_fsh_dynamic_value(fsh_rules,"intent","#text/cql-expression",fsh_rules.quote("proposal"))
+
+    fsh_rules.write(fsh_conditions)
 
     if not self.is_blank(rule['guidance']):
       text = self.markdown_escape(rule['guidance'])
-      fsh_rules += "* action[+]\n"
-      fsh_rules += "  * title = \"Health worker guidance\"\n"
-      fsh_rules += "  * description = \"Communicate guidance to the health worker\"\n"
-      fsh_rules += "  * definitionCanonical = Canonical(SGDecisionTableGuidance)\n"
-      fsh_rules += "  * dynamicValue[+]\n"
-      fsh_rules += "    * path = \"status\"\n"
-      fsh_rules += "    * expression\n"
-      fsh_rules += "      * language = #text/cql-expression\n"
-      fsh_rules += "      * expression = \"active\"\n"
-      fsh_rules += "  * dynamicValue[+]\n"
-      fsh_rules += "    * path = \"payload.contentString\"\n"
-      fsh_rules += "    * expression\n"
-      fsh_rules += "      * language = #text/cql-identifier\n"
-      fsh_rules += f"      * expression = \"\"\"{text}\"\"\"\n"
-      fsh_rules += "  * dynamicValue[+]\n"
-      fsh_rules += "    * path = \"category.coding\"\n"
-      fsh_rules += "    * expression\n"
-      fsh_rules += "      * description = \"Category of communication\"\n"
-      fsh_rules += "      * language = #text/cql-expression\n"
-      fsh_rules += "      * expression = \"Code { system: 'http://terminology.hl7.org/CodeSystem/communication-category', code: 'alert' }\"\n"
-      fsh_rules += "  * dynamicValue[+]\n"
-      fsh_rules += "    * path = \"priority\"\n"
-      fsh_rules += "    * expression\n"
-      fsh_rules += "      * description = \"Alert priority\"\n"
-      fsh_rules += "      * language = #text/cql-expression\n"
-      fsh_rules += "      * expression = \"Code { system: 'http://hl7.org/fhir/request-priority', code: 'routine' }\"\n"      
-      fsh_rules += fsh_conditions
+      fsh_rules.rule("action[+]")
+      fsh_rules.rule("title",fsh_rules.quote("Health worker guidance"),1)
+      fsh_rules.rule("description",fsh_rules.quote("Communicate guidance to the health worker"),1)
+      fsh_rules.rule("definitionCanonical","Canonical(SGDecisionTableGuidance)",1)
+      self.get_fsh_dynamic_value(fsh_rules,"status","#text/cql-expression",fsh_rules.quote("active"))
+      self.get_fsh_dynamic_value(fsh_rules,"payload.contentString","#text/cql-identifier",fsh_rules.triple_quote(text))
+      self.get_fsh_dynamic_value(fsh_rules,"category.coding","#text/cql-expression",
+                                 fsh_rules.quote("Code { system: 'http://terminology.hl7.org/CodeSystem/communication-category', code: 'alert' }"),
+                                 "Category of communication")
+      self.get_fsh_dynamic_value(fsh_rules,"priority","#text/cql-expression",
+                                 fsh_rules.quote("Code { system: 'http://hl7.org/fhir/request-priority', code: 'routine' }"),
+                                 "Alert priority")
+      fsh_rules.write(fsh_conditions)
     return fsh_rules
 
-  def get_fsh_citations(self,rule):
+  def get_fsh_citations(self,rule,fsh):
     if not self.is_blank(rule['reference']):
       citation = rule['reference']
-      fsh =  "* relatedArtifact[+]\n"
-      fsh += "  * type = #citation\n"
-      fsh += f"  * citation = \"\"\"{citation}\"\"\"\n"
-      return fsh
-    else:
-      return ""
+      fsh.rule("relatedArtifact[+]")
+      fsh.rule("type","#citation",1)
+      fsh.rule("citation",fsh.triple_quote(citation),1)
+    return fsh
         
+  def create_dmn_element(self,parent,tag:str,attributes = {},text = None):
+    # DMN builder: a dmn:tag element, appended to parent unless parent is None.
+    # Attribute values and text are escaped by lxml on output.
+    import lxml.etree as ET   # loaded on first use, not needed to find the workbooks
+    if parent is None:
+      element = ET.Element(ET.QName(self.installer.dmn_namespace,tag),nsmap={'dmn':self.installer.dmn_namespace})
+    else:
+      element = ET.SubElement(parent,ET.QName(self.installer.dmn_namespace,tag))
+    for name,value in attributes.items():
+      element.set(name,self.installer.xml_safe(value))
+    if text is not None:
+      element.text = self.installer.xml_safe(text)
+    return element
+
   def create_dmn_rule(self,rule_name:str,rule_dmn_entries):
     rule_id = self.name_to_id(rule_name)
     rule_dmn_id = "rule." + rule_id
-    rule_dmn = "<dmn:rule id='" + rule_dmn_id + "'>" + "\n".join(rule_dmn_entries)  + "</dmn:rule>"
+    rule_dmn = self.create_dmn_element(None,"rule",{"id":rule_dmn_id})
+    for entry in rule_dmn_entries:
+      rule_dmn.append(entry)
     return rule_dmn
 
 
@@ -835,26 +855,16 @@ class dt_extractor(extractor):
 
 
       name = self.escape_code(name)
-      self.log("Found entry code(" + name + ")")
+      self.debug("Found entry code(" + name + ")")
       if not (self.is_dash(name) or self.is_blank(name) or self.is_nan(name)):
-        if not tab_id in self.cql_definitions:
-          self.cql_definitions[tab_id] = {}
-        if not dt_id in self.cql_definitions[tab_id]:
-          self.cql_definitions[tab_id][dt_id] = {}
-        self.cql_definitions[tab_id][dt_id][name] = expr
-        self.cql_definitions_by_type[type][name] = expr
-
-        self.log("Added CQL via dmn with:\n\tTAB_ID="  + tab_id + "\n\tDT_ID=" + dt_id + "\n\tNAME=" + name + "\n\tEXPR=" + expr)
-
-    id = self.name_to_id(rule_name + "." + str(name))
-    dmn_id = type + "Entry."  + id
-    #dmn = "<dmn:" + type  + "Entry id='" + dmn_id + "' expressionLanguage='http://smart.who.int'>"
-    #dmn = "<dmn:" + type  + "Entry id='" + dmn_id + "'>"
-    dmn = "<dmn:" + type  + "Entry>"
+        self.cql_symbols.add(tab_id,dt_id,name,expr,type)
+
+        self.debug("Added CQL via dmn with:\n\tTAB_ID="  + tab_id + "\n\tDT_ID=" + dt_id + "\n\tNAME=" + name + "\n\tEXPR=" + expr)
+
+    dmn = self.create_dmn_element(None,type + "Entry")
     if expr:
-      dmn += "<dmn:description>" + self.xml_escape(expr) + "</dmn:description>"
-    dmn += "<dmn:text>" + self.xml_escape(name) + "</dmn:text>" 
-    dmn += "</dmn:" + type + "Entry>"
+      self.create_dmn_element(dmn,"description",{},expr)
+    self.create_dmn_element(dmn,"text",{},name if isinstance(name,str) else "")
     return dmn
 
 
@@ -863,10 +873,9 @@ class dt_extractor(extractor):
     id = self.name_to_id(name)              
     dmn_id = type + "." +  dt_id + "." + id
     dmn_expr_id = type + "Expression." + dt_id + "." + id 
-    dmn = "<dmn:" + type + " id='" + dmn_id + "' label='"+ self.xml_escape(name) + "'>"
+    dmn = self.create_dmn_element(None,type,{"id":dmn_id,"label":name})
     if expr:
-      dmn += "<dmn:description >" + expr + "</dmn:description>" 
-    dmn += "</dmn:" + type + ">"      
+      self.create_dmn_element(dmn,"description",{},expr)
     return dmn
 
   def create_dmn_input_expression(self,dt_id:str,name:str, expr:str):
@@ -874,9 +883,8 @@ class dt_extractor(extractor):
     id = self.name_to_id(name)              
     dmn_id = type + "." +  dt_id + "." + id
     dmn_expr_id = type + "Expression." + dt_id + "." + id 
-    dmn = "<dmn:" + type + " id='" + dmn_id + "' label='"+ self.xml_escape(name) + "'>"
+    dmn = self.create_dmn_element(None,type,{"id":dmn_id,"label":name})
     if expr:
-      dmn += "<dmn:" + type + "Expression id='" + dmn_expr_id \
-        + "' typeRef='string'><dmn:text>" + expr + "</dmn:text></dmn:" + type + "Expression>" 
-    dmn += "</dmn:" + type + ">"      
+      expression = self.create_dmn_element(dmn,type + "Expression",{"id":dmn_expr_id,"typeRef":"string"})
+      self.create_dmn_element(expression,"text",{},expr)
     return dmn
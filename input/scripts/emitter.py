@@ -0,0 +1,56 @@
+import io
+
+class emitter(object):
+  # Streaming text output.  Lines are written to a buffer (or to a file handle
+  # passed as out) instead of being accumulated with repeated string
+  # concatenation, which copies the whole text for every line added.
+
+  def __init__(self,out = None):
+    self.out = out if out is not None else io.StringIO()
+
+  def write(self,text:str):
+    self.out.write(text)
+    return self
+
+  def line(self,text:str = "",indent:int = 0):
+    self.out.write("  " * indent + text + "\n")
+    return self
+
+  def getvalue(self):
+    return self.out.getvalue()
+
+
+class fsh_emitter(emitter):
+  # FSH specific helpers.  Values are written as given: the caller is
+  # responsible for escaping them.
+
+  def quote(self,value:str):
+    return '"' + value + '"'
+
+  def triple_quote(self,value:str):
+    return '"""' + value + '"""'
+
+  def header(self,keyword:str,value:str):
+    # e.g. Instance: id, InstanceOf: profile, Title: "title"
+    return self.line(keyword + ": " + value)
+
+  def instance(self,id:str,instance_of:str,title = None,description = None,usage = None):
+    self.header("Instance",id)
+    self.header("InstanceOf",instance_of)
+    if title is not None:
+      self.header("Title",title)
+    if description is not None:
+      self.header("Description",description)
+    if usage is not None:
+      self.header("Usage",usage)
+    return self
+
+  def rule(self,path:str,value = None,indent:int = 0):
+    # * path = value, or just * path when there is no value
+    if value is None:
+      return self.line("* " + path,indent)
+    return self.line("* " + path + " = " + value,indent)
+
+  def comment(self,text:str):
+    return self.line("//" + text)
+
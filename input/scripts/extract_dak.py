@@ -1,31 +1,276 @@
 #!/usr/bin/env python3
 
 
-from installer import installer
-from req_extractor import req_extractor 
-from dt_extractor import dt_extractor 
+from logger import logger
 import getopt
 import sys
 
 def usage():
     print("Usage: scans for source DAK L2 content for extraction ")
     print("OPTIONS:")
-    print(" none")
+    print("--force|f : extract every workbook, ignoring the results of previous runs")
+    print("--jobs|j N : extract workbooks in N worker processes (default 1)")
+    print("--log-level|l LEVEL : messages shown on stderr: DEBUG, INFO, WARN or ERROR (default WARN)")
+    print("--log-file-level LEVEL : messages written to the log file (default INFO)")
+    print("--verbose|v : same as --log-level INFO")
+    print("--validate-dmn : validate the generated DMN against includes/DMN16.xsd")
+    print("--profile : time the extraction stages, print a summary and write a Chrome trace")
+    print("--profile-trace FILE : Chrome trace file written by --profile (default temp/DAKExtract.trace.json)")
+    print("--profile-dump FILE : write cProfile statistics of the main process to FILE (read with pstats)")
+    print("--input-root DIR : IG directory to read the sushi config, workbooks, CQL and FSH from (default .)")
+    print("--output-root DIR : IG directory to write the generated files and temp/ to (default the input root)")
+    print("--watch : keep running and extract again whenever a workbook, CQL file or the sushi config changes")
+    print("--watch-interval SECONDS : how often --watch polls for changes (default 1)")
     print("--help|h : print this information")
     sys.exit(2)
 
 
+def get_extractors():
+    # extractors in the order they are run, keyed by the name used for worker
+    # tasks.  The installer and extractor modules are only imported once the
+    # options are parsed, so that --help does not wait for them.
+    from req_extractor import req_extractor
+    from dt_extractor import dt_extractor
+    return {'req':req_extractor, 'dt':dt_extractor}
+
+
+def extract_workbook(settings,task):
+    # runs in a worker process, or in the main process with a single job:
+    # extract a single workbook into a fresh installer and return what it
+    # collected as picklable results.  settings are the log level, profile
+    # flag and IG roots of the run.
+    extractor_name,inputfile_name = task
+    from installer import installer
+    ins = installer(logfile_path=None,stderr_level=None,record_level=settings['log_level'],profile=settings['profile'],
+                    input_root=settings['input_root'],output_root=settings['output_root'])
+    ext = get_extractors()[extractor_name](ins)
+    ext.extract_workbook(inputfile_name)
+    return {'installer':ins.get_results(), 'extractor':ext.get_results()}
+
+
+def get_tasks(exts):
+    tasks = []
+    for extractor_name,ext in exts.items():
+        tasks.extend((extractor_name,inputfile_name) for inputfile_name in ext.find_files())
+    return tasks
+
+
+def extract_tasks(ins,tasks,jobs,log_level,profile,pool = None):
+    # every workbook is extracted into its own installer and extractor, so
+    # worker processes can take any number of tasks and a single job runs in
+    # the main process without the cost of a pool.  A pool that is passed in
+    # (--watch) is kept, with the modules its workers imported.
+    settings = {'log_level':log_level, 'profile':profile,
+                'input_root':ins.input_root, 'output_root':ins.output_root}
+    if jobs <= 1:
+        ins.log("Extracting " + str(len(tasks)) + " workbook(s) in the main process")
+        return [extract_workbook(settings,task) for task in tasks]
+    ins.log("Extracting " + str(len(tasks)) + " workbook(s) with " + str(jobs) + " worker processes")
+    import functools
+    if pool is not None:
+        return pool.map(functools.partial(extract_workbook,settings),tasks,chunksize=1)
+    import multiprocessing
+    with multiprocessing.Pool(processes=min(jobs,len(tasks))) as pool:
+        return pool.map(functools.partial(extract_workbook,settings),tasks,chunksize=1)
+
+
 def main():
     try:
-        opts,args = getopt.getopt(sys.argv[1:], "h", ["help"])
+        opts,args = getopt.getopt(sys.argv[1:], "hfj:l:v",
+                                  ["help","force","jobs=","log-level=","log-file-level=","verbose","validate-dmn",
+                                   "profile","profile-trace=","profile-dump=","input-root=","output-root=",
+                                   "watch","watch-interval="])
     except getopt.GetoptError:
         usage()
 
-    ins = installer()
+    jobs = 1
+    force = False
+    stderr_level = logger.WARN
+    file_level = logger.INFO
+    validate_dmn = False
+    profile = False
+    profile_trace = None
+    profile_dump = None
+    input_root = ""
+    output_root = None
+    watch_interval = None
+    for opt,arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+        elif opt in ("-f", "--force"):
+            force = True
+        elif opt in ("-j", "--jobs"):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                usage()
+        elif opt in ("-l", "--log-level"):
+            stderr_level = logger.get_level(arg)
+            if stderr_level is None:
+                usage()
+        elif opt == "--log-file-level":
+            file_level = logger.get_level(arg)
+            if file_level is None:
+                usage()
+        elif opt in ("-v", "--verbose"):
+            stderr_level = min(stderr_level,logger.INFO)
+        elif opt == "--validate-dmn":
+            validate_dmn = True
+        elif opt == "--profile":
+            profile = True
+        elif opt == "--profile-trace":
+            profile = True
+            profile_trace = arg
+        elif opt == "--profile-dump":
+            profile_dump = arg
+        elif opt == "--input-root":
+            input_root = arg
+        elif opt == "--output-root":
+            output_root = arg
+        elif opt == "--watch":
+            watch_interval = watch_interval or 1.0
+        elif opt == "--watch-interval":
+            try:
+                watch_interval = float(arg)
+            except ValueError:
+                usage()
+            if watch_interval <= 0:
+                usage()
+
+    if profile_dump:
+        import cProfile
+        main_profile = cProfile.Profile()
+        main_profile.enable()
+    options = {'jobs':jobs, 'file_level':file_level, 'stderr_level':stderr_level,
+               'validate_dmn':validate_dmn, 'profile':profile}
+    if watch_interval is None:
+        ins = run(input_root,output_root,force=force,**options)
+        if profile:
+            print_profile(ins,profile_trace)
+    else:
+        watch(input_root,output_root,watch_interval,force=force,profile_trace=profile_trace,**options)
+
+    if profile_dump:
+        main_profile.disable()
+        main_profile.dump_stats(profile_dump)
+        print("cProfile statistics written to: " + profile_dump)
+
+
+def print_profile(ins,profile_trace = None):
+    if profile_trace is None:
+        profile_trace = ins.get_output_path("temp/DAKExtract.trace.json")
+    ins.record_id_stats()
+    print(ins.profiler.get_summary())
+    ins.profiler.save_trace(profile_trace)
+    print("Chrome trace written to: " + profile_trace)
+
+
+def watch(input_root,output_root,interval,force = False,profile_trace = None,**options):
+    # extracts, then polls the workbooks, CQL and sushi config and extracts
+    # again after each change until interrupted.  The process keeps what the
+    # runs have in common: the imported modules, the worker pool and the
+    # parsed and compiled DMN stylesheet.  Unchanged workbooks are taken from
+    # the manifest, so only the changed ones are extracted again.
+    import os
+    import time
+    from watcher import watcher
+    pool = None
+    if options['jobs'] > 1:
+        import multiprocessing
+        import signal
+        # Ctrl-C stops the parent, which terminates the workers
+        pool = multiprocessing.Pool(processes=options['jobs'],initializer=signal.signal,
+                                    initargs=(signal.SIGINT,signal.SIG_IGN))
+    files = watcher(input_root,interval)
+    changes = None
+    try:
+        while True:
+            start = time.perf_counter()
+            # files saved while extracting are changes to the next run
+            files.snapshot = files.scan()
+            try:
+                ins = run(input_root,output_root,force=force,pool=pool,**options)
+            except (Exception,SystemExit) as e:
+                # the extractors exit on some malformed input: report it and wait for a fix
+                print("Extraction failed: " + (str(e) or type(e).__name__), file=sys.stderr)
+            else:
+                print("Extracted in " + format(time.perf_counter() - start,".2f") + "s")
+                if options['profile']:
+                    print_profile(ins,profile_trace)
+                if os.path.realpath(ins.get_input_path("")) == os.path.realpath(ins.get_output_path("")):
+                    files.ignore(ins.installed_files)
+            force = False
+            if changes is None:
+                print("Watching " + ", ".join(watcher.watched_dirs + watcher.watched_files)
+                      + " for changes (Ctrl-C to stop)")
+            changes = files.wait()
+            print("Changed: " + ", ".join(changes))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def run(input_root = "",output_root = None,jobs = 1,force = False,file_level = logger.INFO,stderr_level = logger.WARN,
+        validate_dmn = False,profile = False,pool = None):
+    # extracts the DAK of the IG at input_root into the IG at output_root
+    # (both default to the current directory) and returns the installer.
+    # Runs share no state, so a long running process may call run() for any
+    # number of IGs, one after the other or from several threads.  pool is a
+    # multiprocessing pool to extract in with several jobs, see watch().
+    from installer import installer
+    from manifest import manifest
+    ins = installer(file_level=file_level,stderr_level=stderr_level,profile=profile,
+                    input_root=input_root,output_root=output_root)
+    if validate_dmn:
+        ins.enable_dmn_validation()
+
+    exts = {extractor_name:extractor_class(ins) for extractor_name,extractor_class in get_extractors().items()}
+    tasks = get_tasks(exts)
+    extraction_manifest = manifest(ins)
+    if force:
+        extraction_manifest.clear()
+    if not force and not validate_dmn and extraction_manifest.is_unchanged(tasks):
+        ins.log("No workbook, CQL or configuration changes since the last extraction. Nothing to do.")
+    else:
+        extract(ins,exts,tasks,extraction_manifest,jobs,min(file_level,stderr_level),profile,pool)
+    ins.logger.close()
+    return ins
+
+
+def extract(ins,exts,tasks,extraction_manifest,jobs,log_level,profile,pool = None):
+    results = {}
+    for task in tasks:
+        results[task] = extraction_manifest.get_cached_results(*task)
+    pending = [task for task in tasks if results[task] is None]
+    if len(pending) > 0:
+        with ins.profiler.stage("extract"):
+            extracted = extract_tasks(ins,pending,jobs,log_level,profile,pool)
+        for task,result in zip(pending,extracted):
+            results[task] = result
+            extraction_manifest.record_results(*task,result)
+
+    # merge in task order so the output is identical to a serial run
+    with ins.profiler.stage("merge"):
+        for extractor_name,inputfile_name in tasks:
+            ins.merge_results(results[(extractor_name,inputfile_name)]['installer'])
+            exts[extractor_name].merge_results(results[(extractor_name,inputfile_name)]['extractor'])
+    with ins.profiler.stage("finalize"):
+        for ext in exts.values():
+            ext.finalize()
+    with ins.profiler.stage("resolve_references"):
+        ins.resolve_references(extraction_manifest.get_previously_installed())
+    with ins.profiler.stage("install"):
+        ins.install()
+    ins.remove_stale_files(extraction_manifest.get_previously_installed())
+    ins.log_output_summary()
+    ins.save_diagnostics([inputfile_name for extractor_name,inputfile_name in tasks])
 
-    req_extractor(ins).extract()    
-    dt_extractor(ins).extract()
-    ins.install()
+    extraction_manifest.record_installed(ins.installed_files)
+    extraction_manifest.save()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 import re
 import os
-import pandas as pd
 from installer import installer
+from logger import logger
+from workbook import workbook
+from header_matcher import header_matcher
 
 class extractor(object):
 
   inputfile_name = ""
+  workbook = None
   class_cs = "http://smart.who.int/base/CodeSystem/CDHIv1"
 
 
@@ -14,10 +17,59 @@ class extractor(object):
 
   def extract(self):
     for inputfile_name in self.find_files():
-      self.log('IF=' + inputfile_name)
-      self.inputfile_name = inputfile_name
-      self.extract_file()
-    pass
+      self.extract_workbook(inputfile_name)
+    self.finalize()
+
+  def extract_workbook(self,inputfile_name):
+    self.log('IF=' + inputfile_name)
+    self.inputfile_name = inputfile_name
+    self.installer.profiler.workbook = inputfile_name
+    self.installer.workbook = inputfile_name
+    with self.profile("open_workbook"):
+      opened = self.open_workbook()
+    if not opened:
+      self.installer.profiler.workbook = None
+      self.installer.workbook = None
+      return False
+    with self.profile("extract_file"):
+      result = self.extract_file()
+    self.workbook.close()
+    self.workbook = None
+    self.installer.profiler.workbook = None
+    self.installer.workbook = None
+    return result
+
+  def profile(self,stage:str):
+    # times a stage when profiling is enabled, e.g. with self.profile("load_tab"): ...
+    return self.installer.profiler.stage(stage)
+
+  def finalize(self):
+    # called once after all of the workbooks have been extracted
+    return True
+
+  def get_results(self):
+    # picklable extraction state held by the extractor rather than the installer
+    return {}
+
+  def merge_results(self,results):
+    return True
+
+  def get_source(self,location = None):
+    # where a generated resource comes from, recorded by installer.add_resource()
+    return {'workbook':self.inputfile_name,'location':location}
+
+  def new_workbook(self):
+    return workbook(self.installer.get_input_path(self.inputfile_name))
+
+  def open_workbook(self):
+    # parse the workbook once; every sheet / header row probe reuses it
+    try:
+      self.workbook = self.new_workbook()
+    except Exception as e:
+      self.diagnose(logger.ERROR,"Could not open workbook " + self.inputfile_name + ": " + str(e))
+      self.workbook = None
+      return False
+    return True
 
   def get_aliases(self):
       return []
@@ -25,9 +77,11 @@ class extractor(object):
   
   def __init__(self,installer:installer):
     self.installer = installer
+    self.header_matchers = {}
+    self.headers = None   # sheet, header row and column positions found by find_headers()
     aliases = self.installer.get_base_aliases()
     aliases.extend(self.get_aliases())
-    self.log("Aliases",aliases)
+    self.debug("Aliases",aliases)
     self.installer.add_aliases(aliases)
 
 
@@ -36,18 +90,14 @@ class extractor(object):
 
     
 
-  # see https://www.youtube.com/watch?v=EnSu9hHGq5o&t=1184s&ab_channel=NextDayVideo
-  def generate_pairs_from_lists(self,lista,listb):
-    for a in lista:
-        for b in listb:
-            yield a,b
-
-  def generate_pairs_from_column_maps(self,column_maps):
-    for desired_column_name,possible_column_names in column_maps.items():
-        for possible_column_name in possible_column_names:
-            yield desired_column_name,possible_column_name
+  def get_header_matcher(self,column_maps):
+    # column_maps are compiled once per extractor
+    key = tuple((k,tuple(v)) for k,v in column_maps.items())
+    if not key in self.header_matchers:
+      self.header_matchers[key] = header_matcher(column_maps,self.name_to_lower_key)
+    return self.header_matchers[key]
 
-  def retrieve_data_frame_by_headers(self,column_maps,sheet_names,header_offsets = [0,1,2]):
+  def find_headers(self,column_maps,sheet_names,header_offsets = [0,1,2]):
     # sheet_names is an array of potential excel sheet names to look for data on
     #
     # example column_maps which has key the desired column name, value is an array of potential matching names
@@ -59,63 +109,108 @@ class extractor(object):
     #     'i-want': ["I want","I want to"],
     #     'so-that':["So that"]
     #     }
+    #
+    # returns (sheet name, header row, map of header cell -> desired column name) or None
 
-    self.log("Seeking the following input data columns ", column_maps, header_offsets)
-    for sheet_name, header_row in self.generate_pairs_from_lists(sheet_names,header_offsets):
-        self.log("Checking sheetname/header row #: " + sheet_name +  "/"+ str(header_row))
-        try:
-            data_frame = pd.read_excel(self.inputfile_name, sheet_name=sheet_name, header=header_row)
-        except Exception as e:
-            self.log("Could not open sheet " + sheet_name + " on header row ", header_row)
-            self.log(e)
+    self.debug("Seeking the following input data columns ", column_maps, header_offsets)
+    if self.workbook is None:
+      self.warn("No workbook open for " + self.inputfile_name)
+      return None
+    matcher = self.get_header_matcher(column_maps)
+    near_misses = []
+    for sheet_name in sheet_names:
+        self.debug("Checking sheetname/header rows #: " + sheet_name +  "/"+ str(header_offsets))
+        if self.workbook.get_sheet(sheet_name) is None:
+            self.debug("Could not open sheet " + sheet_name)
             continue
-        
-#        self.log("Opened sheet " + sheet_name +  " on header_row " , header_row, "\nReading columns: ",list(data_frame))    
-
-        true_column_map = {} #this is where we will map current column names to canonicalized/normalied column names        
-        for column in list(data_frame):
-            self.log("Looking at data frame column: ",column)                    
-            column_id = self.name_to_lower_id(column)
-#            self.log("Looking at data frame column id: ",column_id)                                
-            #loop through potential names and try to match desired column
-            for desired_column_name,possible_column_name in self.generate_pairs_from_column_maps(column_maps):
-                possible_column_id = self.name_to_lower_id(possible_column_name)
-                if (possible_column_id == column_id):
-                    #we found what we needed
-                    self.log("Matched input sheet column " + column + " with desired column " + desired_column_name)
-                    self.log("Matched input sheet p_column_i " + str(possible_column_id) + " with  column_i " + str(column_id))
-                    true_column_map[column] =  desired_column_name
-                                  
-            if not column in true_column_map:
-                #we dont need this input/source data frame column
-                #we get rid of it to help normalize for downstream processing
-                data_frame.drop(column,axis='columns', inplace=True)
-#                self.log("Dropped: ",column)
-                continue
-                                  
-#        self.log("Mapping the following columns: ",true_column_map)
-        #normalize column names
-        data_frame = data_frame.rename(columns=true_column_map)
- #       self.log("Normalized Data frame Columns:" , list(data_frame))
-        if ( list(data_frame) != list(column_maps.keys()) ):
-#            self.log("Incorrect headers at ", header_row, " for data frame at " + sheet_name  + "." )
-#            self.log("Received: ", list(data_frame))
+        with self.profile("header_detection"):
+          match = matcher.scan(self.workbook,sheet_name,header_offsets)
+        if not match['found']:
+            near_misses.extend(match['near_misses'])
             continue
-                                       
-        self.log("Found desired column headers at sheet name / header row: " + sheet_name + "/" + str(header_row))
-        #we are happy, return the data frame with normalized column names
-        return data_frame
+        self.log("Found desired column headers at sheet name / header row: " + sheet_name + "/" + str(match['row']))
+        self.headers = {'sheet':sheet_name,'row':match['row'],'positions':match['positions']}
+        #maps current column names to canonicalized/normalied column names
+        return (sheet_name,match['row'],match['columns'])
 
+    near_misses.sort(key=lambda near_miss: len(near_miss['missing']))
+    for near_miss in near_misses[:3]:
+      self.diagnose(logger.WARN,"Closest header candidate: " + matcher.describe_near_miss(near_miss),sheet=near_miss['sheet'])
     #we tried all combinations and failed.
     return None
 
+  def retrieve_data_frame_by_headers(self,column_maps,sheet_names,header_offsets = [0,1,2]):
+    # the data frame below the header row with the desired columns, see find_headers()
+    headers = self.find_headers(column_maps,sheet_names,header_offsets)
+    if headers is None:
+      return None
+    sheet_name,header_row,true_column_map = headers
+    data_frame = self.workbook.get_data_frame(sheet_name,header_row)
+    #we dont need the other input/source data frame columns
+    #we get rid of them to help normalize for downstream processing
+    data_frame = data_frame[[column for column in data_frame.columns if column in true_column_map]]
+    #normalize column names
+    data_frame = data_frame.rename(columns=true_column_map)
+    #we are happy, return the data frame with normalized column names
+    return data_frame
+
+  def retrieve_rows_by_headers(self,column_maps,sheet_names,header_offsets = [0,1,2]):
+    # streaming counterpart of retrieve_data_frame_by_headers() for a
+    # streaming_workbook: an iterator of (index, row) with row a namedtuple
+    # of the desired columns, or None
+    headers = self.find_headers(column_maps,sheet_names,header_offsets)
+    if headers is None:
+      return None
+    sheet_name,header_row,true_column_map = headers
+    return self.workbook.get_rows(sheet_name,header_row,true_column_map)
+
 
-  def log(self,*statements):
+  def log(self,*statements,level = logger.INFO):
+    # the prefix and indentation are only built when the level is enabled;
+    # statements may be callables returning the text
+    if not self.installer.is_log_enabled(level):
+      return
     prefix = self.__class__.__name__ + "(" + os.path.basename(self.inputfile_name) + "):"
+    lines = []
     for statement in statements:
-      statement = str(statement).replace("\n","\n\t")
-      self.installer.log( prefix + statement )
+      statement = self.installer.logger.format(statement).replace("\n","\n\t")
+      lines.append(prefix + statement)
       prefix = "\t"
+    self.installer.log(*lines,level=level)
+
+  def debug(self,*statements):
+    self.log(*statements,level=logger.DEBUG)
+
+  def warn(self,*statements):
+    self.log(*statements,level=logger.WARN)
+
+  def error(self,*statements):
+    self.log(*statements,level=logger.ERROR)
+
+  def diagnose(self,level:int,message:str,sheet = None,cell = None,artifact = None):
+    # logs message and records it as a structured diagnostic of the
+    # workbook, see diagnostics
+    self.log(message,level=level)
+    self.installer.diagnostics.add(logger.get_level_name(level),message,self.inputfile_name or None,sheet,cell,artifact)
+
+  def get_cell_name(self,row:int,col:int):
+    # A1 style name of the cell at 0-based row and column indexes, (13,2) -> 'C14'
+    name = ""
+    col += 1
+    while col > 0:
+      col,rem = divmod(col - 1,26)
+      name = chr(ord('A') + rem) + name
+    return name + str(row + 1)
+
+  def get_row_location(self,index:int,column:str):
+    # sheet and cell of column on data row index below the header row found
+    # by find_headers(), as keyword arguments for diagnose()
+    if self.headers is None:
+      return {}
+    position = self.headers['positions'].get(column)
+    if position is None:
+      return {'sheet':self.headers['sheet']}
+    return {'sheet':self.headers['sheet'],'cell':self.get_cell_name(self.headers['row'] + 1 + index,position)}
 
   def markdown_escape(self,input):
     if not isinstance(input,str):
@@ -147,6 +242,9 @@ class extractor(object):
       
   def name_to_lower_id(self,name):    
     return self.installer.name_to_lower_id(name)
+
+  def name_to_lower_key(self,name):
+    return self.installer.name_to_lower_key(name)
     
   def escape_code(self,input):
     return self.installer.escape_code(input)
@@ -0,0 +1,60 @@
+class header_matcher(object):
+  # Compiled form of a column_maps dictionary, e.g.
+  #   { 'reqid':["Requirement ID","Requirement"], 'as-a': ["As a"], ... }
+  # The possible column names are normalised once into a hash index so that a
+  # header row is matched with one dictionary lookup per cell.
+
+  def __init__(self,column_maps:dict,normalize):
+    self.normalize = normalize
+    self.desired_columns = list(column_maps.keys())
+    self.alias_index = {}
+    for desired_column_name,possible_column_names in column_maps.items():
+      for possible_column_name in possible_column_names:
+        # a later desired column wins if two aliases normalise the same
+        self.alias_index[normalize(possible_column_name)] = desired_column_name
+
+  def match_header(self,header:list):
+    # returns the map of header cell -> desired column name
+    column_map = {}
+    for column in header:
+      column_id = self.normalize(column)
+      if column_id is not None and column_id in self.alias_index:
+        column_map[column] = self.alias_index[column_id]
+    return column_map
+
+  def is_match(self,header:list,column_map:dict):
+    # the matched columns must appear exactly once each and in the order of column_maps
+    return [column_map[column] for column in header if column in column_map] == self.desired_columns
+
+  def scan(self,workbook,sheet_name:str,header_rows):
+    # single pass over the candidate header rows of the raw sheet grid
+    # returns {'found': True, 'row': .., 'columns': .., 'positions': .. } for
+    # the first matching row (positions maps desired column names to their
+    # 0-based column index), otherwise {'found': False, 'near_misses': [...]} with the rows that
+    # matched at least one desired column, best candidates first
+    near_misses = []
+    for header_row in header_rows:
+      header = workbook.get_header_row(sheet_name,header_row)
+      if header is None:
+        continue
+      column_map = self.match_header(header)
+      if self.is_match(header,column_map):
+        positions = {column_map[column]:i for i,column in enumerate(header) if column in column_map}
+        return {'found':True,'sheet':sheet_name,'row':header_row,'columns':column_map,'positions':positions}
+      if len(column_map) > 0:
+        matched = [column_map[column] for column in header if column in column_map]
+        near_misses.append({
+          'sheet':sheet_name,
+          'row':header_row,
+          'matched':matched,
+          'missing':[c for c in self.desired_columns if not c in matched]
+          })
+    near_misses.sort(key=lambda near_miss: len(near_miss['missing']))
+    return {'found':False,'sheet':sheet_name,'near_misses':near_misses}
+
+  def describe_near_miss(self,near_miss:dict):
+    if len(near_miss['missing']) == 0:
+      reason = "all columns found but duplicated or out of order: " + ", ".join(near_miss['matched'])
+    else:
+      reason = "missing column(s): " + ", ".join(near_miss['missing'])
+    return "sheet " + str(near_miss['sheet']) + " row " + str(near_miss['row']) + " " + reason
@@ -0,0 +1,120 @@
+import functools
+import hashlib
+import re
+from logger import logger
+
+class id_table(object):
+  # Normalises names into FHIR ids and codes, e.g.
+  #   name_to_id('Client age (months)') -> 'Clientagemonths'
+  # The same input names, decision table ids and rule data are normalised
+  # over and over while a workbook is extracted, so each normalisation is
+  # memoised in a bounded LRU cache.
+  #
+  # Every id, code and hash is recorded with the first name it was made
+  # from, so that two distinct names ending up with the same id are reported
+  # as a collision instead of silently sharing it.
+
+  cache_size = 4096
+  id_pattern = re.compile('[^0-9a-zA-Z\\-\\.]+')
+  quote_pattern = re.compile(r"['\"]")
+  space_pattern = re.compile(r"\s+")
+
+  def __init__(self,installer,cache_size = None):
+    self.installer = installer
+    size = cache_size if cache_size is not None else self.cache_size
+    self.caches = {'name_to_id':functools.lru_cache(maxsize=size)(self.make_id),
+                   'escape_code':functools.lru_cache(maxsize=size)(self.make_code),
+                   'to_hash':functools.lru_cache(maxsize=size)(self.make_hash),
+                   'name_to_key':functools.lru_cache(maxsize=size)(self.make_key)}
+    self.sources = {'id':{}, 'code':{}, 'hash':{}}   # kind -> id -> first name
+    self.collisions = []   # (kind, id, first name, other name)
+
+  def name_to_id(self,name:str):
+    return self.caches['name_to_id'](name)
+
+  def escape_code(self,input:str):
+    return self.caches['escape_code'](input)
+
+  def name_to_key(self,name:str):
+    return self.caches['name_to_key'](name)
+
+  def to_hash(self,input:str,length:int):
+    return self.caches['to_hash'](input,length)
+
+  def make_id(self,name:str):
+    id = self.id_pattern.sub('',name)
+    # to work around jekyll error, make sure there are no trailing periods...
+    id = id.rstrip('.')
+    if len(id) > 55:
+      # make length of an id is 64 characters
+      #we need to make use of hashes
+      id = self.to_hash(id,55)
+      self.installer.diagnose(logger.INFO,"id too long, hashed to " + id,artifact=name)
+      self.installer.debug("Escaping id " + name + " to " + id )
+    self.add_source('id',id,name)
+    return id
+
+  def make_key(self,name:str):
+    # the id a name would normalise to, unhashed and not recorded: for
+    # comparing labels such as column headers that never end up in an artifact
+    return self.id_pattern.sub('',name).rstrip('.')
+
+  def make_code(self,input:str):
+    original = input
+    input = input.strip()
+    input = self.quote_pattern.sub("",input)
+    #SUSHI BUG on processing codes with double quote.  sushi fails
+    #Example \"Bivalent oral polio vaccine (bOPV)–inactivated polio vaccine (IPV)\" schedule (in countries with high vaccination coverage [e.g. 90–95%] and low importation risk [where neighbouring countries and/or countries that share substantial population movement have a similarly high coverage])"
+
+    input = self.space_pattern.sub(" ",input)
+    if len(input) > 245:
+       # max filename size is 255, leave space for extensions such as .fsh
+      input = self.to_hash(input,245)
+      self.installer.diagnose(logger.INFO,"code too long, hashed to " + input,artifact=original)
+      self.installer.debug("Escaping code " + original + " to " + input )
+    self.add_source('code',input,original)
+    return input
+
+  def make_hash(self,input:str,length:int):
+    hashed = input[:length -10] + str(hashlib.shake_256(input.encode()).hexdigest(5))
+    self.add_source('hash',hashed,input)
+    return hashed
+
+  def add_source(self,kind:str,id:str,name:str):
+    # returns False if id was already made from a different name.  Names
+    # that already are ids (codes escaped twice) are not recorded.
+    if name == id:
+      return True
+    sources = self.sources[kind]
+    first = sources.setdefault(id,name)
+    if first == name:
+      return True
+    self.collisions.append((kind,id,first,name))
+    if kind == 'hash':
+      # distinct inputs sharing a truncated hash: the ids would clash
+      self.installer.diagnose(logger.WARN,"Hash collision on " + id + " between " + repr(first) + " and " + repr(name),artifact=id)
+    else:
+      self.installer.diagnose(logger.WARN,"Names " + repr(first) + " and " + repr(name) + " both map to " + kind + " " + id,artifact=id)
+    return False
+
+  def get_sources(self):
+    return self.sources
+
+  def merge_sources(self,sources:dict):
+    # sources recorded by another installer (a worker process)
+    for kind,ids in sources.items():
+      for id,name in ids.items():
+        self.add_source(kind,id,name)
+
+  def get_collisions(self):
+    return self.collisions
+
+  def get_stats(self):
+    # cache hits and misses of every normalisation, and the collisions found
+    stats = {}
+    for name,cache in self.caches.items():
+      info = cache.cache_info()
+      stats[name + " hits"] = info.hits
+      stats[name + " misses"] = info.misses
+    stats["id collisions"] = len(self.collisions)
+    return stats
@@ -1,44 +1,81 @@
-import lxml.etree as ET
 import glob
 import re
 import os
-import shutil
 import yaml
-from typing import List
+from typing import TYPE_CHECKING
 from pathlib import Path
 import pprint
 import sys
-from lxml import etree
-import hashlib
+from output_writer import output_writer
+from emitter import emitter, fsh_emitter
+from logger import logger
+from alias_table import alias_table
+from id_table import id_table
+from artifact_registry import artifact_registry
+from diagnostics import diagnostics
+from dmn_renderer import dmn_renderer
+from profiler import profiler
+if TYPE_CHECKING:
+  import lxml.etree as ET
 
 class installer:
-  resources = { 'requirements' : {} ,'codesystems' : {} , 'valuesets' : {} , 'rulesets' : {},
-                'actors' : {} , 'instances': {}, 'rulesets' : {}, 'libraries' : {},
-                'plandefinitions':{}, 'activitydefinitions':{}}  
-  cqls = {}
-  codesystems = {}
-  codesystem_titles = {}
-  codesystem_properties = {}
-  pages = {}
-  logfile = None
-  sushi_config = {}
-  dmn2html_xslt = None
+  # state of an extraction, set up per instance in __init__
+  resources : dict
+  cqls : dict
+  codesystems : dict
+  codesystem_titles : dict
+  codesystem_properties : dict
+  pages : dict
+  sushi_config : dict
+  installed_files : list
+  dmn_tables : dict
+  sushi_file = "sushi-config.yaml"
+  dmn_renderer = None
+  dmn_validator = None
   dmn2html_xslt_file = "includes/dmn2html.xslt"  #relative to directory containing this file
   dmn_css_file = "includes/dmn.css"  #relative to directory containing this file
   dmn_namespace =  "https://www.omg.org/spec/DMN/20240513/MODEL/"
       
   
-  def __init__(self):
-    logfile_path = Path("temp/DAKExtract.log.txt")
-    print("Logging status messages to stderr and: " + str(logfile_path))
-    logfile_path.parent.mkdir(exist_ok=True, parents=True)
-    self.logfile = open(logfile_path,"w")
-    Path("input/dmn").mkdir(exist_ok=True, parents=True)
-    Path("input/cql").mkdir(exist_ok=True, parents=True)
-    Path("input/fsh").mkdir(exist_ok=True, parents=True)
-    Path("input/fsh/activitydefinitions").mkdir(exist_ok=True, parents=True)
-    Path("input/fsh/plandefinitions").mkdir(exist_ok=True, parents=True)
-    Path("input/pagecontent").mkdir(exist_ok=True, parents=True)
+  def __init__(self,logfile_path = "temp/DAKExtract.log.txt",file_level = logger.INFO,
+               stderr_level = logger.WARN,record_level = None,profile = False,
+               input_root = "",output_root = None):
+    # with logfile_path=None and a record_level (worker processes) log records
+    # are kept and handed back to the parent installer through get_results()
+    #
+    # input_root is the IG directory the sushi config, workbooks, CQL and FSH
+    # are read from, output_root the IG directory the generated files (and
+    # temp/) are written to; both default to the current directory.  All
+    # other paths are relative to one of them.
+    self.input_root = input_root
+    self.output_root = input_root if output_root is None else output_root
+    self.resources = { 'requirements' : {} ,'codesystems' : {} , 'valuesets' : {} , 'rulesets' : {},
+                       'actors' : {} , 'instances': {}, 'libraries' : {},
+                       'plandefinitions':{}, 'activitydefinitions':{}}
+    self.cqls = {}
+    self.codesystems = {}
+    self.codesystem_titles = {}
+    self.codesystem_properties = {}
+    self.pages = {}
+    self.sushi_config = {}
+    self.installed_files = []
+    self.dmn_tables = {}
+    self.output_writer = output_writer()
+    self.aliases = alias_table()
+    self.logged_alias_conflicts = 0
+    self.ids = id_table(self)
+    self.artifacts = artifact_registry()
+    self.diagnostics = diagnostics()
+    self.workbook = None   # the workbook being extracted, for diagnostics
+    if logfile_path is not None:
+      logfile_path = self.get_output_path(logfile_path)
+    self.logger = logger(logfile_path,file_level,stderr_level,record_level)
+    self.profiler = profiler(profile)
+    if logfile_path is not None:
+      print("Logging status messages to: " + str(logfile_path))
+    for directory in ["input/dmn","input/cql","input/fsh","input/fsh/activitydefinitions",
+                      "input/fsh/plandefinitions","input/pagecontent"]:
+      Path(self.get_output_path(directory)).mkdir(exist_ok=True, parents=True)
     if not self.read_sushi_config():
       raise Exception('Could not load sushi-config')
     self.add_rulesets()
@@ -48,41 +85,50 @@ class installer:
   def get_base_dir(self):
     return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+  def get_input_path(self,path):
+    # e.g. get_input_path("input/decision-logic/x.xlsx") -> <input_root>/input/decision-logic/x.xlsx
+    return os.path.join(self.input_root,str(path))
+
+  def get_output_path(self,path):
+    return os.path.join(self.output_root,str(path))
+
+  def find_input_files(self,pattern:str):
+    # files under input_root matching pattern, as paths relative to input_root
+    return glob.glob(pattern,root_dir=self.input_root or None)
+
     
   def initialize_dmn(self):
     try:
-      Path("input/images-source").mkdir(exist_ok=True, parents=True)
-      Path("input/pagecontent/includes").mkdir(exist_ok=True, parents=True)
+      Path(self.get_output_path("input/images-source")).mkdir(exist_ok=True, parents=True)
+      Path(self.get_output_path("input/pagecontent/includes")).mkdir(exist_ok=True, parents=True)
       script_directory = self.get_base_dir() + "/input/scripts" 
       source_file = script_directory + "/" +  self.dmn_css_file
       # shutil.copy(source_file,Path("input/images-source/dmn.css"))
       transformed_file = script_directory + "/" +  self.dmn2html_xslt_file
-      self.log("xslt at " + transformed_file)
-      with open(Path(transformed_file), "rb") as f:
-        self.dmn2html_xslt = ET.XSLT(ET.parse(f))
+      self.debug("xslt at " + transformed_file)
+      self.dmn_renderer = dmn_renderer(self,transformed_file)
     except BaseException as e:
-      self.log("WARNING: Could not find XSLT at input/includes/dmn2html.xslt -- HTML DMN rendering will be unavailable.")
-      self.log(f"\tError: {e}")
+      self.warn("WARNING: Could not find XSLT at input/includes/dmn2html.xslt -- HTML DMN rendering will be unavailable.")
+      self.warn(f"\tError: {e}")
       sys.exit(88)
 
 
     
     
   def read_sushi_config(self):
-    sushi_file = "sushi-config.yaml"
     try:
-        with open(sushi_file, 'r') as file:
+        with open(self.get_input_path(self.sushi_file), 'r') as file:
             self.sushi_config = yaml.safe_load(file)
             if not self.sushi_config:
-              self.log("Could not load sushi config")
+              self.error("Could not load sushi config")
               return False          
-            self.log("Got sushi config:\n\t" + pprint.pformat(self.sushi_config).replace("\n","\n\t"))
+            self.debug(lambda: "Got sushi config:\n\t" + pprint.pformat(self.sushi_config).replace("\n","\n\t"))
             return True
     except FileNotFoundError:
-        self.log("Could not find sushi config")
+        self.error("Could not find sushi config")
         return False
     except yaml.YAMLError as e:
-       self.log("Could not parse sushi config")
+       self.error("Could not parse sushi config")
        return False
     return True
 
@@ -109,12 +155,93 @@ class installer:
   def get_ig_version(self):
     return self.sushi_config['version']
   
+  def get_results(self):
+    # picklable snapshot of everything collected for installation, used to
+    # hand the output of a worker process back to the parent installer
+    import lxml.etree as ET
+    self.record_id_stats()
+    return {'resources':self.resources,
+            'codesystems':self.codesystems,
+            'codesystem_titles':self.codesystem_titles,
+            'codesystem_properties':self.codesystem_properties,
+            'pages':self.pages,
+            'cqls':self.cqls,
+            'dmn_tables':{dt_id:ET.tostring(dt_dmn) for dt_id,dt_dmn in self.dmn_tables.items()},
+            'aliases':self.aliases.get_aliases(),
+            'ids':self.ids.get_sources(),
+            'artifacts':self.artifacts.get_results(),
+            'diagnostics':self.diagnostics.get_results(),
+            'log':self.logger.get_records(),
+            'profile':self.profiler.get_results()}
+
+  def merge_results(self,results):
+    # results are merged in the order the workbooks would be extracted serially
+    # so that later workbooks overwrite earlier ones exactly as in a serial run
+    if results['log']:
+      self.logger.replay(results['log'])
+    self.profiler.merge_results(results.get('profile'))
+    for dir,instances in results['resources'].items():
+      if not dir in self.resources:
+        self.resources[dir] = {}
+      self.resources[dir].update(instances)
+    self.codesystems.update(results['codesystems'])
+    self.codesystem_titles.update(results['codesystem_titles'])
+    self.codesystem_properties.update(results['codesystem_properties'])
+    self.pages.update(results['pages'])
+    self.cqls.update(results['cqls'])
+    if results['dmn_tables']:
+      import lxml.etree as ET
+    for dt_id,dt_dmn in results['dmn_tables'].items():
+      self.add_dmn_table(dt_id,ET.fromstring(dt_dmn))
+    self.add_aliases(results['aliases'])
+    self.ids.merge_sources(results['ids'])
+    self.artifacts.merge_results(results['artifacts'])
+    self.diagnostics.merge_results(results['diagnostics'])
+    return True
+
   def install(self):
-    self.install_aliases()
-    self.install_resources()
-    self.install_dmns()
-    self.install_pages()
-    self.install_cqls()
+    with self.profiler.stage("install_aliases"):
+      self.install_aliases()
+    with self.profiler.stage("install_resources"):
+      self.install_resources()
+    with self.profiler.stage("install_dmns"):
+      self.install_dmns()
+    with self.profiler.stage("install_pages"):
+      self.install_pages()
+    with self.profiler.stage("install_cqls"):
+      self.install_cqls()
+
+  def write_file(self,file_path,content:str,workbook = None):
+    # all generated files go through the output writer, which leaves files
+    # whose content is unchanged untouched.  workbook is the workbook the
+    # file was generated from, if any, for the profile.
+    self.installed_files.append(str(file_path))
+    with self.profiler.stage("file_write",workbook):
+      written = self.output_writer.write(self.get_output_path(file_path),content)
+    if written:
+      if self.profiler.enabled:
+        self.profiler.add_bytes("file_write",len(content.encode(self.output_writer.encoding)),workbook)
+      self.log("Installed " + str(file_path))
+    else:
+      self.debug("Unchanged " + str(file_path))
+    return True
+
+  def keep_file(self,file_path):
+    # a file left in place from a previous run counts as installed
+    self.installed_files.append(str(file_path))
+    self.output_writer.keep(self.get_output_path(file_path))
+    self.debug("Unchanged " + str(file_path))
+
+  def remove_stale_files(self,file_paths):
+    # remove files installed by a previous run that were not installed by this one
+    installed_files = set(self.installed_files)
+    for file_path in file_paths:
+      if not file_path in installed_files and self.output_writer.remove(self.get_output_path(file_path)):
+        self.log("Removed stale " + file_path)
+    return True
+
+  def log_output_summary(self):
+    self.log(self.output_writer.get_summary())
 
   def install_cqls(self):
     for id,cql in self.cqls.items():
@@ -125,59 +252,64 @@ class installer:
       self.install_page(id,page)
 
 
-  dmn_tables = {}
-  def add_dmn_table(self,dt_id:str,dt_dmn:str):
-    if dt_id in self.dmn_tables:
-      self.log("**Warning** found duplicated decitiosn table with id=" + dt_id)
-    self.dmn_tables[dt_id] = dt_dmn
+  def add_dmn_table(self,dt_id:str,dt_dmn:"ET._Element"):
+    # dt_id is the id of the dmn:definitions of a tab: the dmn:decision
+    # elements of all decision tables on the same tab are collected into one
+    # document, so each tab is written and rendered once
+    if not dt_id in self.dmn_tables:
+      self.dmn_tables[dt_id] = dt_dmn
+      return
+    definitions = self.dmn_tables[dt_id]
+    decisions = {decision.get("id"):decision for decision in definitions.iterfind("{" + self.dmn_namespace + "}decision")}
+    for decision in dt_dmn.findall("{" + self.dmn_namespace + "}decision"):
+      if decision.get("id") in decisions:
+        self.diagnose(logger.WARN,"**Warning** found duplicated decision table with id=" + str(decision.get("id")) + " in " + dt_id,
+                      artifact=decision.get("id"))
+        definitions.replace(decisions[decision.get("id")],decision)
+      else:
+        definitions.append(decision)
+      decisions[decision.get("id")] = decision
 
   def name_to_lower_id(self,name):
     if ( not (isinstance(name,str))):
       return None
     return self.name_to_id(name.lower())
     
-  def name_to_id(self,name):    
+  def name_to_lower_key(self,name):
     if ( not (isinstance(name,str))):
       return None
-    id = re.sub('[^0-9a-zA-Z\\-\\.]+', '', name)
-    # to work around jekyll error, make sure there are no trailing periods...
-    id = id.rstrip('.')
-    if len(id) > 55:
-      # make length of an id is 64 characters
-      #we need to make use of hashes
-      self.log("ERROR: name of id is too long. hashing.: " + id)
-      id = self.to_hash(id,55)
-      self.log("Escaping id " + name + " to " + id )
-    return id
+    return self.ids.name_to_key(name.lower())
 
+  def name_to_id(self,name):    
+    if ( not (isinstance(name,str))):
+      return None
+    return self.ids.name_to_id(name)
 
   def to_hash(self,input:str,len:int):
-    return input[:len -10] + str(hashlib.shake_256(input.encode()).hexdigest(5))
-
-
+    return self.ids.to_hash(input,len)
 
   def escape_code(self,input):
-    original = input
     if ( not (isinstance(input,str))):
         return None
-    input = input.strip()
-    input = re.sub(r"['\"]","",input)
-    #SUSHI BUG on processing codes with double quote.  sushi fails
-    #Example \"Bivalent oral polio vaccine (bOPV)–inactivated polio vaccine (IPV)\" schedule (in countries with high vaccination coverage [e.g. 90–95%] and low importation risk [where neighbouring countries and/or countries that share substantial population movement have a similarly high coverage])" 
-
-    input = re.sub(r"\s+"," ",input)
-    if len(input) > 245:
-       # max filename size is 255, leave space for extensions such as .fsh
-      self.log("ERROR: name of id is too long.hashing: " + input)        
-      input = self.to_hash(input,245)
-      self.log("Escaping code " + original + " to " + input )
-    return input
+    return self.ids.escape_code(input)
+
+  def record_id_stats(self):
+    # hit / miss counts of the id caches, shown in the --profile summary.
+    # Called once per installer, when its results are complete.
+    self.profiler.add_counts(self.ids.get_stats())
 
   def xml_escape(self,input):
     if ( not (isinstance(input,str))):
       return ""
     # see https://stackoverflow.com/questions/1546717/escaping-strings-for-use-in-xml
     return input.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\"", "&quot;").replace("'", "&apos;")    
+  xml_invalid_pattern = re.compile('[^\t\n\r\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+  def xml_safe(self,input):
+    # text with the characters XML 1.0 does not allow removed
+    if ( not (isinstance(input,str))):
+      return ""
+    return self.xml_invalid_pattern.sub("",input)
+
   def escape(self,input):
     if ( not (isinstance(input,str))):
         return None
@@ -185,11 +317,28 @@ class installer:
 
 
   def install_dmns(self):
+    # write all DMN files, then render the HTML of the changed ones in one batch
     result = True
+    dmn_trees = []
     for dt_id,dmn_table in self.dmn_tables.items():
-      result &= self.install_dmn(dt_id,dmn_table)
+      with self.profiler.stage("dmn_install"):
+        dmn = self.install_dmn(dt_id,dmn_table)
+      if dmn is None:
+        result = False
+        continue
+      dmn_trees.append((dt_id,) + dmn)
+    if self.dmn_validator:
+      self.log(self.dmn_validator.get_summary())
+      self.dmn_validator.save()
+    if self.dmn_renderer:
+      result &= self.install_dmn_htmls(dmn_trees)
     return result
 
+  def enable_dmn_validation(self):
+    # validate every DMN tree against the bundled DMN schema before it is written
+    from dmn_validator import dmn_validator
+    self.dmn_validator = dmn_validator(self)
+
 
 
   def add_rulesets(self):
@@ -197,7 +346,7 @@ class installer:
     for ruleset_file in glob.glob(self.get_base_dir() + "/input/fsh/rulesets/*fsh"):      
       ruleset_id =  str(os.path.splitext(os.path.basename(ruleset_file))[0])
       with open(ruleset_file, 'r') as file:
-        self.log("Opned " + ruleset_file)
+        self.debug("Opned " + ruleset_file)
         ruleset = str(file.read())
         self.add_resource("rulesets",ruleset_id,ruleset)
 
@@ -205,52 +354,64 @@ class installer:
 
     
   alias_file = "input/fsh/Aliases.fsh"
-  aliases = []  #should change this to a set...
+  aliases = None
+  base_aliases = None
 
   def get_base_aliases(self):
-    ig_alias_file = self.get_base_dir() + "/" + self.alias_file
-    with open(ig_alias_file, 'r') as file:
-      return str(file.read()).split("\n")
-        
-  
+    # the alias lines of the base IG, read once
+    if self.base_aliases is None:
+      ig_alias_file = self.get_base_dir() + "/" + self.alias_file
+      with open(ig_alias_file, 'r') as file:
+        self.base_aliases = str(file.read()).split("\n")
+    return list(self.base_aliases)
+
   def add_aliases(self , aliases):
-    for alias in aliases:
-      if alias not in self.aliases:
-        self.aliases.append(alias)
+    # aliases are either alias lines (Alias: $name = url) or a dictionary of
+    # name -> url as returned by get_results()
+    if isinstance(aliases,dict):
+      self.aliases.update(aliases)
+    else:
+      self.aliases.add_lines(aliases)
+    self.log_alias_conflicts()
+
+  def resolve_alias(self,name:str):
+    # e.g. resolve_alias('$SGActor') -> http://smart.who.int/base/StructureDefinition/SGActor
+    return self.aliases.resolve(name)
+
+  def log_alias_conflicts(self):
+    for name,kept,ignored in self.aliases.get_conflicts()[self.logged_alias_conflicts:]:
+      self.diagnose(logger.WARN,"Conflicting definitions of alias " + name + ": keeping " + kept + ", ignoring " + ignored,
+                    artifact=name)
+    self.logged_alias_conflicts = len(self.aliases.get_conflicts())
 
   def install_aliases(self):
+    content = ""
     try:
-        if not os.path.exists(self.alias_file):
-            with open(filename, 'w') as file:
-                for alias in set(self.aliases):
-                    self.log("Adding alias:" + alias)
-                    file.write(alias + "\n")
-                file.close()
-        else:
-            with open(self.alias_file, 'r+') as file:
-                content = file.read()
-                for alias in set(self.aliases):
-#                    self.log("Checking alias:" + alias)
-                    if alias not in content:
-                        self.log("Adding alias:" + alias)
-                        file.write('\n' + alias + '\n')
-                file.close()
+      # the aliases of the IG, extended by the previous run if there was one
+      alias_path = self.get_output_path(self.alias_file)
+      if not os.path.exists(alias_path):
+        alias_path = self.get_input_path(self.alias_file)
+      if os.path.exists(alias_path):
+        with open(alias_path, 'r') as file:
+          content = file.read()
+      updated = self.aliases.render(content)
+      self.log_alias_conflicts()
+      if updated != content:
+        self.debug(lambda: "Adding aliases:\n" + updated[len(content):])
+      self.write_file(self.alias_file,updated)
     except IOError as e:
-        self.log("Could not insert aliases")
-        self.log(f"\tError: {e}")
+        self.error("Could not insert aliases")
+        self.error(f"\tError: {e}")
 
 
 
   def install_page(self,id,page:str):
     try:
       file_path = "input/pagecontent/" + id + ".md"
-      file = open(file_path,"w")
-      print (page,file=file)
-      file.close()
-      self.log("Installed " + file_path)
+      self.write_file(file_path,page + "\n")
     except IOError as e:
-      self.log("Could not save page with id: " + id + "\n")
-      self.log(f"\tError: {e}")
+      self.error("Could not save page with id: " + id + "\n")
+      self.error(f"\tError: {e}")
     return True
     
 
@@ -258,59 +419,65 @@ class installer:
   def install_cql(self,id,cql:str):
     try:
       file_path = "input/cql/" + id + ".cql"
-      file = open(file_path,"w")
-      print (cql,file=file)
-      file.close()
-      self.log("Installed " + file_path)
+      self.write_file(file_path,cql + "\n")
     except IOError as e:
-      self.log("Could not save CQL with id: " + id + "\n")
-      self.log(f"\tError: {e}")
+      self.error("Could not save CQL with id: " + id + "\n")
+      self.error(f"\tError: {e}")
     return True
     
 
-  def install_dmn(self,id,dmn:str):
-    try:
-      #self.log(dmn_wrapped)
-      ET.register_namespace('dmn' , self.dmn_namespace )
-      dmn_tree = ET.XML(dmn)
-      ET.indent(dmn_tree)
-    except BaseException as e:
-      self.log("ERROR: Generated invalid XML for DMN id " + id +"\n" +  f"\tError: {e}\n" )
-      return False
-    
+  def install_dmn(self,id,dmn_tree:"ET._Element"):
+    # returns (dmn tree, serialised dmn) or None
+    import lxml.etree as ET
+    ET.indent(dmn_tree)
+    if self.dmn_validator:
+      self.dmn_validator.validate(id,dmn_tree)
     try:
       dmn_path = Path("input/dmn/") /  f"{id}.dmn"
-      dmn_file = open(dmn_path,"w")
-      #self.log(ET.tostring(dmn_tree,encoding="unicode"))
-      dmn_file.write(ET.tostring(dmn_tree,encoding="unicode"))
-      #print(ET.tostring(dmn_tree,encoding="unicode"),file=dmn_file)
-      dmn_file.close()
-      self.log("Installed " + str(dmn_path))
+      dmn = ET.tostring(dmn_tree,encoding="unicode")
+      self.write_file(dmn_path,dmn)
     except IOError as e:
-      self.log("Could not save DMN with id: " + id + "\n")
-      log(f"\tERROR: {e}")
-      return False
+      self.error("Could not save DMN with id: " + id + "\n")
+      self.error(f"\tERROR: {e}")
+      return None
+    return (dmn_tree,dmn)
 
-    if self.dmn2html_xslt:
+  def get_dmn_html_path(self,id):
+    return Path("input/pagecontent/") / f"{id}.html"
+
+  def install_dmn_htmls(self,dmn_trees):
+    # dmn_trees is a list of (id, dmn tree, serialised dmn).  Tables whose DMN
+    # is unchanged since their HTML was last rendered are not transformed.
+    result = True
+    pending = []
+    dmns = {}
+    for id,dmn_tree,dmn in dmn_trees:
+      html_path = self.get_dmn_html_path(id)
+      dmns[id] = dmn
+      if self.dmn_renderer.is_unchanged(id,dmn,self.get_output_path(html_path)):
+        self.keep_file(html_path)
+        self.dmn_renderer.record(id,dmn)
+        continue
+      pending.append((id,dmn_tree))
+    self.log("Transforming " + str(len(pending)) + " of " + str(len(dmn_trees)) + " DMN table(s) to HTML")
+    for id,html,e in self.dmn_renderer.render(pending):
+      html_path = self.get_dmn_html_path(id)
+      if html is None:
+        self.warn("Could not process DMN into HTML")
+        self.warn(f"\tError: {e}")
+        result = False
+        continue
       try:
-        html_path = Path("input/pagecontent/") / f"{id}.html"
-        # Use lxml to parse and transform DMN to HTML
-        # Pass relative stylesheet path for HTML output
-        self.log("Transforming dmn to html on " + id)
-        html_result = self.dmn2html_xslt(dmn_tree)
-        #self.log(html_result)
-        #self.log(ET.tostring(html_result,encoding="unicode"))
-        # Patch: ensure CSS is referenced as just 'dmn.css'        
-        html_file = open(html_path, "w")
-        html_file.write(ET.tostring(html_result, encoding="unicode"))
-        html_file.close()
-        self.log(f"Generated HTML DMN table for {id}: {html_path}")
-      except BaseException as e:
-        self.log("Could not process DMN into HTML")
-        self.log(f"\tError: {e}")
-        return False
-      
-    return True
+        self.write_file(html_path,html)
+      except IOError as e:
+        self.error("Could not save DMN HTML with id: " + id + "\n")
+        self.error(f"\tERROR: {e}")
+        result = False
+        continue
+      self.dmn_renderer.record(id,dmns[id])
+      self.log(f"Generated HTML DMN table for {id}: {html_path}")
+    self.dmn_renderer.save()
+    return result
 
   def install_resources(self):
     result = True
@@ -318,65 +485,64 @@ class installer:
       for id,resource in instances.items() :
         try:
           file_path = "input/fsh/" + directory + "/" + id + ".fsh"
-          Path("input/fsh/" + directory).mkdir(exist_ok=True, parents=True)
-          file = open(file_path,"w")
-          print(resource,file=file)
-          file.close()
-          self.log("Installed " + file_path)
+          Path(self.get_output_path("input/fsh/" + directory)).mkdir(exist_ok=True, parents=True)
+          self.write_file(file_path,resource + "\n",self.artifacts.get_workbook(directory,id))
         except IOError as e:
           result = False
-          self.log("Could not save resource of type: " + directory + "  with id: " + id + "\n")
-          self.log(f"\tError: {e}")
+          self.error("Could not save resource of type: " + directory + "  with id: " + id + "\n")
+          self.error(f"\tError: {e}")
     return result
 
   def render_codesystem(self,id:str):
     if (not id in self.codesystems) or (not id in self.codesystem_titles):
-      self.log("Trying to render absent codesystem " + id)
+      self.warn("Trying to render absent codesystem " + id)
       return ""
     title = self.codesystem_titles[id]
-    codesystem = 'CodeSystem: ' + self.escape(id) + '\n'
-    codesystem += 'Title: "' + self.escape(title) + '"\n'
-    codesystem += 'Description:  "CodeSystem for ' + self.escape(title) + '. Autogenerated from DAK artifacts"\n'
-    codesystem += '* ^experimental = false\n'
-    codesystem += '* ^caseSensitive = false\n'
-    codesystem += '* ^status = #active\n'
+    fsh = fsh_emitter()
+    fsh.header('CodeSystem',self.escape(id))
+    fsh.header('Title',fsh.quote(self.escape(title)))
+    fsh.header('Description',' "CodeSystem for ' + self.escape(title) + '. Autogenerated from DAK artifacts"')
+    fsh.rule('^experimental','false')
+    fsh.rule('^caseSensitive','false')
+    fsh.rule('^status','#active')
     for code,vals in self.codesystem_properties[id].items():
-      codesystem += '* ^property[+].code = #"' + self.escape_code(code) + '"\n'
+      fsh.rule('^property[+].code','#' + fsh.quote(self.escape_code(code)))
       for k,v in vals.items():
-        codesystem += '* ^property[=].' + k + ' = ' + v + "\n" # user is responsible for content
+        fsh.rule('^property[=].' + k,v) # user is responsible for content
 
     for code,val in self.codesystems[id].items():
-      self.log("Attempting to add " + str(code) )
+      self.debug("Attempting to add " + str(code) )
       if isinstance(val,str):
-        codesystem += '* #"' + self.escape_code(code) +  '" "' + self.escape(name) + '"\n'
+        fsh.rule('#' + fsh.quote(self.escape_code(code)) + ' ' + fsh.quote(self.escape(val)))
       elif isinstance(val,dict)  and 'display' in val:
-        codesystem += '* #"' + self.escape_code(code) +  '" "' + self.escape(val['display']) + '"\n'
+        fsh.rule('#' + fsh.quote(self.escape_code(code)) + ' ' + fsh.quote(self.escape(val['display'])))
         if 'definition' in val:
-          codesystem += '  * ^definition = """' + val['definition'] + '\n"""\n'
+          fsh.rule('^definition',fsh.triple_quote(val['definition'] + '\n'),1)
         if 'designation' in val and isinstance(val['designation'],list):
           for d_val in val['designation']:
             if not isinstance(d_val,dict) or not 'value' in d_val:
               continue
-            codesystem += '  * ^designation[+].value = ' + d_val['value'] + "\n"
+            fsh.rule('^designation[+].value',d_val['value'],1)
             d_val.pop('value')
             for k,v in d_val.items():
-              codesystem += '  * ^designation[=].' + k + " = " + v + "\n"
+              fsh.rule('^designation[=].' + k,v,1)
             
         if 'propertyString' in val and isinstance(val['propertyString'],dict):
           for p_code,p_val in val['propertyString'].items():
-            codesystem += '  * ^property[+].code = #"' + self.escape(p_code) +  '"\n'
-            codesystem += '  * ^property[=].valueString = "' + self.escape(p_val) +  '"\n'
+            fsh.rule('^property[+].code','#' + fsh.quote(self.escape(p_code)),1)
+            fsh.rule('^property[=].valueString',fsh.quote(self.escape(p_val)),1)
       else:
-        self.log("  failed to add code (expected string or dict with 'display' property)" + str(code))
-        self.log(pprint.pp(val))
+        self.diagnose(logger.WARN,"  failed to add code (expected string or dict with 'display' property)" + str(code),
+                      artifact=id + "#" + str(code))
+        self.warn(lambda: pprint.pformat(val))
 
-    return codesystem
+    return fsh.getvalue()
 
 
 
   def initialize_codesystem(self,codesystem_id:str,title:str):
     if codesystem_id in self.codesystems:
-      self.log("WARNING: reinitializing codesystem " + codesystem_id)
+      self.warn("WARNING: reinitializing codesystem " + codesystem_id)
     self.codesystems[codesystem_id] = {}
     self.codesystem_titles[codesystem_id] = title
     self.codesystem_properties[codesystem_id] = {}
@@ -399,12 +565,13 @@ class installer:
     
   def add_to_codesystem(self,codesystem_id:str,code:str,expr:str):
     if not codesystem_id in self.codesystems:
-      self.log("ERROR: Code system not initialized " + codesystem_id)
+      self.diagnose(logger.ERROR,"ERROR: Code system not initialized " + codesystem_id,artifact=codesystem_id)
       return False
 
     if code in self.codesystems[codesystem_id] and expr != self.codesystems[codesystem_id][code]:
         # want this to be a structured ERROR for quality control back to the L2 authors
-        self.log("ERROR: non-matching definitions for code " + code + " in code system " + codesystem_id)
+        self.diagnose(logger.ERROR,"ERROR: non-matching definitions for code " + code + " in code system " + codesystem_id,
+                      artifact=codesystem_id + "#" + code)
         return False
       
     self.codesystems[codesystem_id][code] = expr
@@ -412,45 +579,94 @@ class installer:
 
 
   def generate_vs_from_list(self,id:str, codesystem_id:str, title:str, codes):
-        
-    valueset = 'ValueSet: ' + self.escape(id) + '\n'
-    valueset += 'Title: "' + self.escape(title) + '"\n'
-    valueset += 'Description:  "Value Set for ' + self.escape(title) + '. Autogenerated from DAK artifacts"\n'
-    valueset += '* ^status = #active\n'
-    valueset += '* ^experimental = false\n'
+    fsh = self.start_valueset(id,title)
     for code in codes:
-      valueset += '* include ' + self.escape(codesystem_id) + '#"' + self.escape_code(code) + '"\n'
+      fsh.rule('include ' + self.escape(codesystem_id) + '#' + fsh.quote(self.escape_code(code)))
     
-    self.add_resource('valuesets',id, valueset)
+    self.add_resource('valuesets',id, fsh.getvalue())
 
     return True
 
+  def start_valueset(self,id:str,title:str):
+    fsh = fsh_emitter()
+    fsh.header('ValueSet',self.escape(id))
+    fsh.header('Title',fsh.quote(self.escape(title)))
+    fsh.header('Description',' "Value Set for ' + self.escape(title) + '. Autogenerated from DAK artifacts"')
+    fsh.rule('^status','#active')
+    fsh.rule('^experimental','false')
+    return fsh
+
   
 
   def generate_cs_and_vs_from_dict(self,id:str, title:str, codelist:dict , properties : {}):
     if not self.initialize_codesystem(id,title):
-      self.log("Skipping CS and VS for " + str + " could not initialize")
+      self.warn("Skipping CS and VS for " + str + " could not initialize")
       return False
     if not self.add_dict_to_codesystem(id,codelist):
-      self.log("Skipping CS and VS for " + str + " could not add dictionary")
+      self.warn("Skipping CS and VS for " + str + " could not add dictionary")
       return False
     self.add_codesystem_properties(id,properties)
 
-    codesystem = self.render_codesystem(id)
+    with self.profiler.stage("codesystem_render"):
+      codesystem = self.render_codesystem(id)
     
-    valueset = 'ValueSet: ' + self.escape(id) + '\n'
-    valueset += 'Title: "' + self.escape(title) + '"\n'
-    valueset += 'Description:  "Value Set for ' + self.escape(title) + '. Autogenerated from DAK artifacts"\n'
-    valueset += '* ^status = #active\n'
-    valueset += '* ^experimental = false\n'
-    valueset += '* include codes from system ' + self.escape(id) + '\n'
+    valueset = self.start_valueset(id,title)
+    valueset.rule('include codes from system ' + self.escape(id))
 
     self.add_resource('codesystems',id,codesystem)
-    self.add_resource('valuesets',id, valueset)
+    self.add_resource('valuesets',id, valueset.getvalue())
     return True
   
-  def add_resource(self,dir,id,resource):
+  def add_resource(self,dir,id,resource,source = None):
+    # source is the workbook location the resource was generated from, see extractor.get_source()
     self.resources[dir][id]=resource
+    self.artifacts.add(dir,id,resource,source)
+
+  def resolve_references(self,generated_files = []):
+    # checks that the Canonical(), Reference() and page links of the generated
+    # resources point at a generated resource or at something defined in the
+    # static FSH of the IG or of the base IG.  generated_files are files
+    # installed by a previous run, which do not count as static FSH.
+    generated = set(os.path.realpath(self.get_output_path(file_path)) for file_path in generated_files)
+    for dir,instances in self.resources.items():
+      generated.update(os.path.realpath(self.get_output_path("input/fsh/" + dir + "/" + id + ".fsh")) for id in instances.keys())
+    fsh_dirs = []
+    for fsh_dir in [self.get_input_path("input/fsh"), self.get_base_dir() + "/input/fsh"]:
+      if not os.path.realpath(fsh_dir) in fsh_dirs:
+        fsh_dirs.append(os.path.realpath(fsh_dir))
+    for fsh_dir in fsh_dirs:
+      for fsh_file in sorted(glob.glob(fsh_dir + "/**/*.fsh",recursive=True)):
+        if fsh_file in generated:
+          continue
+        try:
+          with open(fsh_file, 'r') as file:
+            self.artifacts.add_static(fsh_file,file.read())
+        except (IOError, UnicodeDecodeError) as e:
+          self.warn("Could not read FSH file " + fsh_file)
+          self.warn(f"\tError: {e}")
+    dangling = self.artifacts.resolve(self.resolve_alias)
+    for reference in dangling:
+      source = reference['source'] or {}
+      self.diagnose(logger.WARN,"Dangling reference " + self.artifacts.describe(reference),
+                    workbook=source.get('workbook'),artifact=reference['kind'] + "/" + reference['id'])
+    self.log(self.artifacts.get_summary())
+    try:
+      self.artifacts.save(self.get_output_path(self.artifacts.report_file))
+    except IOError as e:
+      self.warn("Could not save reference report " + self.artifacts.report_file)
+      self.warn(f"\tError: {e}")
+    return len(dangling) == 0
+
+  def save_diagnostics(self,workbooks = []):
+    # writes the diagnostics collected by the run as JSON and JUnit XML;
+    # workbooks are the workbooks of the run, reported even without diagnostics
+    self.log(self.diagnostics.get_summary())
+    try:
+      self.diagnostics.save(self.get_output_path(self.diagnostics.report_file))
+      self.diagnostics.save_junit(self.get_output_path(self.diagnostics.junit_file),workbooks)
+    except IOError as e:
+      self.warn("Could not save diagnostics report " + self.diagnostics.report_file)
+      self.warn(f"\tError: {e}")
 
 
   def add_cql(self,id,cql):
@@ -462,58 +678,77 @@ class installer:
 
   def create_cql_library(self,lib_name,cql_codes, properties = {}):
     lib_id = self.name_to_id(lib_name)
-    cql =  "/*\n"
-    cql += "@libname: " + lib_name + "\n"
-    cql += "@libid: " + lib_id + "\n"
+    cql = emitter()
+    cql.line("/*")
+    cql.line("@libname: " + lib_name)
+    cql.line("@libid: " + lib_id)
     for k,v in properties.items():
-      cql += '@' + k + ': ' + v + "\n"
-    cql += "*/\n"
-    cql += "library " + lib_id + "\n"
-    #cql += "using FHIR version '4.0.1'\n"
-    #cql += "include FHIRHelpers version '4.0.1'\n" #do we want to include some common libraries?
-    cql += "\ncontext Patient\n"
+      cql.line('@' + k + ': ' + v)
+    cql.line("*/")
+    cql.line("library " + lib_id)
+    #cql.line("using FHIR version '4.0.1'")
+    #cql.line("include FHIRHelpers version '4.0.1'") #do we want to include some common libraries?
+    cql.line()
+    cql.line("context Patient")
 
     if not isinstance(cql_codes,dict):
-      self.log("Invalid CQL code definitions for " + lib_name)
+      self.warn("Invalid CQL code definitions for " + lib_name)
       sys.exit()
       return False
     
     for name,val in cql_codes.items():
       if isinstance(val,str):
-        cql += "\n/*\n"
-        cql += "@name: " + name + "\n"
-        cql += "@pseudocode: " + val + "\n"
-        cql += " */\n"
-        cql += "define \"" + self.escape(name) + "\":\n"
-        cql += "  //CQL AUTHORS: you need to insert stuff here\n"
+        cql.line()
+        cql.line("/*")
+        cql.line("@name: " + name)
+        cql.line("@pseudocode: " + val)
+        cql.line(" */")
+        cql.line("define \"" + self.escape(name) + "\":")
+        cql.line("  //CQL AUTHORS: you need to insert stuff here")
       elif isinstance(val,dict):
-        cql += "\n/*\n"
-        cql += "Autogenerated documentation from DAK\n"
-        cql += "@name: " + name + "\n"
+        cql.line()
+        cql.line("/*")
+        cql.line("Autogenerated documentation from DAK")
+        cql.line("@name: " + name)
         for k,v in val.items():
-          cql += "@" + k + ": " + str(v) + "\n"            
-        cql += " */\n"
-        cql += "define \"" + self.escape(name) + "\":\n"
-        cql += "  //CQL AUTHORS: you need to insert stuff here\n"
+          cql.line("@" + k + ": " + str(v))
+        cql.line(" */")
+        cql.line("define \"" + self.escape(name) + "\":")
+        cql.line("  //CQL AUTHORS: you need to insert stuff here")
         if 'pseudocode' in val:
-          cql += "  // " + "\n   // ".join(val['pseudocode'].splitlines(True)) + "\n"
+          cql.line("  // " + "\n   // ".join(val['pseudocode'].splitlines(True)))
           
-    self.add_cql(lib_id,cql)
+    self.add_cql(lib_id,cql.getvalue())
     
-    library = "Instance: " + lib_id + "\n"
-    library += "InstanceOf: Library\n"
-    library += "Title: \"" + self.escape(lib_name) + "\"\n"
-    library += "Description: \"This library defines context-independent elements for "  + lib_name + "\"\n"
-    library += "Usage: #definition\n"
-    library += "* insert LogicLibrary( " + lib_id + " )\n"    
-    self.add_resource("libraries",lib_id,library)
+    library = fsh_emitter()
+    library.instance(lib_id,"Library",
+                     title=library.quote(self.escape(lib_name)),
+                     description=library.quote("This library defines context-independent elements for "  + lib_name),
+                     usage="#definition")
+    library.rule("insert LogicLibrary( " + lib_id + " )")
+    self.add_resource("libraries",lib_id,library.getvalue())
 
     
-  def log(self,*statements):
-    for statement in statements:
-      print(str(statement) ,  file=sys.stderr)
-      self.logfile.write(str(statement) + "\n")
-    self.logfile.flush()
+  def log(self,*statements,level = logger.INFO):
+    # statements may be callables, only called when the level is enabled
+    self.logger.log(level,*statements)
+
+  def debug(self,*statements):
+    self.log(*statements,level=logger.DEBUG)
+
+  def diagnose(self,level:int,message:str,workbook = None,sheet = None,cell = None,artifact = None):
+    # logs message and records it as a structured diagnostic, see diagnostics
+    self.log(message,level=level)
+    self.diagnostics.add(logger.get_level_name(level),message,workbook or self.workbook,sheet,cell,artifact)
+
+  def warn(self,*statements):
+    self.log(*statements,level=logger.WARN)
+
+  def error(self,*statements):
+    self.log(*statements,level=logger.ERROR)
+
+  def is_log_enabled(self,level):
+    return self.logger.is_enabled(level)
 
 
     
@@ -0,0 +1,90 @@
+import atexit
+import sys
+from pathlib import Path
+
+class logger(object):
+  # Leveled, buffered logging.  Records below a level are dropped before
+  # they are formatted: a statement may be a callable returning the text,
+  # which is only called when the record is written somewhere, e.g.
+  #   ins.log(lambda: pprint.pformat(data), level=logger.DEBUG)
+  #
+  # The log file is written through a large buffer and flushed on close (and
+  # at exit), stderr only shows WARN and above unless asked otherwise.  A
+  # logger without a log file or stderr output (worker processes) keeps its
+  # records so that they can be handed back to and replayed by the parent.
+
+  DEBUG = 10
+  INFO = 20
+  WARN = 30
+  ERROR = 40
+  levels = {'DEBUG':DEBUG, 'INFO':INFO, 'WARN':WARN, 'WARNING':WARN, 'ERROR':ERROR}
+  names = {DEBUG:'DEBUG', INFO:'INFO', WARN:'WARN', ERROR:'ERROR'}
+  buffer_size = 1 << 20
+
+  def __init__(self,logfile_path = None,file_level = INFO,stderr_level = WARN,record_level = None):
+    # a level of None disables that output; records at or above record_level
+    # are kept for get_records()
+    self.file_level = file_level if logfile_path is not None else None
+    self.stderr_level = stderr_level
+    self.record_level = record_level
+    self.records = [] if record_level is not None else None
+    self.logfile = None
+    if self.file_level is not None:
+      logfile_path = Path(logfile_path)
+      logfile_path.parent.mkdir(exist_ok=True, parents=True)
+      self.logfile = open(logfile_path,"w",buffering=self.buffer_size)
+      atexit.register(self.close)
+    enabled = [level for level in [self.file_level,self.stderr_level,self.record_level] if level is not None]
+    self.level = min(enabled) if len(enabled) > 0 else None
+
+  @classmethod
+  def get_level(cls,name:str):
+    # level number for a name such as "debug" or "WARN", None if unknown
+    return cls.levels.get(str(name).strip().upper())
+
+  @classmethod
+  def get_level_name(cls,level:int):
+    return cls.names.get(level,str(level))
+
+  def is_enabled(self,level:int):
+    return self.level is not None and level >= self.level
+
+  def format(self,statement):
+    if callable(statement):
+      statement = statement()
+    return str(statement)
+
+  def log(self,level:int,*statements):
+    if not self.is_enabled(level):
+      return
+    lines = [self.format(statement) for statement in statements]
+    self.write(level,lines)
+
+  def replay(self,records):
+    # write records collected by another logger, e.g. in a worker process
+    for level,line in records:
+      if self.is_enabled(level):
+        self.write(level,[line])
+
+  def write(self,level:int,lines):
+    if self.records is not None and level >= self.record_level:
+      self.records.extend((level,line) for line in lines)
+    if self.stderr_level is not None and level >= self.stderr_level:
+      for line in lines:
+        print(line, file=sys.stderr)
+    if self.logfile is not None and level >= self.file_level:
+      for line in lines:
+        self.logfile.write(line + "\n")
+
+  def get_records(self):
+    return self.records
+
+  def flush(self):
+    if self.logfile is not None:
+      self.logfile.flush()
+
+  def close(self):
+    if self.logfile is not None and not self.logfile.closed:
+      self.logfile.close()
+      # a long running process may create many loggers
+      atexit.unregister(self.close)
@@ -0,0 +1,159 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from installer import installer
+
+class manifest(object):
+  # Records the content hash of every input of a DAK extraction run and the
+  # extraction results of each workbook, so that the next run can reuse the
+  # results of unchanged workbooks instead of parsing them again.
+  #
+  # The manifest is invalidated as a whole when sushi-config.yaml, the DMN
+  # XSLT or the extraction scripts themselves change.  Aliases.fsh is not an
+  # input: install_aliases() rewrites it (in the base IG too when the scripts
+  # are inside the IG) and the aliases of the current run are merged into
+  # every installer, so hashing it would throw away every cached workbook
+  # after each run adding an alias.
+
+  manifest_file = "temp/DAKExtract.manifest.json"
+  cache_dir = "temp/DAKExtract.cache"
+  version = 1
+
+  def __init__(self,installer:installer):
+    self.installer = installer
+    self.previous = self.load()
+    self.current = {'version':self.version,
+                    'inputs':self.hash_files(self.get_global_inputs()),
+                    'cql':self.hash_files(sorted(self.installer.find_input_files("input/cql/*cql"))),
+                    'workbooks':{},
+                    'installed':[]}
+    if self.previous['inputs'] != self.current['inputs']:
+      self.log("Extraction inputs or scripts changed, all workbooks will be extracted")
+      self.previous['workbooks'] = {}
+
+  def get_global_inputs(self):
+    script_directory = self.installer.get_base_dir() + "/input/scripts"
+    files = [self.installer.sushi_file,
+             script_directory + "/" + self.installer.dmn2html_xslt_file]
+    files.extend(sorted(glob.glob(script_directory + "/*.py")))
+    return files
+
+  def load(self):
+    empty = {'version':self.version,'inputs':{},'cql':{},'workbooks':{},'installed':[]}
+    try:
+      with open(self.get_path(self.manifest_file), 'r') as file:
+        previous = json.load(file)
+    except (IOError, ValueError):
+      return empty
+    if not isinstance(previous,dict) or previous.get('version') != self.version:
+      return empty
+    return previous
+
+  def clear(self):
+    # forget the results of the previous run, forcing a full extraction
+    self.previous['workbooks'] = {}
+
+  def save(self):
+    try:
+      Path(self.get_path(self.cache_dir)).mkdir(exist_ok=True, parents=True)
+      with open(self.get_path(self.manifest_file), 'w') as file:
+        json.dump(self.current,file,indent=1,sort_keys=True)
+    except IOError as e:
+      self.log("Could not save extraction manifest " + self.manifest_file)
+      self.log(f"\tError: {e}")
+      return False
+    # drop cached results no longer referenced by the manifest
+    cache_files = set(entry['results'] for entry in self.current['workbooks'].values())
+    for cache_file in glob.glob(self.get_path(self.cache_dir) + "/*.pickle"):
+      if not os.path.basename(cache_file) in cache_files:
+        os.remove(cache_file)
+    return True
+
+  def get_path(self,file_name:str):
+    # the manifest and the cached results are kept in the output IG
+    return self.installer.get_output_path(file_name)
+
+  def hash_file(self,file_name:str):
+    # file_name is an input of the extraction, relative to the input IG
+    try:
+      with open(self.installer.get_input_path(file_name), 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+    except IOError:
+      return None
+
+  def hash_files(self,file_names):
+    return {file_name:self.hash_file(file_name) for file_name in file_names}
+
+  def get_key(self,extractor_name:str,inputfile_name:str):
+    return extractor_name + ":" + inputfile_name
+
+  def is_unchanged(self,tasks):
+    # True when the previous run saw exactly the same inputs and its
+    # installed files are all still in place, i.e. there is nothing to do
+    if self.previous['inputs'] != self.current['inputs'] \
+       or self.previous['cql'] != self.current['cql'] \
+       or len(self.previous['workbooks']) != len(tasks):
+      return False
+    for extractor_name,inputfile_name in tasks:
+      key = self.get_key(extractor_name,inputfile_name)
+      if not key in self.previous['workbooks'] \
+         or self.previous['workbooks'][key]['hash'] != self.hash_file(inputfile_name):
+        return False
+    for file_path in self.previous['installed']:
+      if not os.path.exists(self.get_path(file_path)):
+        return False
+    return True
+
+  def get_cached_results(self,extractor_name:str,inputfile_name:str):
+    # returns the results of the previous extraction of an unchanged workbook, or None
+    key = self.get_key(extractor_name,inputfile_name)
+    if not key in self.previous['workbooks']:
+      return None
+    entry = self.previous['workbooks'][key]
+    if entry['hash'] != self.hash_file(inputfile_name):
+      return None
+    try:
+      with open(Path(self.get_path(self.cache_dir)) / entry['results'], 'rb') as file:
+        results = pickle.load(file)
+    except (IOError, pickle.UnpicklingError, EOFError) as e:
+      self.log("Could not load cached results for " + inputfile_name)
+      self.log(f"\tError: {e}")
+      return None
+    self.current['workbooks'][key] = entry
+    self.log("Reusing results of unchanged workbook " + inputfile_name)
+    return results
+
+  def record_results(self,extractor_name:str,inputfile_name:str,results:dict):
+    key = self.get_key(extractor_name,inputfile_name)
+    file_hash = self.hash_file(inputfile_name)
+    results_file = hashlib.sha256(key.encode()).hexdigest()[:16] + "-" + file_hash[:16] + ".pickle"
+    try:
+      Path(self.get_path(self.cache_dir)).mkdir(exist_ok=True, parents=True)
+      # the profile of the run that extracted the workbook is not reused
+      cached = dict(results,installer=dict(results['installer'],profile=None))
+      with open(Path(self.get_path(self.cache_dir)) / results_file, 'wb') as file:
+        pickle.dump(cached,file)
+    except IOError as e:
+      self.log("Could not cache results for " + inputfile_name)
+      self.log(f"\tError: {e}")
+      return False
+    artifacts = []
+    for dir,instances in results['installer']['resources'].items():
+      artifacts.extend("input/fsh/" + dir + "/" + id + ".fsh" for id in instances.keys())
+    artifacts.extend("input/dmn/" + id + ".dmn" for id in results['installer']['dmn_tables'].keys())
+    self.current['workbooks'][key] = {'hash':file_hash,
+                                      'results':results_file,
+                                      'artifacts':artifacts}
+    return True
+
+  def get_previously_installed(self):
+    return list(self.previous['installed'])
+
+  def record_installed(self,file_paths):
+    self.current['installed'] = sorted(set(str(file_path) for file_path in file_paths))
+
+  def log(self,*statements):
+    self.installer.log(*statements)
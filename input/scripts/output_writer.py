@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+# the umask can only be read by setting it, so it is read once at import
+# rather than while another thread (a concurrent run()) may be creating files
+process_umask = os.umask(0)
+os.umask(process_umask)
+
+class output_writer(object):
+  # Writes generated files only when their content differs from what is
+  # already on disk, so unchanged outputs keep their mtimes (and SUSHI, the IG
+  # Publisher and git status do not see them as modified).  Files are written
+  # to a temporary file in the target directory and renamed into place.
+
+  encoding = "utf-8"
+  file_mode = 0o666 & ~process_umask   # for new files, as open(...,"w") would have created them
+
+  def __init__(self):
+    self.written = []
+    self.unchanged = []
+    self.removed = []
+
+  def is_unchanged(self,file_path,data:bytes):
+    try:
+      if os.path.getsize(file_path) != len(data):
+        return False
+      with open(file_path, 'rb') as file:
+        return file.read() == data
+    except OSError:
+      return False
+
+  def write(self,file_path,content:str):
+    # returns True if the file was (re)written, False if it was already up to date
+    file_path = str(file_path)
+    data = content.encode(self.encoding)
+    if self.is_unchanged(file_path,data):
+      self.unchanged.append(file_path)
+      return False
+    directory = os.path.dirname(file_path) or "."
+    fd,temp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(file_path) + ".", suffix=".tmp")
+    try:
+      with os.fdopen(fd, 'wb') as file:
+        file.write(data)
+      os.chmod(temp_path,self.file_mode)
+      os.replace(temp_path,file_path)
+    except BaseException:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+      raise
+    self.written.append(file_path)
+    return True
+
+  def keep(self,file_path):
+    # record a file known to be up to date without comparing its content
+    self.unchanged.append(str(file_path))
+
+  def remove(self,file_path):
+    file_path = str(file_path)
+    try:
+      os.remove(file_path)
+    except FileNotFoundError:
+      return False
+    self.removed.append(file_path)
+    return True
+
+  def get_summary(self):
+    return "Output files: " + str(len(self.written)) + " written, " \
+      + str(len(self.unchanged)) + " unchanged, " + str(len(self.removed)) + " removed"
@@ -0,0 +1,125 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+class profiler(object):
+  # Stage timers for the extraction pipeline, e.g.
+  #   with self.installer.profiler.stage("load_tab"):
+  #     ...
+  # record the number of calls and the cumulative (inclusive) time of every
+  # stage per workbook, plus the bytes written by stages that write files.
+  # Every timed call is also kept as a Chrome trace event (chrome://tracing,
+  # Perfetto).  Counters such as cache hits are added with add_counts().
+  # When profiling is disabled stage() returns a shared no-op context
+  # manager.
+
+  null_stage = contextlib.nullcontext()
+
+  def __init__(self,enabled = False):
+    self.enabled = enabled
+    self.workbook = None   # workbook being extracted, set by the extractors
+    self.stats = {}        # (stage, workbook) -> {'count':..., 'seconds':..., 'bytes':...}
+    self.events = []
+    self.counters = {}     # name -> count
+    self.lock = threading.Lock()   # stages may be timed from several threads
+
+  def stage(self,name:str,workbook = None):
+    # the call is counted for workbook, by default the workbook being extracted
+    if not self.enabled:
+      return self.null_stage
+    return self.timer(name,workbook)
+
+  @contextlib.contextmanager
+  def timer(self,name:str,workbook = None):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.record(name,start,time.perf_counter(),workbook)
+
+  def get_entry(self,name:str,workbook):
+    key = (name,workbook)
+    if not key in self.stats:
+      self.stats[key] = {'count':0,'seconds':0.0,'bytes':0}
+    return self.stats[key]
+
+  def record(self,name:str,start:float,end:float,workbook = None):
+    workbook = workbook or self.workbook
+    event = {'name':name, 'cat':'stage', 'ph':'X',
+             'ts':start * 1e6, 'dur':(end - start) * 1e6,
+             'pid':os.getpid(), 'tid':threading.get_ident()}
+    if workbook is not None:
+      event['args'] = {'workbook':workbook}
+    with self.lock:
+      entry = self.get_entry(name,workbook)
+      entry['count'] += 1
+      entry['seconds'] += end - start
+      self.events.append(event)
+
+  def add_bytes(self,name:str,size:int,workbook = None):
+    # bytes are counted for workbook, by default the workbook being extracted
+    if self.enabled:
+      with self.lock:
+        self.get_entry(name,workbook or self.workbook)['bytes'] += size
+
+  def add_counts(self,counts:dict):
+    if self.enabled:
+      with self.lock:
+        for name,count in counts.items():
+          self.counters[name] = self.counters.get(name,0) + count
+
+  def get_results(self):
+    # picklable snapshot for handing the profile of a worker process to the parent
+    if not self.enabled:
+      return None
+    return {'stats':[(name,workbook,entry) for (name,workbook),entry in self.stats.items()],
+            'events':self.events,
+            'counters':self.counters}
+
+  def merge_results(self,results):
+    if not self.enabled or not results:
+      return
+    for name,workbook,other in results['stats']:
+      entry = self.get_entry(name,workbook)
+      for k in ['count','seconds','bytes']:
+        entry[k] += other[k]
+    self.events.extend(results['events'])
+    self.add_counts(results['counters'])
+
+  def get_totals(self):
+    # stage -> {'count':..., 'seconds':..., 'bytes':...} over all workbooks
+    totals = {}
+    for (name,workbook),entry in self.stats.items():
+      total = totals.setdefault(name,{'count':0,'seconds':0.0,'bytes':0})
+      for k in ['count','seconds','bytes']:
+        total[k] += entry[k]
+    return totals
+
+  def get_summary(self):
+    # one row per stage for all workbooks, followed by one row per workbook
+    totals = self.get_totals()
+    rows = []
+    for name in sorted(totals,key=lambda name: -totals[name]['seconds']):
+      rows.append((name,"(all)",totals[name]))
+      workbooks = [(workbook,entry) for (n,workbook),entry in self.stats.items() if n == name and workbook is not None]
+      if len(workbooks) > 1 or (len(workbooks) == 1 and workbooks[0][1]['count'] != totals[name]['count']):
+        for workbook,entry in sorted(workbooks,key=lambda w: -w[1]['seconds']):
+          rows.append(("",os.path.basename(workbook),entry))
+    lines = [f"{'Stage':<24} {'Workbook':<28} {'Count':>8} {'Total s':>10} {'Mean ms':>10} {'Bytes':>12}"]
+    for name,workbook,entry in rows:
+      mean = entry['seconds'] * 1000 / entry['count'] if entry['count'] else 0.0
+      lines.append(f"{name:<24} {workbook:<28} {entry['count']:>8} {entry['seconds']:>10.3f} {mean:>10.3f} {entry['bytes']:>12}")
+    if self.counters:
+      lines.append("")
+      lines.append(f"{'Counter':<53} {'Count':>8}")
+      for name in sorted(self.counters):
+        lines.append(f"{name:<53} {self.counters[name]:>8}")
+    return "\n".join(lines)
+
+  def save_trace(self,file_name:str):
+    Path(file_name).parent.mkdir(exist_ok=True, parents=True)
+    with open(file_name,'w') as file:
+      json.dump({'traceEvents':self.events,'displayTimeUnit':'ms'},file)
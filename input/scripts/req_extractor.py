@@ -1,10 +1,11 @@
 import os
-import glob
 import re
-import pandas as pd
 
 from extractor import extractor 
 from installer import installer
+from logger import logger
+from emitter import fsh_emitter
+from streaming_workbook import streaming_workbook
 
 class req_extractor(extractor):
 
@@ -12,7 +13,7 @@ class req_extractor(extractor):
     super().__init__(installer)
 
   def find_files(self):
-      return glob.glob("input/system-requirements/*xlsx")
+      return self.installer.find_input_files("input/system-requirements/*xlsx")
 
 
   # def usage():
@@ -28,6 +29,11 @@ class req_extractor(extractor):
   #   print("--help|h : print this information")
   #   sys.exit(2)
 
+  def new_workbook(self):
+    # requirement sheets are read once from top to bottom: stream their rows
+    # rather than loading them into data frames
+    return streaming_workbook(self.installer.get_input_path(self.inputfile_name))
+
   def get_aliases(self):
       return ['Alias: $pubStatus = http://hl7.org/fhir/publication-status',
                'Alias: $actorType = http://hl7.org/fhir/examplescenario-actor-type',
@@ -40,8 +46,7 @@ class req_extractor(extractor):
     try: 
       self.extract_resources()
     except ValueError as e:
-      self.log("Could not process: " +  self.inputfile_name + "\n" )
-      self.log(f"\tError: {e}")
+      self.diagnose(logger.ERROR,"Could not process: " +  self.inputfile_name + "\n" + f"\tError: {e}")
     
   
   def extract_resources(self):
@@ -53,10 +58,10 @@ class req_extractor(extractor):
         'so-that':["So that"]
         }
     sheet_names = ['Functional']
-    functional = self.retrieve_data_frame_by_headers(functional_column_maps,sheet_names)
+    functional = self.retrieve_rows_by_headers(functional_column_maps,sheet_names)
             
-    if (not  self.extract_functional_requirements(functional)):
-      self.log("Could not extract functional requirements from: " + self.inputfile_name)
+    if (not  self.extract_functional_requirements_to_resources(functional)):
+      self.diagnose(logger.WARN,"Could not extract functional requirements from: " + self.inputfile_name)
       return False        
     else:
         self.log("Could not find functional requirements in:" + self.inputfile_name) 
@@ -69,10 +74,10 @@ class req_extractor(extractor):
         'requirement':["Non-functional requirement","Non-functional requirements", "Nonfunctional requirements", "nonfunctional requirement"]
     }
     sheet_names = ['Non-Functional','Non-functional']
-    nonfunctional = self.retrieve_data_frame_by_headers(nonfunctional_column_maps,sheet_names)
+    nonfunctional = self.retrieve_rows_by_headers(nonfunctional_column_maps,sheet_names)
         
     if (not  self.extract_nonfunctional_requirements_to_resources(nonfunctional)):
-      self.log("Could not extract non-functional requirements from: " + self.inputfile_name)
+      self.diagnose(logger.WARN,"Could not extract non-functional requirements from: " + self.inputfile_name)
       return False        
     else:
       self.log("Could not find non-functional requirements in:" + self.inputfile_name)
@@ -82,168 +87,180 @@ class req_extractor(extractor):
 
         
 
-  def extract_nonfunctional_requirements_to_resources(nonfunctional:pd.DataFrame ):
+  def describe_row(self,row):
+    return "\tRow:\n" + "\n".join("\t\t" + k + "  " + str(v) for k,v in row._asdict().items())
+
+  def extract_nonfunctional_requirements_to_resources(self,nonfunctional):
+    # nonfunctional is an iterator of (index, row) from retrieve_rows_by_headers()
     self.log("Reading non-functional requirements")
-    nonfunctional.drop(index=0)
+    if nonfunctional is None:
+      return False
 
     categories={}
     cat_cs = 'FXREQCategories'
     classification = ""
     classification_codes = []
 
-    for index, row in nonfunctional.iterrows():
-        if not "reqid" in row or not isinstance(row["reqid"], str):
-            self.log("// skipping row "+str(index+1)+": no reqid")
+    index = 0
+    for index, row in nonfunctional:
+        if not isinstance(row.reqid, str):
+            self.debug("// skipping row "+str(index+1)+": no reqid")
             continue
-        reqid = self.name_to_id(row["reqid"])
+        reqid = self.name_to_id(row.reqid)
 
-        self.log("\tRow:\n" + "\t\t" + row.to_string().replace("\n", "\n\t\t"))
+        self.debug(lambda: self.describe_row(row))
 
 
         #check if this is setting up the classifications
-        if ( row["reqid"].strip().lower().startswith("classification of digital health interventions")):            
-            classification = row["reqid"].strip()
+        if ( row.reqid.strip().lower().startswith("classification of digital health interventions")):            
+            classification = row.reqid.strip()
             classification_codes = re.findall(r'\d+\.?\d*', classification )
-            self.log("\tFound classification text: " + classification)
-            self.log("\tFound classification codes: " , classification_codes)
+            self.debug("\tFound classification text: " + classification)
+            self.debug("\tFound classification codes: " , classification_codes)
             continue
 
 
-        if not "category" in row or not isinstance(row["category"], str):
-            self.log("// skipping row "+str(index+1)+": no category")
+        if not isinstance(row.category, str):
+            self.diagnose(logger.WARN,"\t*warning* skipping row "+str(index+1)+": no category",
+                          artifact=reqid,**self.get_row_location(index,'category'))
             continue        
-        if not "requirement" in row or not isinstance(row["requirement"], str):
-            self.log("// skipping row "+str(index+1)+": no requirement")
+        if not isinstance(row.requirement, str):
+            self.diagnose(logger.WARN,"\t*warning* skipping row "+str(index+1)+": no requirement",
+                          artifact=reqid,**self.get_row_location(index,'requirement'))
             continue        
         
-        cat = row["category"].strip()
+        cat = row.category.strip()
         catid = self.name_to_id(cat)
         categories[catid] = cat     #OK to overwrite existing
         
-        nfreq = row["requirement"].strip()
+        nfreq = row.requirement.strip()
 
 
         lm_id = "LM." + reqid 
-        lm = "Instance: " + self.escape(lm_id) + '\n'
-        lm += 'InstanceOf: NonFunctionalRequirement\n'
-        lm += 'Description: "' + self.escape(nfreq) + '"\n'
-        lm += 'Usage: #definition\n'
-        lm += '* id = "' + self.escape(lm_id) + '"\n'
-        lm += '* requirement = "' + self.escape(nfreq) + '"\n'
+        lm = fsh_emitter()
+        lm.instance(self.escape(lm_id),'NonFunctionalRequirement',
+                    description=lm.quote(self.escape(nfreq)),usage='#definition')
+        lm.rule('id',lm.quote(self.escape(lm_id)))
+        lm.rule('requirement',lm.quote(self.escape(nfreq)))
         if (catid):
-            lm += '* category = ' + self.escape(cat_cs) + '#' + self.escape(catid) + '\n'
+            lm.rule('category',self.escape(cat_cs) + '#' + self.escape(catid))
         for classification_code in classification_codes:
-            lm += '* classification[+] = ' + self.escape(class_cs) + '#' \
-                + self.escape(classification_code) + '\n'
+            lm.rule('classification[+]',self.escape(self.class_cs) + '#' + self.escape(classification_code))
 
 
         
-        instance = "//non-functional requirment instance generated from row " + str(index+1) + "\n"
-        instance += "Instance: " + reqid + "\n"
-        instance += "InstanceOf: SGRequirements\n"
-        instance += "Usage: #definition" + "\n"
-        instance += '* title = "' + self.escape(nfreq) + '"\n'
-        instance += '* status = $pubStatus#active\n'
-        instance += '* name = "' + self.escape(nfreq) + '"\n'
-        instance += '* publisher = "WHO"\n'
-        instance += '* experimental = true\n'
+        instance = fsh_emitter()
+        instance.comment("non-functional requirment instance generated from row " + str(index+1))
+        instance.instance(reqid,'SGRequirements',usage='#definition')
+        instance.rule('title',instance.quote(self.escape(nfreq)))
+        instance.rule('status','$pubStatus#active')
+        instance.rule('name',instance.quote(self.escape(nfreq)))
+        instance.rule('publisher','"WHO"')
+        instance.rule('experimental','true')
         if (catid):
-            instance += '* extension[classification][+].valueCoding = ' + self.escape(cat_cs) + '#' + self.escape(catid) + '\n'
+            instance.rule('extension[classification][+].valueCoding',self.escape(cat_cs) + '#' + self.escape(catid))
         for classification_code in classification_codes:
-            instance += '* extension[classification][+].valueCoding = ' + self.escape(class_cs) + '#' + self.escape(classification_code) + '\n'
+            instance.rule('extension[classification][+].valueCoding',self.escape(self.class_cs) + '#' + self.escape(classification_code))
         description = '*Category*: ' + self.escape(cat) + "\n" + self.escape(nfreq)
-        description = '* description = """\n' + description + '\n"""\n\n'
-        instance += description + "\n"
-        self.installer.add_resource('instances',lm_id,lm)
-        self.installer.add_resource('requirements',reqid, instance)
+        instance.rule('description',instance.triple_quote("\n" + description + "\n"))
+        instance.line().line()
+        source = self.get_source("Non-functional row " + str(index+1))
+        self.installer.add_resource('instances',lm_id,lm.getvalue(),source)
+        self.installer.add_resource('requirements',reqid,instance.getvalue(),source)
 
     self.log("Extracted " + str(index) + " functional requirement(s)")
 
-    self.installer.generate_cs_and_vs_from_dict(cat_cs,'Functional Requirement Categories',categories)
+    self.installer.generate_cs_and_vs_from_dict(cat_cs,'Functional Requirement Categories',categories,{})
     return True
 
 
         
 
-  def extract_functional_requirements_to_resources(functional: pd.DataFrame):
+  def extract_functional_requirements_to_resources(self,functional):
+    # functional is an iterator of (index, row) from retrieve_rows_by_headers()
     self.log("Reading functional requirements")
+    if functional is None:
+      return False
     businessprocess_code = ""
     businessprocess_name = ""
     businessprocess_codes = {}
     classification = ""
     classification_codes = []
     bpid = "FXREQBusinessProcesses"
-    
-    functional.drop(index=0)
 
-    for index, row in functional.iterrows():
-        if not "reqid" in row or not isinstance(row["reqid"], str):
-            self.log("// skipping row "+str(index+1)+": no reqid")
+    index = 0
+    for index, row in functional:
+        if not isinstance(row.reqid, str):
+            self.debug("// skipping row "+str(index+1)+": no reqid")
             continue
-        reqid = self.name_to_id(row["reqid"])
+        reqid = self.name_to_id(row.reqid)
 
-        self.log("\tRow:\n" + "\t\t" + row.to_string().replace("\n", "\n\t\t"))
+        self.debug(lambda: self.describe_row(row))
 
         #check if this is setting up the classifications
-        if ( row["reqid"].strip().lower().startswith("classification of digital health interventions")):            
-            classification = row["reqid"].strip()
+        if ( row.reqid.strip().lower().startswith("classification of digital health interventions")):            
+            classification = row.reqid.strip()
             classification_codes = re.findall(r'\d+\.?\d*', classification )
-            self.log("\tFound classification text: " + classification)
-            self.log("\tFound classification codes: " , classification_codes)
+            self.debug("\tFound classification text: " + classification)
+            self.debug("\tFound classification codes: " , classification_codes)
             continue
 
-        if ( row["reqid"].strip().lower().startswith("business process")):
-            businessprocess = row["reqid"].strip()[16:].strip()
-            self.log("\tFound business process row " + str(index+1) +  ": "+ businessprocess)
+        if ( row.reqid.strip().lower().startswith("business process")):
+            businessprocess = row.reqid.strip()[16:].strip()
+            self.debug("\tFound business process row " + str(index+1) +  ": "+ businessprocess)
             parts = businessprocess.split(":",2)
             if (len(parts) == 2):
                 businessprocess_code = parts[0].strip()
                 businessprocess_name = parts[1].strip()
-                self.log("\tFound business process code (" + businessprocess_code + ") associated to " + businessprocess_name )
+                self.debug("\tFound business process code (" + businessprocess_code + ") associated to " + businessprocess_name )
                 businessprocess_codes[businessprocess_code] = businessprocess_name
 
         if (businessprocess_code):
             reqid = reqid + "." + businessprocess_code
 
-        if not "activityid-and-name" in row or not isinstance(row["activityid-and-name"], str):
-            self.log("\t*warning* skipping row "+str(index+1)+": no activityid-and-name")
+        if not isinstance(row.activityid_and_name, str):
+            self.diagnose(logger.WARN,"\t*warning* skipping row "+str(index+1)+": no activityid-and-name",
+                          artifact=reqid,**self.get_row_location(index,'activityid-and-name'))
             continue
         
-        if not "as-a" in row or not isinstance(row["as-a"], str):
-            self.log("\t*warning* skipping row "+str(index+1)+": no as-a")
+        if not isinstance(row.as_a, str):
+            self.diagnose(logger.WARN,"\t*warning* skipping row "+str(index+1)+": no as-a",
+                          artifact=reqid,**self.get_row_location(index,'as-a'))
             continue
 
-        if not "i-want" in row or not isinstance(row["i-want"], str):
-            self.log("\t*warning* skipping row "+str(index+1)+": no i-want")
+        if not isinstance(row.i_want, str):
+            self.diagnose(logger.WARN,"\t*warning* skipping row "+str(index+1)+": no i-want",
+                          artifact=reqid,**self.get_row_location(index,'i-want'))
             continue
 
-        if not "so-that" in row or not isinstance(row["so-that"], str):
-            self.log("\t*warning* skipping row "+str(index+1)+": no so-that")
+        if not isinstance(row.so_that, str):
+            self.diagnose(logger.WARN,"\t*warning* skipping row "+str(index+1)+": no so-that",
+                          artifact=reqid,**self.get_row_location(index,'so-that'))
             continue
         
             
-        components = row["activityid-and-name"].split(".")
+        components = row.activityid_and_name.split(".")
         activityid = ".".join(components[:-1])
         activity_name = components[-1]
 
-        actor_name = row["as-a"].strip()
+        actor_name = row.as_a.strip()
         actor_id = self.name_to_lower_id(actor_name)
-        actor_instance = "Instance: " + self.escape(actor_id) + "\n"
-        actor_instance += "InstanceOf: $SGActor\n"
-        actor_instance += "Usage: #definition\n"
-        actor_instance += '* name = "' + self.escape(actor_name) + '"\n'
-        actor_instance += '* title = "' + self.escape(actor_name) + '"\n'
-        actor_instance += '* description = "Actor ' + self.escape(actor_name) + ' from Function Requirements"\n'
-        actor_instance += '* status = $pubStatus#active\n'
-        actor_instance += '* experimental = true\n'
-        actor_instance += '* publisher = "WHO"\n'
-        actor_instance += '* type = $actorType#person\n'        
-        self.installer.add_resource('actors',actor_id,actor_instance)  # ok to overwrite      
+        actor_instance = fsh_emitter()
+        actor_instance.instance(self.escape(actor_id),'$SGActor',usage='#definition')
+        actor_instance.rule('name',actor_instance.quote(self.escape(actor_name)))
+        actor_instance.rule('title',actor_instance.quote(self.escape(actor_name)))
+        actor_instance.rule('description',actor_instance.quote('Actor ' + self.escape(actor_name) + ' from Function Requirements'))
+        actor_instance.rule('status','$pubStatus#active')
+        actor_instance.rule('experimental','true')
+        actor_instance.rule('publisher','"WHO"')
+        actor_instance.rule('type','$actorType#person')
+        source = self.get_source("Functional row " + str(index+1))
+        self.installer.add_resource('actors',actor_id,actor_instance.getvalue(),source)  # ok to overwrite      
         actorlink='<a href="ActorDefinition-' + self.escape(actor_id) + '.html">' + self.escape(actor_name) +'</a>'
         
 
         description = 'Activity: ' + activity_name + ':\n' + \
-            "As a " + actorlink + ", I want to:\n>" + self.escape(row['i-want']) + '\n\nso that\n\n>' + self.escape(row['so-that'])
+            "As a " + actorlink + ", I want to:\n>" + self.escape(row.i_want) + '\n\nso that\n\n>' + self.escape(row.so_that)
         if (businessprocess_name):
             if (businessprocess_code):
                 description = "*Business process* (" + self.escape(businessprocess_code) + ") "  \
@@ -253,44 +270,40 @@ class req_extractor(extractor):
 
         
         lm_id = "LM." + reqid 
-        lm = "Instance: " + self.escape(lm_id) + '\n'
-        lm += 'InstanceOf: FunctionalRequirement\n'
-        lm += 'Description: """' + description + '"""\n'
-        lm += 'Usage: #definition\n'
-        lm += '* id = "' + self.escape(lm_id) + '"\n'
-        lm += '* activity = "' + self.escape(activity_name) + '"\n'
-        lm += '* actor[+] = Reference(' + self.escape(actor_id) + ')\n'
-        lm += '* capabilityString = "' + self.escape(row['i-want']) + '"\n'
-        lm += '* benefitString = "' + self.escape(row['so-that']) + '"\n'
+        lm = fsh_emitter()
+        lm.instance(self.escape(lm_id),'FunctionalRequirement',
+                    description=lm.triple_quote(description),usage='#definition')
+        lm.rule('id',lm.quote(self.escape(lm_id)))
+        lm.rule('activity',lm.quote(self.escape(activity_name)))
+        lm.rule('actor[+]','Reference(' + self.escape(actor_id) + ')')
+        lm.rule('capabilityString',lm.quote(self.escape(row.i_want)))
+        lm.rule('benefitString',lm.quote(self.escape(row.so_that)))
         if (businessprocess_code):
-            lm += '* classification[+] = ' + bpid + '#' + self.escape(businessprocess_code) + '\n'
+            lm.rule('classification[+]',bpid + '#' + self.escape(businessprocess_code))
         for classification_code in classification_codes:
-            lm += '* classification[+] = ' + self.escape(class_cs) + '#' \
-                + self.escape(classification_code) + '\n'
-        self.installer.add_resource('instances',lm_id,lm)
-
-        instance = "//functional requirment instance generated from row " + str(index+1) + "\n"
-        instance += "Instance: " + self.escape(reqid) + "\n"
-        instance += "InstanceOf: SGRequirements\n"
-        instance += "Usage: #definition" + "\n"
-        instance += '* title = "' + self.escape(activity_name) + '"\n'
-        instance += '* status = $pubStatus#active\n'
-        instance += '* name = "' + self.escape(activity_name) + '"\n'
-        instance += '* publisher = "WHO"\n'
-        instance += '* experimental = true\n'
-        instance += '* actor[+] = Canonical(' + self.escape(actor_id) + ')\n'
+            lm.rule('classification[+]',self.escape(self.class_cs) + '#' + self.escape(classification_code))
+        self.installer.add_resource('instances',lm_id,lm.getvalue(),source)
+
+        instance = fsh_emitter()
+        instance.comment("functional requirment instance generated from row " + str(index+1))
+        instance.instance(self.escape(reqid),'SGRequirements',usage='#definition')
+        instance.rule('title',instance.quote(self.escape(activity_name)))
+        instance.rule('status','$pubStatus#active')
+        instance.rule('name',instance.quote(self.escape(activity_name)))
+        instance.rule('publisher','"WHO"')
+        instance.rule('experimental','true')
+        instance.rule('actor[+]','Canonical(' + self.escape(actor_id) + ')')
         if (businessprocess_code):
-            instance += '* extension[classification][+].valueCoding = ' + bpid + '#' + self.escape(businessprocess_code) + '\n'
+            instance.rule('extension[classification][+].valueCoding',bpid + '#' + self.escape(businessprocess_code))
         for classification_code in classification_codes:
-            instance += '* extension[classification][+].valueCoding = ' + self.escape(class_cs) + '#' \
-                + self.escape(classification_code) + '\n'
-        instance += '* extension[userstory].extension[capability].valueString = "' + self.escape(row['i-want']) + '"\n'
-        instance += '* extension[userstory].extension[benefit].valueString = "' + self.escape(row['so-that']) + '"\n'
-        description = '* description = """\n' + description + '\n"""\n\n'
-        instance += description + "\n"
-        self.installer.add_resource('requirements',reqid,instance)
+            instance.rule('extension[classification][+].valueCoding',self.escape(self.class_cs) + '#' + self.escape(classification_code))
+        instance.rule('extension[userstory].extension[capability].valueString',instance.quote(self.escape(row.i_want)))
+        instance.rule('extension[userstory].extension[benefit].valueString',instance.quote(self.escape(row.so_that)))
+        instance.rule('description',instance.triple_quote("\n" + description + "\n"))
+        instance.line().line()
+        self.installer.add_resource('requirements',reqid,instance.getvalue(),source)
         
     self.log("Extracted " + str(index) + " functional requirement(s)")
-    self.log("Business Process Codes:\n\t" , businessprocess_codes)
-    self.installer.generate_cs_and_vs_from_dict(bpid,'Functional Requirements Business Processes',businessprocess_codes)
+    self.debug("Business Process Codes:\n\t" , businessprocess_codes)
+    self.installer.generate_cs_and_vs_from_dict(bpid,'Functional Requirements Business Processes',businessprocess_codes,{})
     return True
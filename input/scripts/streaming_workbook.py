@@ -0,0 +1,86 @@
+import collections
+import re
+from workbook import workbook
+
+class streaming_workbook(workbook):
+  # A workbook whose sheets are streamed row by row with openpyxl in
+  # read-only mode instead of being read into data frames, so memory stays
+  # roughly constant however many rows a sheet has.  Used for requirement
+  # workbooks, which are read once from top to bottom.
+  #
+  # Cell values are converted the way pd.read_excel converts them (whole
+  # floats become ints, blanks and the default NA strings become None) and
+  # rows are numbered as the rows of the data frame would be, so extraction
+  # gives the same result as from a data frame.
+
+  na_values = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+               '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+               'n/a', 'nan', 'null'}
+  field_pattern = re.compile('[^0-9a-zA-Z_]')
+
+  def __init__(self,inputfile_name:str):
+    self.inputfile_name = inputfile_name
+    import openpyxl
+    self.book = openpyxl.load_workbook(inputfile_name,read_only=True,data_only=True,keep_links=False)
+    self.sheets = {}
+    for sheet in self.book.worksheets:
+      # the dimensions recorded in the file are not always right
+      sheet.reset_dimensions()
+      self.sheets[sheet.title] = sheet
+
+  def close(self):
+    self.book.close()
+
+  def convert_cell(self,value):
+    if value is None:
+      return None
+    if isinstance(value,float):
+      if value != value:
+        return None
+      if value.is_integer():
+        return int(value)
+    elif isinstance(value,str) and value in self.na_values:
+      return None
+    return value
+
+  def is_blank_row(self,values):
+    return all(value is None or value == "" for value in values)
+
+  def get_header_row(self,sheet_name:str,header_row:int):
+    sheet = self.get_sheet(sheet_name)
+    if sheet is None:
+      return None
+    for values in sheet.iter_rows(min_row=header_row + 1,max_row=header_row + 1,values_only=True):
+      if self.is_blank_row(values):
+        return None
+      return self.get_column_names([self.convert_cell(value) for value in values])
+    return None
+
+  def get_row_type(self,columns):
+    # namedtuple with a field for each of columns, - and other characters
+    # not allowed in identifiers replaced by _: 'as-a' -> row.as_a
+    return collections.namedtuple('row',[self.field_pattern.sub('_',column) for column in columns])
+
+  def get_rows(self,sheet_name:str,header_row:int,column_map:dict):
+    # yields (index, row) for the rows below header_row, like
+    # DataFrame.iterrows() on the frame get_data_frame() would give.
+    # column_map maps header cells to the columns of row.
+    header = self.get_header_row(sheet_name,header_row)
+    if header is None:
+      raise ValueError("Header row " + str(header_row) + " is beyond the last row of sheet " + sheet_name)
+    positions = [i for i,column in enumerate(header) if column in column_map]
+    row_type = self.get_row_type([column_map[header[i]] for i in positions])
+    index = 0
+    blank_rows = 0
+    for values in self.get_sheet(sheet_name).iter_rows(min_row=header_row + 2,values_only=True):
+      # trailing blank rows are dropped, as pd.read_excel does
+      if self.is_blank_row(values):
+        blank_rows += 1
+        continue
+      for i in range(blank_rows):
+        yield (index,row_type(*[None] * len(positions)))
+        index += 1
+      blank_rows = 0
+      width = len(values)
+      yield (index,row_type(*[self.convert_cell(values[i]) if i < width else None for i in positions]))
+      index += 1
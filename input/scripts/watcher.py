@@ -0,0 +1,67 @@
+import os
+import stat
+import time
+
+class watcher(object):
+  # Polls the inputs of a DAK extraction for changes, for extract_dak.py
+  # --watch.  Polling needs nothing beyond the standard library and works the
+  # same on every platform and on network and container mounts, where change
+  # notifications are not always delivered.
+  #
+  # A change is only reported once the files have been quiet for a whole
+  # interval, so that a workbook being saved is not read half written.
+  # Editor lock and backup files (~$book.xlsx, .#rules.cql) are ignored.
+
+  watched_dirs = ["input/decision-logic","input/system-requirements","input/cql"]
+  watched_files = ["sushi-config.yaml"]
+
+  def __init__(self,input_root = "",interval = 1.0):
+    self.input_root = input_root
+    self.interval = interval
+    self.ignored = set()
+    self.snapshot = self.scan()
+
+  def get_paths(self):
+    paths = [os.path.normpath(path) for path in self.watched_files]
+    for dir in self.watched_dirs:
+      try:
+        names = os.listdir(os.path.join(self.input_root,dir))
+      except OSError:
+        continue
+      paths.extend(os.path.normpath(os.path.join(dir,name)) for name in sorted(names) if not name.startswith(("~",".","#")))
+    return paths
+
+  def scan(self):
+    # path relative to the input root -> (modification time, size)
+    files = {}
+    for path in self.get_paths():
+      if path in self.ignored:
+        continue
+      try:
+        info = os.stat(os.path.join(self.input_root,path))
+      except OSError:
+        continue
+      if stat.S_ISREG(info.st_mode):
+        files[path] = (info.st_mtime_ns,info.st_size)
+    return files
+
+  def ignore(self,paths):
+    # files the extraction writes itself, e.g. the generated CQL libraries
+    self.ignored = set(os.path.normpath(str(path)) for path in paths)
+    self.snapshot = {path:info for path,info in self.snapshot.items() if path not in self.ignored}
+
+  def get_changes(self):
+    current = self.scan()
+    changes = set(path for path in set(current) | set(self.snapshot) if current.get(path) != self.snapshot.get(path))
+    self.snapshot = current
+    return changes
+
+  def wait(self):
+    # blocks until files changed and returns the changed paths
+    changes = set()
+    while True:
+      time.sleep(self.interval)
+      changed = self.get_changes()
+      if len(changed) == 0 and len(changes) > 0:
+        return sorted(changes)
+      changes.update(changed)
@@ -0,0 +1,57 @@
+class workbook(object):
+  # A workbook session: the xlsx file is opened and parsed once, and the raw
+  # (header-less) grid of every sheet is kept in memory.  Header probing and
+  # tab loading then work on these grids instead of re-reading the file.
+
+  def __init__(self,inputfile_name:str):
+    self.inputfile_name = inputfile_name
+    import pandas as pd   # loaded with the first workbook, most of the start-up time of a run
+    # sheet_name=None reads all sheets in a single pass over the file
+    self.sheets = pd.read_excel(inputfile_name, sheet_name=None, header=None)
+
+  def close(self):
+    # the file is not kept open
+    pass
+
+  def get_sheet_names(self):
+    return list(self.sheets.keys())
+
+  def get_sheet(self,sheet_name:str):
+    # raw grid with integer row/column labels, as read_excel(header=None) gives
+    if not sheet_name in self.sheets:
+      return None
+    return self.sheets[sheet_name]
+
+  def get_header_row(self,sheet_name:str,header_row:int):
+    grid = self.get_sheet(sheet_name)
+    if grid is None or header_row >= len(grid.index):
+      return None
+    return self.get_column_names(grid.iloc[header_row].tolist())
+
+  def get_data_frame(self,sheet_name:str,header_row:int):
+    # equivalent of pd.read_excel(..., sheet_name=sheet_name, header=header_row)
+    # but sliced out of the in-memory grid
+    grid = self.get_sheet(sheet_name)
+    if grid is None:
+      raise KeyError("Worksheet named '" + str(sheet_name) + "' not found")
+    if header_row >= len(grid.index):
+      raise ValueError("Header row " + str(header_row) + " is beyond the last row of sheet " + sheet_name)
+    data_frame = grid.iloc[header_row + 1:].reset_index(drop=True)
+    data_frame.columns = self.get_column_names(grid.iloc[header_row].tolist())
+    return data_frame.infer_objects()
+
+  def get_column_names(self,header):
+    # mimic pandas naming of header cells: blanks become "Unnamed: i" and
+    # duplicates are suffixed with .1, .2, ...
+    names = []
+    seen = {}
+    for i,name in enumerate(header):
+      if name is None or (isinstance(name, float) and name != name):
+        name = "Unnamed: " + str(i)
+      if name in seen:
+        seen[name] += 1
+        name = str(name) + "." + str(seen[name])
+      else:
+        seen[name] = 0
+      names.append(name)
+    return names